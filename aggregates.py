@@ -0,0 +1,748 @@
+"""Материализованные агрегаты для API.
+
+    python3 aggregates.py refresh          # пересчитать команды, у которых изменились игры
+    python3 aggregates.py refresh --full   # пересчитать всё
+    python3 aggregates.py check            # сверить сохранённое с расчётом на лету
+    python3 aggregates.py pipeline         # то же, что refresh, параллельно по лигам
+
+Запускается после daily_update_db.sh. Заменяет неработающий update_auxiliary_data.py:
+  - team_games — завершённые матчи с точки зрения каждой команды (строка на
+    команду и матч): счёт, результат, дни отдыха, четверти. /api/last_games,
+    /api/team_averages и /api/team_rest_days читают её одним диапазоном
+    по (team_id, date) вместо home_team_id = ? OR away_team_id = ?;
+  - team_rolling_stats — средние команды за последние 5/10/20 игр,
+    /api/team_averages читает их одной строкой;
+  - h2h_season — личные встречи по (неупорядоченной паре команд, сезону):
+    id матчей и средние, /api/h2h, /api/h2h_averages и карточки матчей читают
+    их по ключу вместо выборки с OR на каждую пару. Сами матчи с названиями
+    команд и лиг и четвертями берутся из games по id при чтении.
+
+Пересчёт, изменивший хоть одну строку, увеличивает счётчик data_generation:
+по нему API сбрасывает кэш ответов (см. ingest_daily.py). Любую запись в
+завершённые игры и их четверти, кто бы её ни делал, триггеры отмечают сдвигом
+games_version; пересчёт запоминает в aggregates_source версию, с которой начал.
+Если games потом изменили без пересчёта, API видит расхождение и отвечает
+по games, пока агрегаты не пересчитают.
+
+pipeline делит пересчёт по лигам: команда относится к лиге своего последнего
+матча, пара — к лиге своих встреч. Лиги считаются в пуле процессов, каждый со
+своими read-only соединениями; строки всех лиг записываются одной транзакцией
+вместе со сдвигом поколения, время печатается по каждой лиге.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import api_server
+import team_stats
+
+ROLLING_WINDOWS = (5, 10, 20)
+
+SCHEMA = """
+-- одна строка: номер поколения данных для сброса кэша API
+CREATE TABLE IF NOT EXISTS data_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+-- одна строка: версия завершённых игр. Её сдвигают триггеры ниже при записи
+-- в колонки games и quarters, из которых считаются агрегаты, — в том числе
+-- daily_update_db.sh. Таблицу нельзя удалять, пока есть триггеры: запись в games упадёт
+CREATE TABLE IF NOT EXISTS games_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO games_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS games_version_insert AFTER INSERT ON games
+WHEN NEW.status = 'FT'
+BEGIN
+    UPDATE games_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS games_version_update AFTER UPDATE ON games
+WHEN (OLD.status = 'FT' OR NEW.status = 'FT')
+ AND (OLD.status IS NOT NEW.status OR OLD.date IS NOT NEW.date
+      OR OLD.home_team_id IS NOT NEW.home_team_id OR OLD.away_team_id IS NOT NEW.away_team_id
+      OR OLD.home_score IS NOT NEW.home_score OR OLD.away_score IS NOT NEW.away_score
+      OR OLD.league_id IS NOT NEW.league_id OR OLD.season IS NOT NEW.season)
+BEGIN
+    UPDATE games_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS games_version_delete AFTER DELETE ON games
+WHEN OLD.status = 'FT'
+BEGIN
+    UPDATE games_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS quarters_version_insert AFTER INSERT ON quarters
+WHEN (SELECT status FROM games WHERE id = NEW.game_id) = 'FT'
+BEGIN
+    UPDATE games_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS quarters_version_update AFTER UPDATE ON quarters
+WHEN ((SELECT status FROM games WHERE id = NEW.game_id) = 'FT'
+      OR (SELECT status FROM games WHERE id = OLD.game_id) = 'FT')
+ AND (OLD.game_id IS NOT NEW.game_id OR OLD.quarter_num IS NOT NEW.quarter_num
+      OR OLD.home_score IS NOT NEW.home_score OR OLD.away_score IS NOT NEW.away_score)
+BEGIN
+    UPDATE games_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS quarters_version_delete AFTER DELETE ON quarters
+WHEN (SELECT status FROM games WHERE id = OLD.game_id) = 'FT'
+BEGIN
+    UPDATE games_version SET version = version + 1 WHERE id = 1;
+END;
+
+-- одна строка: версия games_version, с которой начался последний пересчёт
+CREATE TABLE IF NOT EXISTS aggregates_source (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    games_version INTEGER NOT NULL,
+    refreshed_at TEXT NOT NULL
+);
+
+-- JSON средних крупный, поэтому обычная таблица с rowid, а не WITHOUT ROWID
+CREATE TABLE IF NOT EXISTS h2h_season (
+    team_low INTEGER NOT NULL,
+    team_high INTEGER NOT NULL,
+    season TEXT NOT NULL,
+    games_count INTEGER NOT NULL,
+    game_ids_json TEXT NOT NULL,
+    averages_json TEXT NOT NULL,
+    source_fingerprint TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (team_low, team_high, season)
+);
+
+CREATE TABLE IF NOT EXISTS team_games (
+    team_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    opponent_id INTEGER NOT NULL,
+    league_id INTEGER,
+    season TEXT,
+    is_home INTEGER NOT NULL,
+    team_score INTEGER,
+    opponent_score INTEGER,
+    result TEXT,
+    rest_days INTEGER,
+    q1 INTEGER, q2 INTEGER, q3 INTEGER, q4 INTEGER,
+    oq1 INTEGER, oq2 INTEGER, oq3 INTEGER, oq4 INTEGER,
+    PRIMARY KEY (team_id, date DESC, game_id)
+) WITHOUT ROWID;
+
+-- отпечаток SQL_TEAM_FINGERPRINTS, по которому записаны строки team_games команды
+CREATE TABLE IF NOT EXISTS team_games_source (
+    team_id INTEGER PRIMARY KEY,
+    source_fingerprint TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS team_rolling_stats (
+    team_id INTEGER NOT NULL,
+    window_size INTEGER NOT NULL,
+    games_count INTEGER NOT NULL,
+    avg_score REAL NOT NULL,
+    avg_opponent_score REAL NOT NULL,
+    avg_total REAL NOT NULL,
+    q1 REAL, q2 REAL, q3 REAL, q4 REAL,
+    h1 REAL, h2 REAL,
+    source_fingerprint TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (team_id, window_size)
+) WITHOUT ROWID;
+"""
+
+# Отпечаток завершённых игр команды: меняется, если добавилась игра,
+# поправили счёт или добавили, убрали или поправили четверть
+SQL_TEAM_FINGERPRINTS = """
+WITH game_quarters AS (
+    SELECT game_id, COUNT(*) as quarter_count,
+           TOTAL(quarter_num * 1000000 + COALESCE(home_score, -1) * 1000 + COALESCE(away_score, -1)) as quarter_points
+    FROM quarters
+    GROUP BY game_id
+)
+SELECT team_id,
+       COUNT(*) || '|' || MAX(date) || '|' || MAX(game_id) || '|' || TOTAL(points)
+       || '|' || TOTAL(quarter_count) || '|' || TOTAL(quarter_points) as fingerprint
+FROM (
+    SELECT g.home_team_id as team_id, g.id as game_id, g.date,
+           COALESCE(g.home_score, -1) * 1000 + COALESCE(g.away_score, -1) as points,
+           q.quarter_count, q.quarter_points
+    FROM games g LEFT JOIN game_quarters q ON q.game_id = g.id
+    WHERE g.status = 'FT'
+    UNION ALL
+    SELECT g.away_team_id as team_id, g.id as game_id, g.date,
+           COALESCE(g.away_score, -1) * 1000 + COALESCE(g.home_score, -1) as points,
+           q.quarter_count, q.quarter_points
+    FROM games g LEFT JOIN game_quarters q ON q.game_id = g.id
+    WHERE g.status = 'FT'
+)
+GROUP BY team_id
+"""
+
+# Отпечаток личных встреч пары за сезон (те же фильтры, что у /api/h2h)
+# со счётом и четвертями, из которых считаются средние, и лига пары
+# для разбиения pipeline по лигам
+SQL_H2H_FINGERPRINTS = """
+WITH game_quarters AS (
+    SELECT game_id, COUNT(*) as quarter_count,
+           TOTAL(quarter_num * 1000000 + COALESCE(home_score, -1) * 1000 + COALESCE(away_score, -1)) as quarter_points
+    FROM quarters
+    GROUP BY game_id
+)
+SELECT MIN(g.home_team_id, g.away_team_id) as team_low,
+       MAX(g.home_team_id, g.away_team_id) as team_high,
+       g.season,
+       COUNT(*) || '|' || MAX(g.date) || '|' || MAX(g.id) || '|'
+       || TOTAL(g.home_team_id * 1000000 + g.home_score * 1000 + g.away_score)
+       || '|' || TOTAL(q.quarter_count) || '|' || TOTAL(q.quarter_points) as fingerprint,
+       MIN(g.league_id) as league_id
+FROM games g
+LEFT JOIN game_quarters q ON q.game_id = g.id
+WHERE g.status = 'FT'
+  AND g.home_score IS NOT NULL
+  AND g.away_score IS NOT NULL
+GROUP BY team_low, team_high, g.season
+"""
+
+# Матчи сезонов для пересчёта h2h_season: строки в формате /api/h2h
+SQL_H2H_SEASON_GAMES = """
+SELECT g.*,
+       l.name as league_name,
+       t1.name as home_team_name,
+       t2.name as away_team_name
+FROM games g
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t1 ON g.home_team_id = t1.id
+JOIN teams t2 ON g.away_team_id = t2.id
+WHERE g.season IN ({placeholders})
+  AND g.status = 'FT'
+  AND g.home_score IS NOT NULL
+  AND g.away_score IS NOT NULL
+ORDER BY g.date DESC, g.id
+"""
+
+# Лига команды для pipeline — лига её последнего завершённого матча
+# (при MAX() SQLite берёт league_id из той же строки)
+SQL_TEAM_LEAGUES = """
+SELECT team_id, league_id, MAX(date) as last_date
+FROM (
+    SELECT home_team_id as team_id, league_id, date FROM games WHERE status = 'FT'
+    UNION ALL
+    SELECT away_team_id as team_id, league_id, date FROM games WHERE status = 'FT'
+)
+GROUP BY team_id
+"""
+
+TEAM_GAMES_COLUMNS = (
+    'team_id', 'date', 'game_id', 'opponent_id', 'league_id', 'season', 'is_home',
+    'team_score', 'opponent_score', 'result', 'rest_days',
+    'q1', 'q2', 'q3', 'q4', 'oq1', 'oq2', 'oq3', 'oq4'
+)
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA)
+
+
+def bump_generation(conn):
+    """Увеличить счётчик data_generation (в текущей транзакции); вернуть новое значение"""
+    conn.execute(
+        "INSERT INTO data_generation (id, generation, updated_at) VALUES (1, 1, ?) "
+        "ON CONFLICT(id) DO UPDATE SET generation = generation + 1, updated_at = excluded.updated_at",
+        (datetime.now().isoformat(timespec='seconds'),)
+    )
+    return conn.execute("SELECT generation FROM data_generation WHERE id = 1").fetchone()[0]
+
+
+def games_version(conn):
+    """Версия завершённых игр; снимается до пересчёта, чтобы игры, записанные
+    во время него, оставили агрегаты устаревшими до следующего запуска"""
+    return conn.execute("SELECT version FROM games_version WHERE id = 1").fetchone()[0]
+
+
+def _record_source(conn, version):
+    """Запомнить версию игр, по которой посчитаны агрегаты (в транзакции вызывающего)"""
+    conn.execute(
+        "INSERT OR REPLACE INTO aggregates_source (id, games_version, refreshed_at) VALUES (1, ?, ?)",
+        (version, datetime.now().isoformat(timespec='seconds'))
+    )
+
+
+def refresh_all(conn, full=False, touched=()):
+    """Пересчитать все агрегаты; вернуть {таблица: (обновлено, секунд)}.
+    touched — матчи (home_id, away_id, season), переписанные загрузкой.
+    Поколение данных сдвигает вызывающий, один раз на запуск."""
+    ensure_schema(conn)
+    version = games_version(conn)
+    refreshes = (
+        ('team_games', refresh_team_games),
+        ('team_rolling_stats', refresh_rolling),
+        ('h2h_season', refresh_h2h),
+    )
+    timings = {}
+    for table, refresh in refreshes:
+        started = time.perf_counter()
+        timings[table] = (refresh(conn, full, touched), time.perf_counter() - started)
+    with conn:
+        _record_source(conn, version)
+    return timings
+
+
+def _changed_teams(conn, full, touched=()):
+    """Команды, чьи игры изменились с прошлого пересчёта: {team_id: fingerprint}"""
+    current = dict(conn.execute(SQL_TEAM_FINGERPRINTS).fetchall())
+    if full:
+        return current
+    stored = dict(conn.execute(
+        "SELECT team_id, source_fingerprint FROM team_rolling_stats WHERE window_size = ?",
+        (ROLLING_WINDOWS[0],)
+    ).fetchall())
+    teams = _touched_teams(touched)
+    return {team_id: fp for team_id, fp in current.items() if stored.get(team_id) != fp or team_id in teams}
+
+
+def _touched_teams(touched):
+    """Команды матчей, переписанных загрузкой: touched — (home_id, away_id, season)"""
+    return {team_id for home_id, away_id, _ in touched for team_id in (home_id, away_id)}
+
+
+def _team_games_changed(conn, full=False, touched=()):
+    """Команды, чьи строки team_games нужно переписать (в том числе оставшиеся без игр):
+    {team_id: отпечаток или None, если завершённых игр не осталось}"""
+    current = dict(conn.execute(SQL_TEAM_FINGERPRINTS).fetchall())
+    stored = dict(conn.execute("SELECT team_id, source_fingerprint FROM team_games_source").fetchall())
+    teams = set(current) | set(stored) | {row[0] for row in conn.execute("SELECT DISTINCT team_id FROM team_games")}
+    if not full:
+        touched_teams = _touched_teams(touched)
+        teams = {t for t in teams if current.get(t) != stored.get(t) or t in touched_teams}
+    return {team_id: current.get(team_id) for team_id in teams}
+
+
+def refresh_team_games(conn, full=False, touched=()):
+    """Перезаписать строки team_games команд, чьи игры изменились; вернуть их число.
+    Строки считаются тем же движком team_stats, что и средние API.
+    touched — матчи (home_id, away_id, season), переписанные загрузкой: правку
+    одних четвертей отпечаток не видит."""
+    changed = _team_games_changed(conn, full, touched)
+    if not changed:
+        return 0
+
+    if full:
+        records = team_games_records(team_stats.team_games(*team_stats.load_frames(conn)), changed)
+    else:
+        records = _team_games_records(conn, sorted(changed))
+    with conn:
+        _write_team_games(conn, changed, records)
+    return len(changed)
+
+
+def team_games_records(frame, team_ids):
+    """Строки team_games команд (кортежи в порядке TEAM_GAMES_COLUMNS).
+    frame должен содержать всю историю этих команд: по ней считаются дни отдыха"""
+    frame['rest_days'] = team_stats.rest_days(frame)
+    rows = np.flatnonzero(np.isin(frame['team_id'], list(team_ids)))
+    columns = [frame[c][rows].tolist() for c in TEAM_GAMES_COLUMNS]
+    return [tuple(_sql_value(v) for v in values) for values in zip(*columns)]
+
+
+def _team_games_records(conn, team_ids):
+    """Строки team_games команд: история грузится только по ним, пачками
+    в пределах лимита параметров SQLite"""
+    records = []
+    chunk_size = api_server.SQL_MAX_VARIABLES // 2
+    for i in range(0, len(team_ids), chunk_size):
+        chunk = team_ids[i:i + chunk_size]
+        records += team_games_records(team_stats.team_games(*team_stats.load_frames(conn, team_ids=chunk)), chunk)
+    return records
+
+
+def _write_team_games(conn, changed, records):
+    """Заменить строки команд changed ({team_id: отпечаток}) на records
+    и запомнить отпечатки (в транзакции вызывающего)"""
+    placeholders = ', '.join('?' * len(TEAM_GAMES_COLUMNS))
+    conn.executemany("DELETE FROM team_games WHERE team_id = ?", [(t,) for t in changed])
+    conn.executemany("DELETE FROM team_games_source WHERE team_id = ?", [(t,) for t in changed])
+    conn.executemany(f"INSERT INTO team_games ({', '.join(TEAM_GAMES_COLUMNS)}) VALUES ({placeholders})", records)
+    conn.executemany(
+        "INSERT INTO team_games_source (team_id, source_fingerprint) VALUES (?, ?)",
+        [(t, fp) for t, fp in changed.items() if fp is not None]
+    )
+
+
+def _sql_value(value):
+    """Значение колонки движка для SQLite: NaN -> NULL, целые очки без .0"""
+    if isinstance(value, float):
+        return None if math.isnan(value) else int(value)
+    return value
+
+
+def _h2h_changed(conn, full=False, touched=()):
+    """Изменившиеся пары (team_low, team_high, season) и текущие {пара: (отпечаток, лига)}"""
+    current = {tuple(r[:3]): (r[3], r[4]) for r in conn.execute(SQL_H2H_FINGERPRINTS)}
+    stored = {tuple(r[:3]): r[3] for r in conn.execute(
+        "SELECT team_low, team_high, season, source_fingerprint FROM h2h_season"
+    )}
+    changed = {
+        key for key in set(current) | set(stored)
+        if full or current.get(key, (None,))[0] != stored.get(key)
+    }
+    changed |= {(min(h, a), max(h, a), season) for h, a, season in touched} & (set(current) | set(stored))
+    return changed, current
+
+
+def refresh_h2h(conn, full=False, touched=()):
+    """Пересчитать h2h_season для пар, чьи встречи изменились; вернуть число пар.
+    Затронутые сезоны читаются одним проходом, средние всех пар — одним вызовом движка."""
+    changed, current = _h2h_changed(conn, full, touched)
+    if not changed:
+        return 0
+
+    seasons = sorted({season for _, _, season in changed if season is not None})
+    pairs = {key: [] for key in changed if key in current}
+    for start in range(0, len(seasons), api_server.SQL_MAX_VARIABLES):
+        chunk = seasons[start:start + api_server.SQL_MAX_VARIABLES]
+        query = SQL_H2H_SEASON_GAMES.format(placeholders=api_server._placeholders(chunk))
+        for g in api_server._db_query(query, tuple(chunk)):
+            key = (min(g['home_team_id'], g['away_team_id']), max(g['home_team_id'], g['away_team_id']), g['season'])
+            if key in pairs:
+                pairs[key].append(g)
+    rows = h2h_rows(pairs, {key: current[key][0] for key in pairs})
+    with conn:
+        _write_h2h(conn, [key for key in changed if key not in pairs], rows)
+    return len(changed)
+
+
+def h2h_rows(pairs, fingerprints):
+    """Строки h2h_season из матчей пар {(team_low, team_high, season): [матч, ...]}
+    в порядке /api/h2h (четверти для средних подгружаются здесь)"""
+    api_server._attach_quarters(*pairs.values())
+    frame = team_stats.team_games(*team_stats.frames_from_rows(g for games in pairs.values() for g in games))
+    averages = team_stats.pairs_h2h_averages(frame, pairs)
+
+    updated_at = datetime.now().isoformat(timespec='seconds')
+    return [
+        (low, high, season, len(games), json.dumps([g['id'] for g in games]), json.dumps(averages[(low, high, season)]),
+         fingerprints[(low, high, season)], updated_at)
+        for (low, high, season), games in pairs.items()
+    ]
+
+
+def _write_h2h(conn, removed, rows):
+    """Удалить пары removed и записать rows (в транзакции вызывающего)"""
+    conn.executemany("DELETE FROM h2h_season WHERE team_low = ? AND team_high = ? AND season = ?", removed)
+    conn.executemany("INSERT OR REPLACE INTO h2h_season VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def compute_rolling(team_ids):
+    """Средние за окна ROLLING_WINDOWS тем же кодом, что и у API: {team_id: {'5': {...}, ...}}.
+    Окна — последние игры со счётом, как в /api/team_averages"""
+    histories = api_server._teams_last_games(team_ids, max(ROLLING_WINDOWS), scored=True)
+    api_server._attach_quarters(*histories.values())
+    rows = (g for games in histories.values() for g in games)
+    frame = team_stats.team_games(*team_stats.frames_from_rows(rows))
+    return team_stats.window_averages(frame, ROLLING_WINDOWS, team_ids)
+
+
+def refresh_rolling(conn, full=False, touched=()):
+    """Пересчитать team_rolling_stats для изменившихся команд; вернуть их число"""
+    changed = _changed_teams(conn, full, touched)
+    if not changed:
+        return 0
+
+    rows = rolling_rows(compute_rolling(list(changed)), changed)
+    with conn:
+        _write_rolling(conn, rows)
+    return len(changed)
+
+
+def rolling_rows(averages, fingerprints):
+    """Строки team_rolling_stats из средних compute_rolling и отпечатков команд"""
+    updated_at = datetime.now().isoformat(timespec='seconds')
+    rows = []
+    for team_id, by_window in averages.items():
+        for window, avg in by_window.items():
+            quarters = avg['quarters']
+            halves = avg['halves']
+            rows.append((
+                team_id, int(window), avg['games_count'],
+                avg['avg_score'], avg['avg_opponent_score'], avg['avg_total'],
+                quarters.get('q1'), quarters.get('q2'), quarters.get('q3'), quarters.get('q4'),
+                halves.get('h1'), halves.get('h2'),
+                fingerprints[team_id], updated_at
+            ))
+    return rows
+
+
+def _write_rolling(conn, rows):
+    conn.executemany(
+        "INSERT OR REPLACE INTO team_rolling_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+
+def _pipeline_init(db_path):
+    """Процесс пула: read-only соединения api_server к той же БД"""
+    api_server.DB_PATH = db_path
+
+
+def _pair_chunks(pairs):
+    """Пары (team_low, team_high, season) пачками, умещающимися в SQL_MAX_VARIABLES"""
+    chunk, teams, seasons = [], set(), set()
+    for pair in sorted(pairs, key=lambda p: (p[0], p[1], str(p[2]))):
+        low, high, season = pair
+        if chunk and 2 * len(teams | {low, high}) + len(seasons | {season}) > api_server.SQL_MAX_VARIABLES:
+            yield chunk
+            chunk, teams, seasons = [], set(), set()
+        chunk.append(pair)
+        teams |= {low, high}
+        seasons.add(season)
+    if chunk:
+        yield chunk
+
+
+def _pairs_games(pairs):
+    """Матчи личных встреч пар в формате /api/h2h (без четвертей): {пара: [матч, ...]}"""
+    games = {pair: [] for pair in pairs}
+    for chunk in _pair_chunks(pairs):
+        wanted = set(chunk)
+        teams = sorted({t for low, high, _ in chunk for t in (low, high)})
+        seasons = sorted({season for _, _, season in chunk}, key=str)
+        query = api_server.SQL_PAIRS_H2H.format(
+            teams=api_server._placeholders(teams), seasons=api_server._placeholders(seasons)
+        )
+        for g in api_server._db_query(query, tuple(teams) * 2 + tuple(seasons)):
+            key = (min(g['home_team_id'], g['away_team_id']), max(g['home_team_id'], g['away_team_id']), g['season'])
+            if key in wanted:
+                games[key].append(g)
+    return games
+
+
+def _pipeline_league(league_id, team_ids, rolling_fingerprints, h2h_fingerprints):
+    """Пересчитать команды и пары одной лиги в процессе пула (только чтение).
+    Возвращает строки трёх таблиц и время расчёта каждой"""
+    timings = {}
+    started = time.perf_counter()
+    records = _team_games_records(api_server._get_conn(), team_ids)
+    timings['team_games'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rolling = []
+    if rolling_fingerprints:
+        rolling = rolling_rows(compute_rolling(list(rolling_fingerprints)), rolling_fingerprints)
+    timings['team_rolling_stats'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    h2h = h2h_rows(_pairs_games(h2h_fingerprints), h2h_fingerprints) if h2h_fingerprints else []
+    timings['h2h_season'] = time.perf_counter() - started
+    api_server._release_conn()
+    return {
+        'league_id': league_id,
+        'teams': len(set(team_ids) | set(rolling_fingerprints)),
+        'pairs': len(h2h_fingerprints),
+        'timings': timings,
+        'rows': {'team_games': records, 'team_rolling_stats': rolling, 'h2h_season': h2h},
+    }
+
+
+def run_pipeline(conn, full=False, touched=(), workers=None):
+    """refresh_all, разбитый по лигам: изменившиеся команды и пары раскладываются
+    по лигам, лиги считаются в пуле из workers процессов (по умолчанию — по числу
+    CPU), результат пишется одной транзакцией со сдвигом поколения данных.
+    Возвращает {'leagues': {лига: {'teams', 'pairs', 'timings'}}, 'timings': {этап: секунды},
+    'updated': {таблица: число}, 'generation': новое поколение или None, 'workers': число}"""
+    ensure_schema(conn)
+    started = time.perf_counter()
+    version = games_version(conn)
+    team_games_changed = _team_games_changed(conn, full, touched)
+    rolling_changed = _changed_teams(conn, full, touched)
+    h2h_changed, h2h_current = _h2h_changed(conn, full, touched)
+    team_leagues = {row[0]: row[1] for row in conn.execute(SQL_TEAM_LEAGUES)}
+
+    tasks = {}
+    for team_id in sorted(team_games_changed):
+        # у команды без завершённых игр строки только удаляются
+        if team_id in team_leagues:
+            tasks.setdefault(team_leagues[team_id], ([], {}, {}))[0].append(team_id)
+    for team_id, fingerprint in rolling_changed.items():
+        tasks.setdefault(team_leagues.get(team_id), ([], {}, {}))[1][team_id] = fingerprint
+    for key in h2h_changed & set(h2h_current):
+        fingerprint, league_id = h2h_current[key]
+        tasks.setdefault(league_id, ([], {}, {}))[2][key] = fingerprint
+    timings = {'plan': time.perf_counter() - started}
+
+    started = time.perf_counter()
+    results = []
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks)))
+    if tasks:
+        # spawn: процессы пула не наследуют открытые соединения SQLite этого процесса
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_pipeline_init, initargs=(api_server.DB_PATH,)) as pool:
+            # крупные лиги первыми: мелкие добивают хвост на освободившихся процессах
+            order = sorted(tasks, key=lambda league_id: -sum(len(part) for part in tasks[league_id]))
+            futures = [pool.submit(_pipeline_league, league_id, *tasks[league_id]) for league_id in order]
+            results = [future.result() for future in futures]
+    timings['compute'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rows = {table: [row for result in results for row in result['rows'][table]]
+            for table in ('team_games', 'team_rolling_stats', 'h2h_season')}
+    updated = {
+        'team_games': len(team_games_changed),
+        'team_rolling_stats': len(rolling_changed),
+        'h2h_season': len(h2h_changed),
+    }
+    generation = None
+    with conn:
+        _write_team_games(conn, team_games_changed, rows['team_games'])
+        _write_rolling(conn, rows['team_rolling_stats'])
+        _write_h2h(conn, list(h2h_changed - set(h2h_current)), rows['h2h_season'])
+        _record_source(conn, version)
+        if any(updated.values()):
+            generation = bump_generation(conn)
+    timings['write'] = time.perf_counter() - started
+
+    leagues = {r['league_id']: {k: r[k] for k in ('teams', 'pairs', 'timings')} for r in results}
+    return {'leagues': leagues, 'timings': timings, 'updated': updated, 'generation': generation, 'workers': workers}
+
+
+def print_pipeline(conn, result):
+    """Таблица времени по лигам и итог run_pipeline"""
+    names = dict(conn.execute("SELECT id, name FROM leagues").fetchall())
+    tables = ('team_games', 'team_rolling_stats', 'h2h_season')
+    print(f"{'лига':<32}{'команд':>8}{'пар':>8}{'team_games':>12}{'rolling':>10}{'h2h':>10}{'всего, с':>10}")
+    leagues = sorted(result['leagues'].items(), key=lambda item: -sum(item[1]['timings'].values()))
+    for league_id, league in leagues:
+        name = f"{league_id} {names.get(league_id, '')}".strip()[:31]
+        t = league['timings']
+        print(f"{name:<32}{league['teams']:>8}{league['pairs']:>8}"
+              + ''.join(f"{t[table]:>{w}.2f}" for table, w in zip(tables, (12, 10, 10)))
+              + f"{sum(t.values()):>10.2f}")
+
+    timings = result['timings']
+    busy = sum(sum(league['timings'].values()) for league in result['leagues'].values())
+    print(f"План {timings['plan']:.2f} с, расчёт {timings['compute']:.2f} с "
+          f"({result['workers']} процессов, сумма по лигам {busy:.2f} с), запись {timings['write']:.2f} с")
+    for table, updated in result['updated'].items():
+        print(f"{table}: обновлено {updated}")
+    if result['generation'] is not None:
+        print(f"Поколение данных: {result['generation']}")
+
+
+def check_source(conn):
+    """Сверить версию игр последнего пересчёта с текущей; 1, если агрегаты устарели"""
+    stored = conn.execute("SELECT games_version, refreshed_at FROM aggregates_source WHERE id = 1").fetchone()
+    current = games_version(conn)
+    if stored is None or stored[0] != current:
+        print(f"  ≠ aggregates_source: пересчёт {stored[1] if stored else 'не записан'}, "
+              f"игры изменились после него (API отвечает по games)")
+        return 1
+    print(f"aggregates_source: пересчёт {stored[1]} по текущим играм")
+    return 0
+
+
+def check_team_games(conn):
+    """Сверить строки team_games с расчётом движка по games и quarters, а отпечатки
+    team_games_source — с текущими; вернуть число команд с расхождениями"""
+    current = dict(conn.execute(SQL_TEAM_FINGERPRINTS).fetchall())
+    sources = dict(conn.execute("SELECT team_id, source_fingerprint FROM team_games_source").fetchall())
+    expected, stored = {}, {}
+    for record in team_games_records(team_stats.team_games(*team_stats.load_frames(conn)), current):
+        expected.setdefault(record[0], set()).add(record)
+    for record in conn.execute(f"SELECT {', '.join(TEAM_GAMES_COLUMNS)} FROM team_games"):
+        stored.setdefault(record[0], set()).add(tuple(record))
+    mismatches = 0
+    for team_id in sorted(set(current) | set(stored) | set(sources)):
+        rows = expected.get(team_id, set()) ^ stored.get(team_id, set())
+        if rows or current.get(team_id) != sources.get(team_id):
+            mismatches += 1
+            print(f"  ≠ team_games, team {team_id}: строк расходится {len(rows)}, "
+                  f"отпечаток games {current.get(team_id)}, записан {sources.get(team_id)}")
+    print(f"team_games: команд {len(current)}, расхождений: {mismatches}")
+    return mismatches
+
+
+def check_rolling(conn):
+    """Сверить team_rolling_stats с расчётом /api/team_averages на лету; вернуть число расхождений"""
+    mismatches = 0
+    rows = conn.execute("SELECT team_id, window_size FROM team_rolling_stats ORDER BY team_id, window_size").fetchall()
+    for team_id, window in rows:
+        stored = api_server._rolling_payload(api_server._db_query(api_server.SQL_TEAM_ROLLING_STATS, (team_id, window))[0])
+        games = api_server._db_query(api_server.SQL_TEAM_SCORED_GAMES, (team_id,) * 5 + (window,))
+        api_server._attach_quarters(games)
+        expected = api_server._team_averages(team_id, games)
+        if stored != expected:
+            mismatches += 1
+            print(f"  ≠ team {team_id}, окно {window}:\n    сохранено {stored}\n    на лету   {expected}")
+    print(f"Проверено строк: {len(rows)}, расхождений: {mismatches}")
+    return mismatches
+
+
+def check_h2h(conn):
+    """Сверить h2h_season с выборкой /api/h2h и расчётом /api/h2h_averages на лету;
+    вернуть число расхождений"""
+    mismatches = 0
+    rows = conn.execute(
+        "SELECT team_low, team_high, season, game_ids_json, averages_json FROM h2h_season ORDER BY team_low, team_high, season"
+    ).fetchall()
+    for low, high, season, game_ids_json, averages_json in rows:
+        games = api_server._h2h_games(low, high, season)
+        api_server._attach_quarters(games)
+        expected = api_server._h2h_averages(low, games)
+        if json.loads(game_ids_json) != [g['id'] for g in games] or json.loads(averages_json) != expected:
+            mismatches += 1
+            print(f"  ≠ h2h {low}-{high}, {season}")
+    print(f"h2h_season: проверено пар {len(rows)}, расхождений: {mismatches}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['refresh', 'pipeline', 'check'])
+    parser.add_argument('--db', default=api_server.DB_PATH, help='путь к basketball.db')
+    parser.add_argument('--full', action='store_true', help='пересчитать все команды')
+    parser.add_argument('--workers', type=int, help='процессов pipeline (по умолчанию — число CPU)')
+    args = parser.parse_args()
+
+    api_server.DB_PATH = args.db
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.command == 'refresh':
+            # пустая team_games подменила бы API пустыми ответами, поэтому таблицы
+            # создаются только вместе с первым пересчётом, а не в check
+            timings = refresh_all(conn, args.full)
+            for table, (updated, seconds) in timings.items():
+                print(f"{table}: обновлено {updated} за {seconds:.2f} с")
+            if any(updated for updated, _ in timings.values()):
+                with conn:
+                    print(f"Поколение данных: {bump_generation(conn)}")
+            return 0
+        if args.command == 'pipeline':
+            print_pipeline(conn, run_pipeline(conn, args.full, workers=args.workers))
+            return 0
+
+        try:
+            return 1 if check_source(conn) + check_team_games(conn) + check_rolling(conn) + check_h2h(conn) else 0
+        except sqlite3.OperationalError as e:
+            print(f"Агрегатов нет ({e}): сначала python3 aggregates.py refresh")
+            return 1
+    finally:
+        api_server._release_conn()
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Метрики API: время запросов по маршрутам и фазам, SQL-запросы по отпечаткам.
+
+Отпечаток запроса — текст SQL без лишних пробелов, с числами и строками,
+заменёнными на ?, и списками IN (?, ?, ...) — на IN (...): запросы, которые
+отличаются только числом id в пачке, считаются одним. Счётчики живут в
+памяти процесса (у каждого воркера gunicorn — свои) и отдаются в текстовом
+формате Prometheus функцией render().
+"""
+import functools
+import hashlib
+import re
+import threading
+
+# Границы гистограмм: длительность запроса (секунды) и SQL-запросов на один запрос
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Длина текста запроса в метке query
+QUERY_LABEL_MAX = 160
+
+# Фазы запроса: соединение из пула, SQL, сериализация JSON, gzip; остальное — Python (app)
+PHASES = ('conn', 'db', 'json', 'gzip', 'app')
+
+_lock = threading.Lock()
+_routes = {}
+_queries = {}
+
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """(id, нормализованный текст) запроса"""
+    text = _SPACES.sub(' ', sql).strip()
+    text = _LITERALS.sub('?', text)
+    text = _IN_LIST.sub('IN (...)', text)
+    return hashlib.sha1(text.encode()).hexdigest()[:12], text
+
+
+def record_query(sql, seconds, rows):
+    """Учесть выполненный SQL-запрос; возвращает его отпечаток"""
+    fp, text = fingerprint(sql)
+    with _lock:
+        stats = _queries.get(fp)
+        if stats is None:
+            stats = _queries[fp] = {'query': text, 'count': 0, 'seconds': 0.0, 'rows': 0, 'max': 0.0}
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['rows'] += rows
+        stats['max'] = max(stats['max'], seconds)
+    return fp
+
+
+def record_request(route, status, seconds, phases, queries):
+    """Учесть HTTP-запрос: маршрут (шаблон URL), код, длительность, фазы и число SQL-запросов"""
+    with _lock:
+        stats = _routes.get(route)
+        if stats is None:
+            stats = _routes[route] = {
+                'count': 0, 'seconds': 0.0, 'buckets': [0] * len(REQUEST_BUCKETS), 'status': {},
+                'phases': dict.fromkeys(PHASES, 0.0), 'queries': 0, 'query_buckets': [0] * len(QUERIES_BUCKETS),
+            }
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['status'][status] = stats['status'].get(status, 0) + 1
+        stats['queries'] += queries
+        for phase, value in phases.items():
+            stats['phases'][phase] += value
+        _observe(stats['buckets'], REQUEST_BUCKETS, seconds)
+        _observe(stats['query_buckets'], QUERIES_BUCKETS, queries)
+
+
+def _observe(buckets, bounds, value):
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            buckets[i] += 1
+            break
+
+
+def server_timing(phases, total, queries, cache=None):
+    """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+    parts = []
+    for phase in PHASES:
+        value = phases.get(phase, 0.0)
+        if phase == 'db':
+            parts.append(f'db;dur={value * 1000:.2f};desc="{queries} queries"')
+        elif value:
+            parts.append(f'{phase};dur={value * 1000:.2f}')
+    if cache:
+        parts.append(f'cache;desc={cache}')
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _histogram(lines, name, labels, bounds, buckets, total, count):
+    cumulative = 0
+    for bound, n in zip(bounds, buckets):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+    lines.append(f'{name}_sum{{{labels}}} {total}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+
+
+def render(gauges=None):
+    """Все метрики в текстовом формате Prometheus.
+    gauges: {имя: (описание, значение)} — дополнительные показатели процесса"""
+    with _lock:
+        routes = {r: dict(s, status=dict(s['status']), phases=dict(s['phases'])) for r, s in _routes.items()}
+        queries = {fp: dict(s) for fp, s in _queries.items()}
+
+    lines = [
+        '# HELP api_request_duration_seconds Время обработки HTTP-запроса',
+        '# TYPE api_request_duration_seconds histogram',
+    ]
+    for route, s in sorted(routes.items()):
+        _histogram(lines, 'api_request_duration_seconds', f'route="{_label(route)}"',
+                   REQUEST_BUCKETS, s['buckets'], s['seconds'], s['count'])
+
+    lines += ['# HELP api_requests_total HTTP-запросы по коду ответа', '# TYPE api_requests_total counter']
+    for route, s in sorted(routes.items()):
+        for status, n in sorted(s['status'].items()):
+            lines.append(f'api_requests_total{{route="{_label(route)}",status="{status}"}} {n}')
+
+    lines += ['# HELP api_request_phase_seconds_total Время запросов по фазам', '# TYPE api_request_phase_seconds_total counter']
+    for route, s in sorted(routes.items()):
+        for phase in PHASES:
+            lines.append(f'api_request_phase_seconds_total{{route="{_label(route)}",phase="{phase}"}} {s["phases"][phase]}')
+
+    lines += ['# HELP api_request_sql_queries SQL-запросов на один HTTP-запрос', '# TYPE api_request_sql_queries histogram']
+    for route, s in sorted(routes.items()):
+        _histogram(lines, 'api_request_sql_queries', f'route="{_label(route)}"',
+                   QUERIES_BUCKETS, s['query_buckets'], s['queries'], s['count'])
+
+    for name, kind, help_text, key in (
+        ('api_sql_queries_total', 'counter', 'Выполнения SQL-запроса', 'count'),
+        ('api_sql_query_seconds_total', 'counter', 'Суммарное время SQL-запроса', 'seconds'),
+        ('api_sql_query_rows_total', 'counter', 'Строк вернул SQL-запрос', 'rows'),
+        ('api_sql_query_max_seconds', 'gauge', 'Самое долгое выполнение SQL-запроса', 'max'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for fp, s in sorted(queries.items()):
+            query = _label(s['query'][:QUERY_LABEL_MAX])
+            lines.append(f'{name}{{fingerprint="{fp}",query="{query}"}} {s[key]}')
+
+    for name, (help_text, value) in sorted((gauges or {}).items()):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
@@ -1,274 +1,1618 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, has_request_context, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from cachetools import TTLCache
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
 import sqlite3
-import pandas as pd
-from datetime import datetime, timedelta
+import threading
+import time
+import pyarrow as pa
+import api_metrics
+import game_snapshot
+import team_stats
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+class _TimedJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask, засекающий сериализацию для Server-Timing"""
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            _add_phase('json', time.perf_counter() - started)
 
 app = Flask(__name__)
-CORS(app)
+app.json = _TimedJSONProvider(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'Server-Timing'])
+
+# Путь к БД можно переопределить переменной окружения (бенчмарки, синтетические БД)
+DB_PATH = os.environ.get('BASKETBALL_DB', "/root/basketball_project/data/basketball.db")
+
+# Старые сборки SQLite ограничивают число параметров в запросе 999
+SQL_MAX_VARIABLES = 900
+
+# Пул соединений: сколько простаивающих соединений держать открытыми
+DB_POOL_SIZE = 16
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE_KB = 64 * 1024
+
+# Сколько секунд SQL-запросам одного HTTP-запроса (0 — без ограничения).
+# Запрос, не уложившийся в срок, прерывается и отдаёт 503, не занимая поток.
+# Выгрузка и live-поток читают уже после завершения запроса и не ограничиваются
+QUERY_TIMEOUT = float(os.environ.get('API_QUERY_TIMEOUT', 10))
+QUERY_PROGRESS_OPS = 10000
+
+# Лог медленных SQL-запросов: порог в миллисекундах (0 — выключен)
+SLOW_QUERY_MS = float(os.environ.get('API_SLOW_QUERY_MS', 0))
+
+# Прогрев воркера: соединений в пуле и максимум карточек сегодняшних матчей в кэше
+WARM_UP_CONNECTIONS = 8
+WARM_UP_MAX_CARDS = 200
+
+# Кэш ответов API: сбрасывается целиком при любой записи в БД,
+# TTL страхует значения, зависящие от текущей даты (дни отдыха)
+CACHE_MAX_ENTRIES = 4096
+CACHE_TTL = 3600
+
+# HTTP-кэширование: прошедшие даты почти не меняются, сегодняшние и будущие — часто.
+# Ответы больше GZIP_MIN_SIZE байт сжимаются, если клиент принимает gzip
+CACHE_CONTROL_PAST = 'public, max-age=86400'
+CACHE_CONTROL_CURRENT = 'public, max-age=30'
+CACHE_CONTROL_DEFAULT = 'public, max-age=60'
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+
+# Карточка матча: окна средних и число последних матчей в выдаче
+MATCH_CARD_WINDOWS = (5, 10)
+MATCH_CARD_LAST_GAMES = 5
+
+# Пакетные POST-запросы по командам: максимум команд, окон и размер окна/limit
+BATCH_MAX_TEAMS = 5000
+BATCH_MAX_WINDOWS = 10
+BATCH_MAX_SIZE = 100
+BATCH_DEFAULT_WINDOWS = (5, 10, 20)
+
+# Выгрузка истории: строк на страницу (по умолчанию и максимум) и в одной пачке fetchmany
+EXPORT_PAGE_SIZE = 50000
+EXPORT_MAX_PAGE_SIZE = 500000
+EXPORT_FETCH_SIZE = 2000
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Поток live-счёта (SSE): как часто проверять поколение данных, когда слать
+# keep-alive, сколько держать одно подключение (клиент переподключится сам)
+# и сколько снимков дня хранить общими для всех подписчиков
+STREAM_POLL_SECONDS = 2
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_MAX_SECONDS = 1800
+STREAM_RETRY_MS = 3000
+STREAM_CACHE_ENTRIES = 256
+
+# Снимок истории матчей в памяти (game_snapshot.py): последние матчи, средние,
+# дни отдыха и личные встречи считаются по массивам NumPy без запросов к SQLite.
+# Строится при прогреве воркера и заново в фоне после смены поколения данных;
+# пока строится — отвечает SQLite. У каждого воркера gunicorn свой снимок
+SNAPSHOT_ENABLED = os.environ.get('API_SNAPSHOT', '0') == '1'
+
+log = logging.getLogger(__name__)
+
+# Запросы эндпоинтов вынесены в константы, чтобы db_migrate.py мог
+# проверить их планы выполнения (EXPLAIN QUERY PLAN)
+SQL_LEAGUES = "SELECT DISTINCT id, name FROM leagues ORDER BY name"
+
+SQL_GAMES_BY_DATE = """
+SELECT g.*, 
+       l.name as league_name,
+       t1.name as home_team_name, t1.logo as home_team_logo,
+       t2.name as away_team_name, t2.logo as away_team_logo
+FROM games g
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t1 ON g.home_team_id = t1.id
+JOIN teams t2 ON g.away_team_id = t2.id
+WHERE g.date >= ? AND g.date < ?
+ORDER BY g.timestamp
+"""
+
+SQL_GAME_BY_ID = """
+SELECT g.*, 
+       l.name as league_name,
+       t1.name as home_team_name, t1.logo as home_team_logo,
+       t2.name as away_team_name, t2.logo as away_team_logo
+FROM games g
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t1 ON g.home_team_id = t1.id
+JOIN teams t2 ON g.away_team_id = t2.id
+WHERE g.id = ?
+"""
+
+SQL_QUARTERS_BY_GAME = "SELECT * FROM quarters WHERE game_id = ? ORDER BY quarter_num"
+
+SQL_QUARTERS_BY_GAMES = "SELECT * FROM quarters WHERE game_id IN ({placeholders}) ORDER BY game_id, quarter_num"
+
+SQL_LAST_GAMES = """
+SELECT g.*,
+       l.name as league_name,
+       CASE 
+           WHEN g.home_team_id = ? THEN t2.name
+           ELSE t1.name
+       END as opponent_name,
+       CASE 
+           WHEN g.home_team_id = ? THEN 'H'
+           ELSE 'A'
+       END as location,
+       CASE
+           WHEN g.home_team_id = ? AND g.home_score > g.away_score THEN 'W'
+           WHEN g.away_team_id = ? AND g.away_score > g.home_score THEN 'W'
+           WHEN g.status = 'FT' THEN 'L'
+           ELSE NULL
+       END as result
+FROM games g
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t1 ON g.home_team_id = t1.id
+JOIN teams t2 ON g.away_team_id = t2.id
+WHERE (g.home_team_id = ? OR g.away_team_id = ?)
+  AND g.status = 'FT'
+ORDER BY g.date DESC, g.id
+LIMIT ?
+"""
+
+SQL_H2H = """
+SELECT g.*,
+       l.name as league_name,
+       t1.name as home_team_name,
+       t2.name as away_team_name
+FROM games g
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t1 ON g.home_team_id = t1.id
+JOIN teams t2 ON g.away_team_id = t2.id
+WHERE ((g.home_team_id = ? AND g.away_team_id = ?)
+       OR (g.home_team_id = ? AND g.away_team_id = ?))
+  AND g.season = ?
+  AND g.status = 'FT'
+  AND g.home_score IS NOT NULL
+  AND g.away_score IS NOT NULL
+ORDER BY g.date DESC, g.id
+"""
+
+SQL_TEAM_SCORED_GAMES = """
+SELECT g.*,
+       CASE WHEN g.home_team_id = ? THEN g.home_score ELSE g.away_score END as team_score,
+       CASE WHEN g.home_team_id = ? THEN g.away_score ELSE g.home_score END as opponent_score,
+       CASE WHEN g.home_team_id = ? THEN 1 ELSE 0 END as is_home
+FROM games g
+WHERE (g.home_team_id = ? OR g.away_team_id = ?)
+  AND g.status = 'FT'
+  AND g.home_score IS NOT NULL
+  AND g.away_score IS NOT NULL
+ORDER BY g.date DESC, g.id
+LIMIT ?
+"""
+
+# Те же выборки по производной team_games (см. aggregates.py): строка на команду
+# и матч, один диапазон по первичному ключу (team_id, date) без OR и CASE
+SQL_TEAM_GAMES_LAST = """
+SELECT g.*,
+       l.name as league_name,
+       t.name as opponent_name,
+       CASE WHEN tg.is_home THEN 'H' ELSE 'A' END as location,
+       tg.result
+FROM team_games tg
+JOIN games g ON g.id = tg.game_id
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t ON t.id = tg.opponent_id
+WHERE tg.team_id = ?
+ORDER BY tg.date DESC, tg.game_id
+LIMIT ?
+"""
+
+SQL_TEAM_GAMES_SCORED = """
+SELECT *
+FROM team_games
+WHERE team_id = ?
+  AND team_score IS NOT NULL
+  AND opponent_score IS NOT NULL
+ORDER BY date DESC, game_id
+LIMIT ?
+"""
+
+SQL_TEAM_GAMES_LAST_DATE = """
+SELECT MAX(date) as last_game_date
+FROM team_games
+WHERE team_id = ?
+"""
+
+SQL_TEAM_ROLLING_STATS = """
+SELECT *
+FROM team_rolling_stats
+WHERE team_id = ? AND window_size = ?
+"""
+
+SQL_TEAM_LAST_GAME_DATE = """
+SELECT MAX(date) as last_game_date
+FROM games
+WHERE (home_team_id = ? OR away_team_id = ?)
+  AND status = 'FT'
+"""
+
+# Пакетные запросы для карточек всего дня: {placeholders} подставляется по числу параметров
+SQL_TEAMS_RECENT_GAME_IDS = """
+SELECT team_id, game_id
+FROM (
+    SELECT team_id, game_id,
+           ROW_NUMBER() OVER (PARTITION BY team_id ORDER BY date DESC, game_id) as rn
+    FROM (
+        SELECT home_team_id as team_id, id as game_id, date
+        FROM games
+        WHERE home_team_id IN ({placeholders}) AND status = 'FT'
+        UNION ALL
+        SELECT away_team_id as team_id, id as game_id, date
+        FROM games
+        WHERE away_team_id IN ({placeholders}) AND status = 'FT'
+    )
+)
+WHERE rn <= ?
+ORDER BY team_id, rn
+"""
+
+# То же только по играм с итоговым счётом: из них собираются окна средних
+SQL_TEAMS_RECENT_SCORED_GAME_IDS = """
+SELECT team_id, game_id
+FROM (
+    SELECT team_id, game_id,
+           ROW_NUMBER() OVER (PARTITION BY team_id ORDER BY date DESC, game_id) as rn
+    FROM (
+        SELECT home_team_id as team_id, id as game_id, date
+        FROM games
+        WHERE home_team_id IN ({placeholders}) AND status = 'FT'
+          AND home_score IS NOT NULL AND away_score IS NOT NULL
+        UNION ALL
+        SELECT away_team_id as team_id, id as game_id, date
+        FROM games
+        WHERE away_team_id IN ({placeholders}) AND status = 'FT'
+          AND home_score IS NOT NULL AND away_score IS NOT NULL
+    )
+)
+WHERE rn <= ?
+ORDER BY team_id, rn
+"""
+
+# Пакетные эндпоинты по командам: средние из team_rolling_stats и дата последнего
+# матча — по team_games, а пока её нет — по games (две ветки UNION ALL по индексам)
+SQL_TEAMS_ROLLING_STATS = """
+SELECT *
+FROM team_rolling_stats
+WHERE team_id IN ({teams}) AND window_size IN ({windows})
+"""
+
+SQL_TEAMS_GAMES_LAST_DATE = """
+SELECT team_id, MAX(date) as last_game_date
+FROM team_games
+WHERE team_id IN ({placeholders})
+GROUP BY team_id
+"""
+
+SQL_TEAMS_LAST_GAME_DATE = """
+SELECT team_id, MAX(date) as last_game_date
+FROM (
+    SELECT home_team_id as team_id, date
+    FROM games
+    WHERE home_team_id IN ({placeholders}) AND status = 'FT'
+    UNION ALL
+    SELECT away_team_id as team_id, date
+    FROM games
+    WHERE away_team_id IN ({placeholders}) AND status = 'FT'
+)
+GROUP BY team_id
+"""
+
+SQL_GAMES_BY_IDS = """
+SELECT g.*,
+       l.name as league_name,
+       t1.name as home_team_name,
+       t2.name as away_team_name
+FROM games g
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t1 ON g.home_team_id = t1.id
+JOIN teams t2 ON g.away_team_id = t2.id
+WHERE g.id IN ({placeholders})
+"""
+
+SQL_PAIRS_H2H = """
+SELECT g.*,
+       l.name as league_name,
+       t1.name as home_team_name,
+       t2.name as away_team_name
+FROM games g
+JOIN leagues l ON g.league_id = l.id
+JOIN teams t1 ON g.home_team_id = t1.id
+JOIN teams t2 ON g.away_team_id = t2.id
+WHERE g.home_team_id IN ({teams})
+  AND g.away_team_id IN ({teams})
+  AND g.season IN ({seasons})
+  AND g.status = 'FT'
+  AND g.home_score IS NOT NULL
+  AND g.away_score IS NOT NULL
+ORDER BY g.date DESC, g.id
+"""
+
+SQL_H2H_GAMES = """
+SELECT g.*
+FROM games g
+WHERE ((g.home_team_id = ? AND g.away_team_id = ?)
+       OR (g.home_team_id = ? AND g.away_team_id = ?))
+  AND g.season = ?
+  AND g.status = 'FT'
+  AND g.home_score IS NOT NULL
+  AND g.away_score IS NOT NULL
+ORDER BY g.date DESC, g.id
+"""
+
+# Предрасчитанные личные встречи (см. aggregates.py): пары подставляются
+# списками по колонкам, точные ключи отбираются в Python
+SQL_H2H_STORE = """
+SELECT team_low, team_high, season, game_ids_json, averages_json
+FROM h2h_season
+WHERE team_low IN ({lows})
+  AND team_high IN ({highs})
+  AND season IN ({seasons})
+"""
+
+# Выгрузка игр с четвертями в одну строку: страница — диапазон id (keyset),
+# {filters} — условия по лиге/сезону/датам
+SQL_EXPORT_GAMES = """
+SELECT g.id, g.league_id, g.season, g.date, g.timestamp, g.status,
+       g.home_team_id, g.away_team_id, g.home_score, g.away_score,
+       MAX(CASE WHEN q.quarter_num = 1 THEN q.home_score END) as q1_home,
+       MAX(CASE WHEN q.quarter_num = 1 THEN q.away_score END) as q1_away,
+       MAX(CASE WHEN q.quarter_num = 2 THEN q.home_score END) as q2_home,
+       MAX(CASE WHEN q.quarter_num = 2 THEN q.away_score END) as q2_away,
+       MAX(CASE WHEN q.quarter_num = 3 THEN q.home_score END) as q3_home,
+       MAX(CASE WHEN q.quarter_num = 3 THEN q.away_score END) as q3_away,
+       MAX(CASE WHEN q.quarter_num = 4 THEN q.home_score END) as q4_home,
+       MAX(CASE WHEN q.quarter_num = 4 THEN q.away_score END) as q4_away
+FROM games g
+LEFT JOIN quarters q ON q.game_id = g.id
+WHERE g.id > ? AND g.id <= ?{filters}
+GROUP BY g.id
+ORDER BY g.id
+"""
+
+# Последний id страницы: ключ следующего курсора
+SQL_EXPORT_PAGE_END = """
+SELECT MAX(id) as page_end, COUNT(*) as games
+FROM (
+    SELECT g.id
+    FROM games g
+    WHERE g.id > ?{filters}
+    ORDER BY g.id
+    LIMIT ?
+)
+"""
+
+EXPORT_SCHEMA = pa.schema(
+    [('id', pa.int64()), ('league_id', pa.int64()), ('season', pa.string()), ('date', pa.string()),
+     ('timestamp', pa.int64()), ('status', pa.string()),
+     ('home_team_id', pa.int64()), ('away_team_id', pa.int64()),
+     ('home_score', pa.int64()), ('away_score', pa.int64())]
+    + [(f'q{n}_{side}', pa.int64()) for n in range(1, 5) for side in ('home', 'away')]
+)
+
+SQL_DATA_GENERATION = "SELECT generation FROM data_generation WHERE id = 1"
+
+# Агрегаты актуальны, если версия завершённых игр (её сдвигают триггеры aggregates.py
+# при записи в games и quarters) не менялась с последнего пересчёта
+SQL_AGGREGATES_CURRENT = """
+SELECT s.games_version = v.version as current
+FROM aggregates_source s
+JOIN games_version v ON v.id = s.id
+WHERE s.id = 1
+"""
+
+_pool = queue.LifoQueue()
+_pool_lock = threading.Lock()
+_pool_stats = {'created': 0, 'reused': 0, 'in_use': 0, 'closed': 0}
+_local = threading.local()
+_wal_checked = False
+
+class QueryTimeout(Exception):
+    """SQL-запросы HTTP-запроса не уложились в QUERY_TIMEOUT"""
+
+def _ensure_wal():
+    """Перевести БД в WAL, чтобы ночное обновление не блокировало читателей.
+    Режим сохраняется в самом файле БД, поэтому достаточно одного раза."""
+    global _wal_checked
+    if _wal_checked:
+        return
+    _wal_checked = True
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        try:
+            if conn.execute("PRAGMA journal_mode").fetchone()[0] != 'wal':
+                conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.warning("Не удалось включить WAL для %s: %s", DB_PATH, e)
+
+def _connect():
+    """Открыть read-only соединение с настройками под чтение"""
+    _ensure_wal()
+    uri = Path(DB_PATH).absolute().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.set_progress_handler(_query_interrupt, QUERY_PROGRESS_OPS)
+    return conn
+
+def _query_interrupt():
+    """Progress handler SQLite: ненулевой ответ прерывает запрос после срока текущего HTTP-запроса"""
+    deadline = getattr(_local, 'deadline', None)
+    return 1 if deadline is not None and time.monotonic() > deadline else 0
 
-DB_PATH = "/root/basketball_project/data/basketball.db"
+def _get_conn():
+    """Соединение текущего потока: берётся из пула и закрепляется до конца запроса"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    
+    started = time.perf_counter()
+    try:
+        conn = _pool.get_nowait()
+        reused = True
+    except queue.Empty:
+        conn = _connect()
+        reused = False
+    _add_phase('conn', time.perf_counter() - started)
+    
+    with _pool_lock:
+        _pool_stats['reused' if reused else 'created'] += 1
+        _pool_stats['in_use'] += 1
+    _local.conn = conn
+    return conn
+
+def _release_conn():
+    """Вернуть соединение текущего потока в пул"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    
+    with _pool_lock:
+        _pool_stats['in_use'] -= 1
+        keep = _pool.qsize() < DB_POOL_SIZE
+        if not keep:
+            _pool_stats['closed'] += 1
+    if keep:
+        _pool.put(conn)
+    else:
+        conn.close()
+
+def _pool_info():
+    """Статистика пула соединений"""
+    with _pool_lock:
+        info = dict(_pool_stats)
+    info['idle'] = _pool.qsize()
+    info['max_idle'] = DB_POOL_SIZE
+    return info
+
+@app.before_request
+def _start_request():
+    _local.deadline = time.monotonic() + QUERY_TIMEOUT if QUERY_TIMEOUT > 0 else None
+    _local.timing = {'started': time.perf_counter(), 'phases': {}, 'queries': 0, 'cache': None}
+
+@app.after_request
+def _finish_request(response):
+    """Server-Timing и метрики запроса; у потоковых ответов — только до начала потока"""
+    timing = getattr(_local, 'timing', None)
+    if timing is None:
+        return response
+    total = time.perf_counter() - timing['started']
+    phases = timing['phases']
+    phases['app'] = max(0.0, total - sum(phases.values()))
+    response.headers['Server-Timing'] = api_metrics.server_timing(phases, total, timing['queries'], timing['cache'])
+    response.headers['Timing-Allow-Origin'] = '*'
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    api_metrics.record_request(route, response.status_code, total, phases, timing['queries'])
+    return response
+
+@app.teardown_request
+def _teardown_db(exc):
+    _local.deadline = None
+    _local.timing = None
+    _release_conn()
+
+def _add_phase(phase, seconds):
+    """Добавить время к фазе текущего HTTP-запроса (вне запроса — ничего)"""
+    timing = getattr(_local, 'timing', None)
+    if timing is not None:
+        timing['phases'][phase] = timing['phases'].get(phase, 0.0) + seconds
+
+@app.errorhandler(QueryTimeout)
+def _query_timeout(e):
+    log.warning("%s %s: %s", request.method, request.path, e)
+    return jsonify({'error': 'query timeout'}), 503
 
 def _db_query(query, params=()):
     """Выполнить SQL запрос и вернуть результат как список словарей"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute(query, params)
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
+    conn = _get_conn()
+    started = time.perf_counter()
+    try:
+        rows = [dict(r) for r in conn.execute(query, params).fetchall()]
+    except sqlite3.OperationalError:
+        # Прерывание по сроку — отдельное исключение, чтобы его не приняли
+        # за отсутствие производной таблицы и не повторили запрос к games
+        if _query_interrupt():
+            raise QueryTimeout(f"запросы дольше {QUERY_TIMEOUT:g} с")
+        raise
+    _record_query(query, params, time.perf_counter() - started, len(rows))
     return rows
 
+def _record_query(query, params, seconds, rows):
+    """Учесть SQL-запрос в метриках и Server-Timing; медленный — записать в лог"""
+    fp = api_metrics.record_query(query, seconds, rows)
+    timing = getattr(_local, 'timing', None)
+    if timing is not None:
+        timing['queries'] += 1
+        timing['phases']['db'] = timing['phases'].get('db', 0.0) + seconds
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        log.warning(
+            "Медленный запрос %.1f мс, строк %d, %s [%s]: %s; параметры %.200r",
+            seconds * 1000, rows, request.path if has_request_context() else '-',
+            fp, api_metrics.fingerprint(query)[1][:300], params
+        )
+
+class _ResponseCache(TTLCache):
+    """TTL/LRU-кэш, считающий вытеснения (popitem вызывается только при переполнении)"""
+    def popitem(self):
+        _cache_stats['evictions'] += 1
+        return super().popitem()
+
+_cache = _ResponseCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+_cache_generation = None
+_aggregates_checked = (None, False)
+
+def _data_generation():
+    """Поколение данных: счётчик data_generation (его сдвигают ingest_daily.py и
+    aggregates.py), размер и mtime файла БД и его WAL. Счётчик гарантирует сброс
+    после загрузки, даже если mtime не успел смениться; файлы ловят запись
+    сторонними скриптами. Одинаково во всех процессах, читающих файл.
+    Пустой WAL не учитывается: SQLite создаёт его заново при открытии соединений."""
+    _ensure_wal()
+    parts = []
+    try:
+        conn = _get_conn()
+        started = time.perf_counter()
+        row = conn.execute(SQL_DATA_GENERATION).fetchone()
+        _record_query(SQL_DATA_GENERATION, (), time.perf_counter() - started, 1 if row else 0)
+        parts.append(f"g{row[0] if row else 0}")
+    except sqlite3.OperationalError:
+        pass
+    for path in (DB_PATH, DB_PATH + '-wal'):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if st.st_size:
+            parts.append(f"{st.st_mtime_ns:x}-{st.st_size:x}")
+    return '.'.join(parts)
+
+def _cache_lookup(key, generation):
+    """Значение из кэша или None; при смене поколения данных кэш очищается"""
+    global _cache, _cache_generation
+    with _cache_lock:
+        if generation != _cache_generation:
+            if _cache_generation is not None:
+                _cache_stats['invalidations'] += 1
+            _cache = _ResponseCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+            _cache_generation = generation
+        value = _cache.get(key)
+        _cache_stats['hits' if value is not None else 'misses'] += 1
+        return value
+
+def _cache_store(key, value, generation):
+    """Сохранить ответ, посчитанный по поколению generation. Если данные успели
+    смениться и кэш уже сброшен под новое поколение, ответ по старым данным
+    не сохраняется: иначе он отдавался бы с ETag нового поколения до CACHE_TTL"""
+    with _cache_lock:
+        if generation == _cache_generation:
+            _cache[key] = value
+
+def _cache_info():
+    """Статистика кэша ответов"""
+    with _cache_lock:
+        info = dict(_cache_stats)
+        info['size'] = _cache.currsize
+    info['max_size'] = CACHE_MAX_ENTRIES
+    info['ttl'] = CACHE_TTL
+    info['generation'] = _cache_generation
+    return info
+
+def _etag(key, generation):
+    """Сильный ETag: поколение данных + аргументы + сегодняшняя дата (от неё зависят дни отдыха)"""
+    raw = f"{generation}|{datetime.now():%Y-%m-%d}|{key!r}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:24]
+
+def _cache_control(kwargs):
+    """Cache-Control: для дат раньше вчерашней — надолго, для вчерашних, сегодняшних
+    и будущих — коротко. Даты игр в UTC, и вчерашние игры ещё переписывает
+    обновление в 05:00 МСК, поэтому граница — вчера по UTC, а не по часам сервера"""
+    date = kwargs.get('date')
+    if date is None:
+        return CACHE_CONTROL_DEFAULT
+    if date < (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d'):
+        return CACHE_CONTROL_PAST
+    return CACHE_CONTROL_CURRENT
+
+def _cached_endpoint(view):
+    """Кэшировать готовое JSON-тело ответа эндпоинта по его аргументам.
+    Заодно отдаёт gzip, если клиент его принимает, и отвечает 304 на If-None-Match —
+    только по ETag того представления, которое получил бы этот запрос."""
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        key = (view.__name__,) + tuple(sorted(kwargs.items()))
+        generation = _data_generation()
+        etag = _etag(key, generation)
+        headers = {'Cache-Control': _cache_control(kwargs), 'Vary': 'Accept-Encoding'}
+        
+        entry = _cache_lookup(key, generation)
+        _local.timing['cache'] = 'miss' if entry is None else 'hit'
+        if entry is None:
+            response = app.make_response(view(**kwargs))
+            if response.status_code >= 500:
+                return response
+            entry = {'body': response.get_data(), 'status': response.status_code}
+            _cache_store(key, entry, generation)
+        
+        body = entry['body']
+        if entry['status'] != 200:
+            return app.response_class(body, status=entry['status'], mimetype='application/json')
+        
+        gzipped = len(body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings
+        if gzipped:
+            etag += '-gz'
+        if request.if_none_match.contains_weak(etag):
+            return app.response_class(status=304, headers={'ETag': f'"{etag}"', **headers})
+        
+        if gzipped:
+            if 'gzip' not in entry:
+                started = time.perf_counter()
+                entry['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+                _add_phase('gzip', time.perf_counter() - started)
+            body = entry['gzip']
+            headers['Content-Encoding'] = 'gzip'
+        headers['ETag'] = f'"{etag}"'
+        return app.response_class(body, status=200, mimetype='application/json', headers=headers)
+    return wrapper
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_snapshot_loading = None
+_snapshot_failed = None
+_snapshot_stats = {'loads': 0, 'failures': 0, 'fallbacks': 0}
+
+def _load_snapshot(generation):
+    """Построить снимок истории для поколения данных и подменить текущий.
+    Строится на отдельном соединении; запросы до подмены обслуживает старый путь"""
+    global _snapshot, _snapshot_loading, _snapshot_failed
+    snapshot = None
+    try:
+        conn = _connect()
+        try:
+            snapshot = game_snapshot.load(conn, generation)
+        finally:
+            conn.close()
+    except (sqlite3.Error, ValueError) as e:
+        log.warning("Снимок истории не построен: %s", e)
+
+    with _snapshot_lock:
+        if snapshot is not None:
+            _snapshot = snapshot
+            _snapshot_stats['loads'] += 1
+        else:
+            _snapshot_failed = generation
+            _snapshot_stats['failures'] += 1
+        _snapshot_loading = None
+    if snapshot is not None:
+        log.info("Снимок истории: %s", snapshot.info())
+    return snapshot
+
+def _current_snapshot():
+    """Снимок текущего поколения данных или None (выключен, ещё строится или
+    не построился). Устаревший снимок не отдаётся, а перестраивается в фоне"""
+    global _snapshot_loading
+    if not SNAPSHOT_ENABLED:
+        return None
+    generation = _data_generation()
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is not None and snapshot.generation == generation:
+            return snapshot
+        _snapshot_stats['fallbacks'] += 1
+        start = _snapshot_loading is None and _snapshot_failed != generation
+        if start:
+            _snapshot_loading = generation
+    if start:
+        threading.Thread(target=_load_snapshot, args=(generation,), name='snapshot', daemon=True).start()
+    return None
+
+def _snapshot_info():
+    """Состояние снимка истории для /api/health"""
+    with _snapshot_lock:
+        snapshot = _snapshot
+        info = {'enabled': SNAPSHOT_ENABLED, 'loading': _snapshot_loading is not None, **_snapshot_stats}
+    if snapshot is not None:
+        info.update(snapshot.info())
+    return info
+
+def _snapshot_histories(snapshot, team_ids, limit):
+    """Последние матчи команд из снимка в формате /api/last_games: {team_id: [матч, ...]}"""
+    return {
+        team_id: [_team_perspective_row(team_id, g) for g in snapshot.last_games(team_id, limit)]
+        for team_id in dict.fromkeys(team_ids)
+    }
+
+def _day_range(date):
+    """Границы суток для фильтра по g.date (ISO-строки сравниваются лексикографически)"""
+    day = datetime.strptime(date, '%Y-%m-%d')
+    return day.strftime('%Y-%m-%d'), (day + timedelta(days=1)).strftime('%Y-%m-%d')
+
+def _load_quarters(game_ids):
+    """Загрузить четверти для набора матчей одним запросом, сгруппировав по game_id"""
+    game_ids = list(dict.fromkeys(game_ids))
+    quarters = {gid: [] for gid in game_ids}
+    if not game_ids:
+        return quarters
+    
+    for i in range(0, len(game_ids), SQL_MAX_VARIABLES):
+        chunk = game_ids[i:i + SQL_MAX_VARIABLES]
+        placeholders = ','.join('?' * len(chunk))
+        rows = _db_query(
+            SQL_QUARTERS_BY_GAMES.format(placeholders=placeholders),
+            tuple(chunk)
+        )
+        for q in rows:
+            quarters[q['game_id']].append(q)
+    return quarters
+
+@app.route('/api/health', methods=['GET'])
+def get_health():
+    """Проверить доступность БД и получить статистику пула соединений"""
+    try:
+        conn = _get_conn()
+        conn.execute("SELECT 1").fetchone()
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        status = 'ok'
+    except sqlite3.Error as e:
+        journal_mode = None
+        status = f'error: {e}'
+    
+    return jsonify({
+        'status': status,
+        'db': {'path': DB_PATH, 'journal_mode': journal_mode},
+        'pool': _pool_info(),
+        'cache': _cache_info(),
+        'snapshot': _snapshot_info()
+    }), 200 if status == 'ok' else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Метрики процесса в текстовом формате Prometheus: время и фазы запросов
+    по маршрутам, SQL-запросы по отпечаткам, пул соединений, кэш ответов и снимок истории"""
+    pool = _pool_info()
+    cache = _cache_info()
+    gauges = {f'api_db_pool_{k}': (f'Пул соединений: {k}', pool[k]) for k in ('created', 'reused', 'in_use', 'idle', 'closed')}
+    gauges.update({f'api_cache_{k}': (f'Кэш ответов: {k}', cache[k]) for k in ('hits', 'misses', 'evictions', 'invalidations', 'size')})
+    snapshot = _snapshot_info()
+    gauges.update({f'api_snapshot_{k}': (f'Снимок истории: {k}', snapshot.get(k, 0))
+                   for k in ('games', 'bytes', 'bytes_per_million_games', 'loads', 'failures', 'fallbacks')})
+    gauges['api_process_id'] = ('PID процесса (у каждого воркера свои счётчики)', os.getpid())
+    return Response(api_metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/leagues', methods=['GET'])
+@_cached_endpoint
 def get_leagues():
     """Получить список всех лиг"""
-    rows = _db_query("SELECT DISTINCT id, name FROM leagues ORDER BY name")
+    rows = _db_query(SQL_LEAGUES)
     return jsonify(rows)
 
 @app.route('/api/games/<date>', methods=['GET'])
+@_cached_endpoint
 def get_games(date):
     """Получить игры на указанную дату"""
-    query = """
-    SELECT g.*, 
-           l.name as league_name,
-           t1.name as home_team_name, t1.logo as home_team_logo,
-           t2.name as away_team_name, t2.logo as away_team_logo
-    FROM games g
-    JOIN leagues l ON g.league_id = l.id
-    JOIN teams t1 ON g.home_team_id = t1.id
-    JOIN teams t2 ON g.away_team_id = t2.id
-    WHERE substr(g.date, 1, 10) = ?
-    ORDER BY g.timestamp
-    """
-    rows = _db_query(query, (date,))
+    try:
+        day_start, day_end = _day_range(date)
+    except ValueError:
+        return jsonify([])
+    
+    rows = _db_query(SQL_GAMES_BY_DATE, (day_start, day_end))
     return jsonify(rows)
 
 @app.route('/api/quarters/<int:game_id>', methods=['GET'])
+@_cached_endpoint
 def get_quarters(game_id):
     """Получить счёт по четвертям для конкретного матча"""
-    rows = _db_query("SELECT * FROM quarters WHERE game_id = ? ORDER BY quarter_num", (game_id,))
+    rows = _db_query(SQL_QUARTERS_BY_GAME, (game_id,))
     return jsonify(rows)
 
+def _attach_quarters(*game_lists):
+    """Подгрузить четверти ко всем матчам из списков одним запросом"""
+    quarters = _load_quarters(g['id'] for games in game_lists for g in games)
+    for games in game_lists:
+        for g in games:
+            g['quarters'] = quarters[g['id']]
+
+def _aggregates_current():
+    """Производные таблицы aggregates.py соответствуют games: версия завершённых игр
+    и их четвертей та же, что при последнем пересчёте. Если игры записаны в обход
+    aggregates.py (daily_update_db.sh без refresh), ответы считаются по games, пока
+    агрегаты не пересчитают. Проверяется раз на поколение данных."""
+    global _aggregates_checked
+    generation = _data_generation()
+    checked_generation, current = _aggregates_checked
+    if checked_generation != generation:
+        try:
+            rows = _db_query(SQL_AGGREGATES_CURRENT)
+        except sqlite3.OperationalError:
+            rows = []
+        current = bool(rows) and bool(rows[0]['current'])
+        if rows and not current:
+            log.warning("Агрегаты устарели (игры изменились после пересчёта), "
+                        "ответы считаются по games: нужен python3 aggregates.py refresh")
+        _aggregates_checked = (generation, current)
+    return current
+
+def _team_games_query(query, params, fallback, fallback_params):
+    """Запрос к производной team_games (см. aggregates.py), а пока таблица
+    не создана или устарела — исходный запрос к games"""
+    if _aggregates_current():
+        try:
+            return _db_query(query, params)
+        except sqlite3.OperationalError:
+            pass
+    return _db_query(fallback, fallback_params)
+
+def _team_last_games(team_id, limit):
+    """Последние N завершённых матчей команды (без четвертей)"""
+    return _team_games_query(
+        SQL_TEAM_GAMES_LAST, (team_id, limit),
+        SQL_LAST_GAMES, (team_id, team_id, team_id, team_id, team_id, team_id, limit)
+    )
+
+def _h2h_games(team1_id, team2_id, season):
+    """Личные встречи двух команд за сезон (без четвертей)"""
+    return _db_query(SQL_H2H, (team1_id, team2_id, team2_id, team1_id, season))
+
+def _team_averages(team_id, games):
+    """Средние показатели команды по списку матчей с подгруженными четвертями"""
+    frame = team_stats.team_games(*team_stats.frames_from_rows(games))
+    return team_stats.window_averages(frame, [len(games)], [team_id])[team_id][str(len(games))]
+
+def _rest_days(last_game_date):
+    """Дни отдыха с даты последнего матча"""
+    if not last_game_date:
+        return {'rest_days': None, 'last_game_date': None}
+    
+    last_game = datetime.fromisoformat(last_game_date.replace('T', ' ').replace('+00:00', ''))
+    today = datetime.now()
+    rest_days = (today - last_game).days
+    return {'rest_days': rest_days, 'last_game_date': last_game_date}
+
+def _games_by_ids(game_ids):
+    """Матчи с названиями лиги и команд по id (без четвертей): {id: матч}"""
+    games = {}
+    game_ids = list(game_ids)
+    for i in range(0, len(game_ids), SQL_MAX_VARIABLES):
+        chunk = game_ids[i:i + SQL_MAX_VARIABLES]
+        for g in _db_query(SQL_GAMES_BY_IDS.format(placeholders=_placeholders(chunk)), tuple(chunk)):
+            games[g['id']] = g
+    return games
+
+def _stored_h2h(pairs):
+    """Личные встречи из h2h_season для пар (team1_id, team2_id, season):
+    {пара: (матчи с четвертями, средние с точки зрения team1)}. Хранятся id и
+    средние, сами матчи читаются из games по id — с текущими названиями и четвертями.
+    None, пока таблица не создана или устарела (тогда H2H считается по games)."""
+    if not _aggregates_current():
+        return None
+    keys = {pair: (min(pair[0], pair[1]), max(pair[0], pair[1]), pair[2]) for pair in pairs}
+    unique = list(set(keys.values()))
+    found = {}
+    try:
+        for start in range(0, len(unique), SQL_MAX_VARIABLES // 3):
+            chunk = unique[start:start + SQL_MAX_VARIABLES // 3]
+            lows = list({k[0] for k in chunk})
+            highs = list({k[1] for k in chunk})
+            seasons = list({k[2] for k in chunk})
+            query = SQL_H2H_STORE.format(
+                lows=_placeholders(lows), highs=_placeholders(highs), seasons=_placeholders(seasons)
+            )
+            for row in _db_query(query, tuple(lows) + tuple(highs) + tuple(seasons)):
+                found[(row['team_low'], row['team_high'], row['season'])] = row
+    except sqlite3.OperationalError:
+        return None
+    
+    game_ids = {key: json.loads(row['game_ids_json']) for key, row in found.items()}
+    games = _games_by_ids({game_id for ids in game_ids.values() for game_id in ids})
+    _attach_quarters(games.values())
+    
+    result = {}
+    for pair, key in keys.items():
+        row = found.get(key)
+        if row is None:
+            result[pair] = ([], team_stats.h2h_payload((), (), 0))
+            continue
+        averages = json.loads(row['averages_json'])
+        if pair[0] != key[0]:
+            averages = team_stats.flip_h2h(averages)
+        result[pair] = ([games[game_id] for game_id in game_ids[key] if game_id in games], averages)
+    return result
+
+def _h2h_averages(team1_id, games):
+    """Средние по личным встречам с точки зрения team1 (матчи с подгруженными четвертями)"""
+    frame = team_stats.team_games(*team_stats.frames_from_rows(games))
+    return team_stats.h2h_averages(frame, team1_id)
+
 @app.route('/api/last_games/<int:team_id>/<int:limit>', methods=['GET'])
+@_cached_endpoint
 def get_last_games(team_id, limit):
     """Получить последние N матчей команды"""
-    query = """
-    SELECT g.*,
-           l.name as league_name,
-           CASE 
-               WHEN g.home_team_id = ? THEN t2.name
-               ELSE t1.name
-           END as opponent_name,
-           CASE 
-               WHEN g.home_team_id = ? THEN 'H'
-               ELSE 'A'
-           END as location,
-           CASE
-               WHEN g.home_team_id = ? AND g.home_score > g.away_score THEN 'W'
-               WHEN g.away_team_id = ? AND g.away_score > g.home_score THEN 'W'
-               WHEN g.status = 'FT' THEN 'L'
-               ELSE NULL
-           END as result
-    FROM games g
-    JOIN leagues l ON g.league_id = l.id
-    JOIN teams t1 ON g.home_team_id = t1.id
-    JOIN teams t2 ON g.away_team_id = t2.id
-    WHERE (g.home_team_id = ? OR g.away_team_id = ?)
-      AND g.status = 'FT'
-    ORDER BY g.date DESC
-    LIMIT ?
-    """
-    rows = _db_query(query, (team_id, team_id, team_id, team_id, team_id, team_id, limit))
-    
-    for row in rows:
-        quarters = _db_query("SELECT * FROM quarters WHERE game_id = ? ORDER BY quarter_num", (row['id'],))
-        row['quarters'] = quarters
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return jsonify(_snapshot_histories(snapshot, [team_id], limit)[team_id])
     
+    rows = _team_last_games(team_id, limit)
+    _attach_quarters(rows)
     return jsonify(rows)
 
 @app.route('/api/h2h/<int:team1_id>/<int:team2_id>/<season>', methods=['GET'])
+@_cached_endpoint
 def get_h2h(team1_id, team2_id, season):
     """Получить личные встречи двух команд за сезон"""
-    query = """
-    SELECT g.*,
-           l.name as league_name,
-           t1.name as home_team_name,
-           t2.name as away_team_name
-    FROM games g
-    JOIN leagues l ON g.league_id = l.id
-    JOIN teams t1 ON g.home_team_id = t1.id
-    JOIN teams t2 ON g.away_team_id = t2.id
-    WHERE ((g.home_team_id = ? AND g.away_team_id = ?)
-           OR (g.home_team_id = ? AND g.away_team_id = ?))
-      AND g.season = ?
-      AND g.status = 'FT'
-      AND g.home_score IS NOT NULL
-      AND g.away_score IS NOT NULL
-    ORDER BY g.date DESC
-    """
-    rows = _db_query(query, (team1_id, team2_id, team2_id, team1_id, season))
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return jsonify(snapshot.h2h(team1_id, team2_id, season)[0])
     
-    for row in rows:
-        quarters = _db_query("SELECT * FROM quarters WHERE game_id = ? ORDER BY quarter_num", (row['id'],))
-        row['quarters'] = quarters
+    stored = _stored_h2h([(team1_id, team2_id, season)])
+    if stored is not None:
+        return jsonify(stored[(team1_id, team2_id, season)][0])
     
+    rows = _h2h_games(team1_id, team2_id, season)
+    _attach_quarters(rows)
     return jsonify(rows)
 
+def _rolling_stats(team_id, limit):
+    """Средние из материализованной team_rolling_stats (см. aggregates.py) или None,
+    если окна там нет или таблица ещё не создана или устарела"""
+    if not _aggregates_current():
+        return None
+    try:
+        rows = _db_query(SQL_TEAM_ROLLING_STATS, (team_id, limit))
+    except sqlite3.OperationalError:
+        return None
+    if not rows:
+        return None
+    
+    return _rolling_payload(rows[0])
+
+def _rolling_payload(row):
+    """Строка team_rolling_stats в формате /api/team_averages"""
+    if not row['games_count']:
+        return team_stats.averages_payload(0, 0, 0, {})
+    return {
+        'games_count': row['games_count'],
+        'avg_score': row['avg_score'],
+        'avg_opponent_score': row['avg_opponent_score'],
+        'avg_total': row['avg_total'],
+        'quarters': {q: row[q] for q in ('q1', 'q2', 'q3', 'q4')},
+        'halves': {h: row[h] for h in ('h1', 'h2')}
+    }
+
 @app.route('/api/team_averages/<int:team_id>/<int:limit>', methods=['GET'])
+@_cached_endpoint
 def get_team_averages(team_id, limit):
     """Получить средние показатели команды за последние N игр"""
-    games_query = """
-    SELECT g.*,
-           CASE WHEN g.home_team_id = ? THEN g.home_score ELSE g.away_score END as team_score,
-           CASE WHEN g.home_team_id = ? THEN g.away_score ELSE g.home_score END as opponent_score,
-           CASE WHEN g.home_team_id = ? THEN 1 ELSE 0 END as is_home
-    FROM games g
-    WHERE (g.home_team_id = ? OR g.away_team_id = ?)
-      AND g.status = 'FT'
-      AND g.home_score IS NOT NULL
-      AND g.away_score IS NOT NULL
-    ORDER BY g.date DESC
-    LIMIT ?
-    """
-    games = _db_query(games_query, (team_id, team_id, team_id, team_id, team_id, limit))
-    
-    if not games:
-        return jsonify({
-            'games_count': 0,
-            'avg_score': 0,
-            'avg_opponent_score': 0,
-            'avg_total': 0,
-            'quarters': {},
-            'halves': {}
-        })
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return jsonify(snapshot.window_averages([team_id], [limit])[team_id][str(limit)])
     
-    avg_score = sum(g['team_score'] for g in games) / len(games)
-    avg_opponent = sum(g['opponent_score'] for g in games) / len(games)
-    avg_total = avg_score + avg_opponent
+    stored = _rolling_stats(team_id, limit)
+    if stored is not None:
+        return jsonify(stored)
     
-    quarters_sum = {'q1': [], 'q2': [], 'q3': [], 'q4': []}
+    rows = None
+    if _aggregates_current():
+        try:
+            rows = _db_query(SQL_TEAM_GAMES_SCORED, (team_id, limit))
+        except sqlite3.OperationalError:
+            pass
+    if rows is None:
+        games = _db_query(SQL_TEAM_SCORED_GAMES, (team_id, team_id, team_id, team_id, team_id, limit))
+        _attach_quarters(games)
+        return jsonify(_team_averages(team_id, games))
     
-    for game in games:
-        quarters = _db_query("SELECT * FROM quarters WHERE game_id = ? ORDER BY quarter_num", (game['id'],))
-        
-        if quarters:
-            for q in quarters:
-                quarter_num = q['quarter_num']
-                if quarter_num <= 4:
-                    if game['is_home']:
-                        score = q['home_score'] or 0
-                    else:
-                        score = q['away_score'] or 0
-                    
-                    quarters_sum[f'q{quarter_num}'].append(score)
-    
-    quarters_avg = {}
-    for q_key, scores in quarters_sum.items():
-        if scores:
-            quarters_avg[q_key] = round(sum(scores) / len(scores), 1)
-        else:
-            quarters_avg[q_key] = 0
-    
-    halves_avg = {}
-    if quarters_avg.get('q1', 0) > 0 and quarters_avg.get('q2', 0) > 0:
-        halves_avg['h1'] = round(quarters_avg['q1'] + quarters_avg['q2'], 1)
-    else:
-        halves_avg['h1'] = 0
-        
-    if quarters_avg.get('q3', 0) > 0 and quarters_avg.get('q4', 0) > 0:
-        halves_avg['h2'] = round(quarters_avg['q3'] + quarters_avg['q4'], 1)
-    else:
-        halves_avg['h2'] = 0
-    
-    return jsonify({
-        'games_count': len(games),
-        'avg_score': round(avg_score, 1),
-        'avg_opponent_score': round(avg_opponent, 1),
-        'avg_total': round(avg_total, 1),
-        'quarters': quarters_avg,
-        'halves': halves_avg
-    })
+    averages = team_stats.window_averages(team_stats.team_frame(rows), [limit], [team_id])
+    return jsonify(averages[team_id][str(limit)])
 
 @app.route('/api/team_rest_days/<int:team_id>', methods=['GET'])
+@_cached_endpoint
 def get_team_rest_days(team_id):
     """Получить количество дней отдыха команды"""
-    query = """
-    SELECT MAX(date) as last_game_date
-    FROM games
-    WHERE (home_team_id = ? OR away_team_id = ?)
-      AND status = 'FT'
-    """
-    result = _db_query(query, (team_id, team_id))
-    
-    if result and result[0]['last_game_date']:
-        last_game = datetime.fromisoformat(result[0]['last_game_date'].replace('T', ' ').replace('+00:00', ''))
-        today = datetime.now()
-        rest_days = (today - last_game).days
-        return jsonify({'rest_days': rest_days, 'last_game_date': result[0]['last_game_date']})
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return jsonify(_rest_days(snapshot.last_game_dates([team_id])[team_id]))
     
-    return jsonify({'rest_days': None, 'last_game_date': None})
+    result = _team_games_query(SQL_TEAM_GAMES_LAST_DATE, (team_id,), SQL_TEAM_LAST_GAME_DATE, (team_id, team_id))
+    return jsonify(_rest_days(result[0]['last_game_date'] if result else None))
 
 @app.route('/api/h2h_averages/<int:team1_id>/<int:team2_id>/<season>', methods=['GET'])
+@_cached_endpoint
 def get_h2h_averages(team1_id, team2_id, season):
     """Получить средние показатели по личным встречам"""
-    query = """
-    SELECT g.*
-    FROM games g
-    WHERE ((g.home_team_id = ? AND g.away_team_id = ?)
-           OR (g.home_team_id = ? AND g.away_team_id = ?))
-      AND g.season = ?
-      AND g.status = 'FT'
-      AND g.home_score IS NOT NULL
-      AND g.away_score IS NOT NULL
-    ORDER BY g.date DESC
-    """
-    games = _db_query(query, (team1_id, team2_id, team2_id, team1_id, season))
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return jsonify(snapshot.h2h(team1_id, team2_id, season)[1])
+    
+    stored = _stored_h2h([(team1_id, team2_id, season)])
+    if stored is not None:
+        return jsonify(stored[(team1_id, team2_id, season)][1])
+    
+    games = _db_query(SQL_H2H_GAMES, (team1_id, team2_id, team2_id, team1_id, season))
+    _attach_quarters(games)
+    return jsonify(_h2h_averages(team1_id, games))
+
+def _match_card(game):
+    """Собрать всю аналитику карточки матча из одной выборки истории каждой команды.
+    Средние за окна считаются по играм со счётом из этой же истории (см.
+    _window_histories), H2H-средние — по списку H2H."""
+    home_id = game['home_team_id']
+    away_id = game['away_team_id']
+    history_size = max(MATCH_CARD_WINDOWS + (MATCH_CARD_LAST_GAMES,))
+    
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        histories = _snapshot_histories(snapshot, [home_id, away_id], history_size)
+        home_games, away_games = histories[home_id], histories[away_id]
+        h2h_games, h2h_averages = snapshot.h2h(home_id, away_id, game['season'])
+        averages = snapshot.window_averages([home_id, away_id], MATCH_CARD_WINDOWS)
+    else:
+        home_games = _team_last_games(home_id, history_size)
+        away_games = _team_last_games(away_id, history_size)
+        pair = (home_id, away_id, game['season'])
+        stored = _stored_h2h([pair])
+        if stored is not None:
+            h2h_games, h2h_averages = stored[pair]
+            _attach_quarters(home_games, away_games)
+        else:
+            h2h_games = _h2h_games(home_id, away_id, game['season'])
+            _attach_quarters(home_games, away_games, h2h_games)
+            h2h_averages = _h2h_averages(home_id, h2h_games)
+        windows = _window_histories({home_id: home_games, away_id: away_games}, max(MATCH_CARD_WINDOWS))
+        frame = team_stats.team_games(*team_stats.frames_from_rows(g for games in windows.values() for g in games))
+        averages = team_stats.window_averages(frame, MATCH_CARD_WINDOWS, [home_id, away_id])
+    
+    def team_block(team_id, games):
+        return {
+            'team_id': team_id,
+            'averages': averages[team_id],
+            'rest': _rest_days(games[0]['date'] if games else None),
+            'last_games': games[:MATCH_CARD_LAST_GAMES]
+        }
+    
+    return {
+        'game': game,
+        'home': team_block(home_id, home_games),
+        'away': team_block(away_id, away_games),
+        'h2h': h2h_games,
+        'h2h_averages': h2h_averages
+    }
+
+@app.route('/api/match_card/<int:game_id>', methods=['GET'])
+@_cached_endpoint
+def get_match_card(game_id):
+    """Получить всю аналитику карточки матча одним запросом"""
+    rows = _db_query(SQL_GAME_BY_ID, (game_id,))
+    if not rows:
+        return jsonify({'error': 'game not found'}), 404
+    
+    return jsonify(_match_card(rows[0]))
+
+def _placeholders(values):
+    return ','.join('?' * len(values))
+
+def _teams_last_games(team_ids, limit, scored=False):
+    """Последние N завершённых матчей сразу для набора команд: {team_id: [матч, ...]}.
+    Строки в формате /api/last_games (без четвертей), один запрос на пачку команд.
+    scored — только матчи с итоговым счётом (окна средних)."""
+    team_ids = list(dict.fromkeys(team_ids))
+    ranked = []
+    chunk_size = (SQL_MAX_VARIABLES - 1) // 2
+    template = SQL_TEAMS_RECENT_SCORED_GAME_IDS if scored else SQL_TEAMS_RECENT_GAME_IDS
+    for i in range(0, len(team_ids), chunk_size):
+        chunk = team_ids[i:i + chunk_size]
+        query = template.format(placeholders=_placeholders(chunk))
+        ranked += _db_query(query, tuple(chunk) * 2 + (limit,))
     
+    games = _games_by_ids({r['game_id'] for r in ranked})
+    
+    history = {team_id: [] for team_id in team_ids}
+    for r in ranked:
+        history[r['team_id']].append(_team_perspective_row(r['team_id'], games[r['game_id']]))
+    return history
+
+def _window_histories(histories, size):
+    """Истории команд для средних за окна до size игр. Окно собирается из игр
+    со счётом (см. team_stats.window_averages), а среди последних завершённых
+    их может оказаться меньше size: таким командам, если история обрезана
+    лимитом, последние size игр со счётом догружаются отдельно. Истории
+    передаются с четвертями; возвращаются {team_id: [матч, ...]}."""
+    short = [
+        team_id for team_id, games in histories.items()
+        if len(games) >= size and sum(g['home_score'] is not None and g['away_score'] is not None for g in games) < size
+    ]
+    if not short:
+        return histories
+    scored = _teams_last_games(short, size, scored=True)
+    _attach_quarters(*scored.values())
+    return {**histories, **scored}
+
+def _team_perspective_row(team_id, game):
+    """Строка /api/last_games: поля матча + соперник, место и результат для команды"""
+    row = dict(game)
+    home_team_name = row.pop('home_team_name')
+    away_team_name = row.pop('away_team_name')
+    is_home = row['home_team_id'] == team_id
+    home_score, away_score = row['home_score'], row['away_score']
+    
+    if home_score is not None and away_score is not None and (
+            (is_home and home_score > away_score) or
+            (row['away_team_id'] == team_id and away_score > home_score)):
+        result = 'W'
+    elif row['status'] == 'FT':
+        result = 'L'
+    else:
+        result = None
+    
+    row['opponent_name'] = away_team_name if is_home else home_team_name
+    row['location'] = 'H' if is_home else 'A'
+    row['result'] = result
+    return row
+
+def _pairs_h2h(games):
+    """Личные встречи для всех пар матчей дня одним запросом: {(home_id, away_id): [матч, ...]}"""
+    team_ids = list({t for g in games for t in (g['home_team_id'], g['away_team_id'])})
+    seasons = list({g['season'] for g in games})
+    pairs = {(g['home_team_id'], g['away_team_id'], g['season']): [] for g in games}
     if not games:
-        return jsonify({
-            'games_count': 0,
-            'team1_avg': 0,
-            'team2_avg': 0,
-            'team1_quarters': {},
-            'team2_quarters': {}
-        })
+        return pairs
     
-    team1_scores = []
-    team2_scores = []
-    team1_quarters = {'q1': [], 'q2': [], 'q3': [], 'q4': []}
-    team2_quarters = {'q1': [], 'q2': [], 'q3': [], 'q4': []}
+    if 2 * len(team_ids) + len(seasons) > SQL_MAX_VARIABLES:
+        for home_id, away_id, season in pairs:
+            pairs[(home_id, away_id, season)] = _h2h_games(home_id, away_id, season)
+        return pairs
     
-    for game in games:
-        if game['home_team_id'] == team1_id:
-            team1_scores.append(game['home_score'])
-            team2_scores.append(game['away_score'])
-            team1_is_home = True
+    query = SQL_PAIRS_H2H.format(teams=_placeholders(team_ids), seasons=_placeholders(seasons))
+    rows = _db_query(query, tuple(team_ids) * 2 + tuple(seasons))
+    for row in rows:
+        for key in ((row['home_team_id'], row['away_team_id'], row['season']),
+                    (row['away_team_id'], row['home_team_id'], row['season'])):
+            if key in pairs:
+                pairs[key].append(row)
+    return pairs
+
+def _day_cards(day_start, day_end):
+    """Карточки всех матчей дня (границы — из _day_range): история каждой команды
+    грузится один раз, даже если команда играет в нескольких матчах"""
+    games = _db_query(SQL_GAMES_BY_DATE, (day_start, day_end))
+    
+    history_size = max(MATCH_CARD_WINDOWS + (MATCH_CARD_LAST_GAMES,))
+    team_ids = [t for g in games for t in (g['home_team_id'], g['away_team_id'])]
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        histories = _snapshot_histories(snapshot, team_ids, history_size)
+        h2h, h2h_averages = {}, {}
+        for g in games:
+            pair = (g['home_team_id'], g['away_team_id'], g['season'])
+            h2h[pair], h2h_averages[pair] = snapshot.h2h(*pair)
+        averages = snapshot.window_averages(list(histories), MATCH_CARD_WINDOWS)
+    else:
+        histories = _teams_last_games(team_ids, history_size)
+        stored = _stored_h2h((g['home_team_id'], g['away_team_id'], g['season']) for g in games)
+        if stored is not None:
+            h2h = {pair: h2h_games for pair, (h2h_games, _) in stored.items()}
+            h2h_averages = {pair: averages for pair, (_, averages) in stored.items()}
+            _attach_quarters(*histories.values())
         else:
-            team1_scores.append(game['away_score'])
-            team2_scores.append(game['home_score'])
-            team1_is_home = False
+            h2h = _pairs_h2h(games)
+            _attach_quarters(*histories.values(), *h2h.values())
+            h2h_frame = team_stats.team_games(*team_stats.frames_from_rows(g for games in h2h.values() for g in games))
+            h2h_averages = team_stats.pairs_h2h_averages(h2h_frame, h2h)
+        windows = _window_histories(histories, max(MATCH_CARD_WINDOWS))
+        frame = team_stats.team_games(*team_stats.frames_from_rows(g for games in windows.values() for g in games))
+        averages = team_stats.window_averages(frame, MATCH_CARD_WINDOWS, list(histories))
+    
+    def team_block(team_id):
+        history = histories[team_id]
+        return {
+            'team_id': team_id,
+            'averages': averages[team_id],
+            'rest': _rest_days(history[0]['date'] if history else None),
+            'last_games': history[:MATCH_CARD_LAST_GAMES]
+        }
+    
+    cards = []
+    for game in games:
+        pair = (game['home_team_id'], game['away_team_id'], game['season'])
+        cards.append({
+            'game': game,
+            'home': team_block(game['home_team_id']),
+            'away': team_block(game['away_team_id']),
+            'h2h': h2h[pair],
+            'h2h_averages': h2h_averages[pair]
+        })
+    return cards
+
+@app.route('/api/day_cards/<date>', methods=['GET'])
+@_cached_endpoint
+def get_day_cards(date):
+    """Получить карточки всех матчей на дату одним ответом"""
+    try:
+        day_start, day_end = _day_range(date)
+    except ValueError:
+        return jsonify({'date': date, 'cards': []})
+    
+    return jsonify({'date': date, 'cards': _day_cards(day_start, day_end)})
+
+def _batch_body():
+    """Тело пакетного запроса: JSON-объект и отсортированные уникальные team_ids"""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ValueError('body: JSON object with team_ids')
+    team_ids = body.get('team_ids')
+    if (not isinstance(team_ids, list) or not 0 < len(team_ids) <= BATCH_MAX_TEAMS
+            or not all(type(t) is int for t in team_ids)):
+        raise ValueError(f'team_ids: 1..{BATCH_MAX_TEAMS} integer ids')
+    return body, tuple(sorted(set(team_ids)))
+
+def _batch_windows(windows):
+    """Окна пакетного запроса: список целых 1..BATCH_MAX_SIZE, отсортированный без повторов"""
+    if (not isinstance(windows, list) or not 0 < len(windows) <= BATCH_MAX_WINDOWS
+            or not all(type(w) is int and 0 < w <= BATCH_MAX_SIZE for w in windows)):
+        raise ValueError(f'windows: 1..{BATCH_MAX_WINDOWS} integers 1..{BATCH_MAX_SIZE}')
+    return tuple(sorted(set(windows)))
+
+def _teams_averages(team_ids, windows):
+    """Средние за несколько окон для набора команд: {team_id: {'5': {...}, ...}}.
+    Готовые окна берутся из team_rolling_stats одним запросом на пачку команд,
+    остальные считаются по последним играм со счётом из _teams_last_games —
+    так же, как их материализует aggregates.py"""
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return snapshot.window_averages(team_ids, windows)
+    
+    result = {team_id: {} for team_id in team_ids}
+    chunk_size = SQL_MAX_VARIABLES - len(windows)
+    if _aggregates_current():
+        try:
+            for i in range(0, len(team_ids), chunk_size):
+                chunk = team_ids[i:i + chunk_size]
+                query = SQL_TEAMS_ROLLING_STATS.format(teams=_placeholders(chunk), windows=_placeholders(windows))
+                for row in _db_query(query, tuple(chunk) + tuple(windows)):
+                    result[row['team_id']][str(row['window_size'])] = _rolling_payload(row)
+        except sqlite3.OperationalError:
+            pass
+    
+    missing = [team_id for team_id in team_ids if len(result[team_id]) < len(windows)]
+    if missing:
+        histories = _teams_last_games(missing, max(windows), scored=True)
+        _attach_quarters(*histories.values())
+        frame = team_stats.team_games(*team_stats.frames_from_rows(g for games in histories.values() for g in games))
+        computed = team_stats.window_averages(frame, windows, missing)
+        for team_id in missing:
+            for window, averages in computed[team_id].items():
+                result[team_id].setdefault(window, averages)
+    return {team_id: {str(w): result[team_id][str(w)] for w in windows} for team_id in team_ids}
+
+def _teams_rest_days(team_ids):
+    """Дни отдыха набора команд: {team_id: {'rest_days', 'last_game_date'}}"""
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return {team_id: _rest_days(date) for team_id, date in snapshot.last_game_dates(team_ids).items()}
+    
+    last_dates = {}
+    chunk_size = SQL_MAX_VARIABLES // 2
+    for i in range(0, len(team_ids), chunk_size):
+        chunk = team_ids[i:i + chunk_size]
+        placeholders = _placeholders(chunk)
+        rows = _team_games_query(
+            SQL_TEAMS_GAMES_LAST_DATE.format(placeholders=placeholders), tuple(chunk),
+            SQL_TEAMS_LAST_GAME_DATE.format(placeholders=placeholders), tuple(chunk) * 2
+        )
+        last_dates.update((r['team_id'], r['last_game_date']) for r in rows)
+    return {team_id: _rest_days(last_dates.get(team_id)) for team_id in team_ids}
+
+@_cached_endpoint
+def _batch_team_averages(team_ids, windows):
+    return jsonify({str(t): v for t, v in _teams_averages(team_ids, windows).items()})
+
+@_cached_endpoint
+def _batch_team_rest_days(team_ids):
+    return jsonify({str(t): v for t, v in _teams_rest_days(team_ids).items()})
+
+@_cached_endpoint
+def _batch_last_games(team_ids, limit):
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        histories = _snapshot_histories(snapshot, team_ids, limit)
+        return jsonify({str(t): games for t, games in histories.items()})
+    histories = _teams_last_games(team_ids, limit)
+    _attach_quarters(*histories.values())
+    return jsonify({str(t): games for t, games in histories.items()})
+
+@app.route('/api/team_averages', methods=['POST'])
+def post_team_averages():
+    """Средние сразу для многих команд и окон.
+    
+    Тело: {"team_ids": [...], "windows": [5, 10, 20]} (windows необязателен).
+    Ответ: {"<team_id>": {"<окно>": как /api/team_averages/<team_id>/<окно>}}"""
+    try:
+        body, team_ids = _batch_body()
+        windows = _batch_windows(body.get('windows', list(BATCH_DEFAULT_WINDOWS)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _batch_team_averages(team_ids=team_ids, windows=windows)
+
+@app.route('/api/team_rest_days', methods=['POST'])
+def post_team_rest_days():
+    """Дни отдыха сразу для многих команд.
+    
+    Тело: {"team_ids": [...]}. Ответ: {"<team_id>": как /api/team_rest_days/<team_id>}"""
+    try:
+        _, team_ids = _batch_body()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _batch_team_rest_days(team_ids=team_ids)
+
+@app.route('/api/last_games', methods=['POST'])
+def post_last_games():
+    """Последние матчи (с четвертями) сразу для многих команд.
+    
+    Тело: {"team_ids": [...], "limit": 5}. Ответ: {"<team_id>": как /api/last_games/<team_id>/<limit>}"""
+    try:
+        body, team_ids = _batch_body()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = body.get('limit', MATCH_CARD_LAST_GAMES)
+    if type(limit) is not int or not 0 < limit <= BATCH_MAX_SIZE:
+        return jsonify({'error': f'limit: 1..{BATCH_MAX_SIZE}'}), 400
+    return _batch_last_games(team_ids=team_ids, limit=limit)
+
+def _export_filters(args):
+    """Условия выгрузки из параметров league, season, date_from, date_to (даты включительно)"""
+    filters = []
+    params = []
+    if args.get('league'):
+        filters.append(" AND g.league_id = ?")
+        params.append(int(args['league']))
+    if args.get('season'):
+        filters.append(" AND g.season = ?")
+        params.append(args['season'])
+    if args.get('date_from'):
+        filters.append(" AND g.date >= ?")
+        params.append(_day_range(args['date_from'])[0])
+    if args.get('date_to'):
+        filters.append(" AND g.date < ?")
+        params.append(_day_range(args['date_to'])[1])
+    return ''.join(filters), params
+
+def _export_batches(query, params):
+    """Строки выгрузки пачками fetchmany. Своё соединение, а не из пула:
+    генератор дочитывается уже после teardown запроса"""
+    conn = _connect()
+    conn.row_factory = None
+    try:
+        cur = conn.execute(query, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def _ndjson_stream(batches):
+    """NDJSON: по объекту на строку, пачка за пачкой"""
+    names = EXPORT_SCHEMA.names
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(names, row)), separators=(',', ':')) + '\n' for row in rows)
+
+class _ChunkSink:
+    """Файл для pyarrow, из которого записанные байты забираются по частям"""
+    closed = False
+    
+    def __init__(self):
+        self.parts = []
+    
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def _arrow_stream(batches):
+    """Arrow IPC stream: RecordBatch на каждую пачку fetchmany"""
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, EXPORT_SCHEMA)
+    for rows in batches:
+        columns = zip(*rows)
+        arrays = [pa.array(values, type=field.type) for values, field in zip(columns, EXPORT_SCHEMA)]
+        writer.write_batch(pa.record_batch(arrays, schema=EXPORT_SCHEMA))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+@app.route('/api/export/games', methods=['GET'])
+def export_games():
+    """Выгрузить игры с четвертями потоком для обучения моделей.
+    
+    Параметры: format=ndjson|arrow, league, season, date_from, date_to (YYYY-MM-DD),
+    limit — игр на страницу, cursor — из заголовка X-Next-Cursor предыдущей страницы.
+    Заголовка нет — это последняя страница."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', EXPORT_PAGE_SIZE))
+        filters, params = _export_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not 0 < limit <= EXPORT_MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit: 1..{EXPORT_MAX_PAGE_SIZE}'}), 400
+    
+    page = _db_query(SQL_EXPORT_PAGE_END.format(filters=filters), (cursor, *params, limit))[0]
+    headers = {'Cache-Control': 'no-store', 'X-Export-Games': str(page['games'])}
+    if page['games'] == limit:
+        headers['X-Next-Cursor'] = str(page['page_end'])
+    
+    query = SQL_EXPORT_GAMES.format(filters=filters)
+    batches = _export_batches(query, (cursor, page['page_end'] or cursor, *params))
+    stream = _arrow_stream(batches) if fmt == 'arrow' else _ndjson_stream(batches)
+    return Response(stream, mimetype=EXPORT_FORMATS[fmt], headers=headers)
+
+_stream_cache = TTLCache(maxsize=STREAM_CACHE_ENTRIES, ttl=STREAM_MAX_SECONDS)
+_stream_lock = threading.Lock()
+
+def _stream_cached(key, compute):
+    """Снимок потока: считается один раз на поколение данных для всех подписчиков"""
+    with _stream_lock:
+        value = _stream_cache.get(key)
+    if value is None:
+        value = compute()
+        with _stream_lock:
+            _stream_cache[key] = value
+    return value
+
+def _games_snapshot(date, generation):
+    """Игры дня с четвертями: {id: игра}"""
+    def compute():
+        day_start, day_end = _day_range(date)
+        games = _db_query(SQL_GAMES_BY_DATE, (day_start, day_end))
+        _attach_quarters(games)
+        return {g['id']: g for g in games}
+    return _stream_cached(('snapshot', date, generation), compute)
+
+def _games_diff(old, new):
+    """Изменившиеся и новые игры дня (целиком, с четвертями) и id исчезнувших.
+    old — снимок, который подписчик уже получил: из кэша его брать нельзя,
+    вытесненная запись пересчиталась бы по текущей БД и дифф вышел бы пустым"""
+    changed = [g for gid, g in new.items() if old.get(gid) != g]
+    removed = [gid for gid in old if gid not in new]
+    return changed, removed
+
+def _sse(event, data, generation):
+    """Событие SSE; id — поколение данных"""
+    return f"id: {generation}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def _games_events(date):
+    """События потока: снимок дня, затем только изменения при смене поколения данных.
+    Генератор работает после teardown запроса, поэтому соединение возвращается
+    в пул после каждой проверки, а не держится всё подключение"""
+    try:
+        generation = _data_generation()
+        snapshot = _games_snapshot(date, generation)
+    finally:
+        _release_conn()
+    yield f"retry: {STREAM_RETRY_MS}\n\n" + _sse('snapshot', list(snapshot.values()), generation)
+    
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < STREAM_MAX_SECONDS:
+        time.sleep(STREAM_POLL_SECONDS)
+        try:
+            current = _data_generation()
+            if current != generation:
+                latest = _games_snapshot(date, current)
+                changed, removed = _games_diff(snapshot, latest)
+                snapshot, generation = latest, current
+            else:
+                changed = removed = None
+        finally:
+            _release_conn()
         
-        quarters = _db_query("SELECT * FROM quarters WHERE game_id = ? ORDER BY quarter_num", (game['id'],))
-        if quarters:
-            for q in quarters[:4]:
-                qnum = q['quarter_num']
-                if team1_is_home:
-                    team1_quarters[f'q{qnum}'].append(q['home_score'] or 0)
-                    team2_quarters[f'q{qnum}'].append(q['away_score'] or 0)
-                else:
-                    team1_quarters[f'q{qnum}'].append(q['away_score'] or 0)
-                    team2_quarters[f'q{qnum}'].append(q['home_score'] or 0)
-    
-    team1_quarters_avg = {k: round(sum(v)/len(v), 1) if v else 0 for k, v in team1_quarters.items()}
-    team2_quarters_avg = {k: round(sum(v)/len(v), 1) if v else 0 for k, v in team2_quarters.items()}
+        if changed or removed:
+            yield _sse('update', {'games': changed, 'removed': removed}, generation)
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= STREAM_HEARTBEAT_SECONDS:
+            yield ': keep-alive\n\n'
+            last_sent = time.monotonic()
+
+@app.route('/api/stream/games/<date>', methods=['GET'])
+def stream_games(date):
+    """Live-счёт дня через Server-Sent Events.
     
-    return jsonify({
-        'games_count': len(games),
-        'team1_avg': round(sum(team1_scores)/len(team1_scores), 1) if team1_scores else 0,
-        'team2_avg': round(sum(team2_scores)/len(team2_scores), 1) if team2_scores else 0,
-        'team1_quarters': team1_quarters_avg,
-        'team2_quarters': team2_quarters_avg
-    })
+    Первое событие snapshot — все игры дня с четвертями; дальше события update
+    {games: [изменившиеся игры с четвертями], removed: [id]} приходят, только
+    когда меняются данные (ingest_daily.py, aggregates.py, запись в БД)"""
+    try:
+        _day_range(date)
+    except ValueError:
+        return jsonify({'error': 'date: YYYY-MM-DD'}), 400
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(_games_events(date), mimetype='text/event-stream', headers=headers)
+
+def warm_up():
+    """Прогреть воркер до приёма запросов: открыть соединения пула, построить
+    снимок истории (если включён), подтянуть страницы БД в кэш ОС и заполнить
+    кэш ответов списком лиг, сегодняшними играми и их карточками.
+    Возвращает {что: секунды}"""
+    timings = {}
+    started = time.perf_counter()
+    conns = [_connect() for _ in range(WARM_UP_CONNECTIONS - _pool.qsize())]
+    with _pool_lock:
+        _pool_stats['created'] += len(conns)
+    for conn in conns:
+        _pool.put(conn)
+    timings['connections'] = time.perf_counter() - started
+    
+    if SNAPSHOT_ENABLED:
+        started = time.perf_counter()
+        generation = _data_generation()
+        _release_conn()
+        _load_snapshot(generation)
+        timings['snapshot'] = time.perf_counter() - started
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    client = app.test_client()
+    started = time.perf_counter()
+    client.get('/api/leagues')
+    games = client.get(f'/api/games/{today}').get_json() or []
+    timings['games'] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    for game in games[:WARM_UP_MAX_CARDS]:
+        client.get(f"/api/match_card/{game['id']}")
+    timings['match_cards'] = time.perf_counter() - started
+    return timings
 
 if __name__ == '__main__':
+    # Сервер разработки; в проде — gunicorn -c gunicorn.conf.py api_server:app
     app.run(host='0.0.0.0', port=5000)
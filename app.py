@@ -1,69 +1,444 @@
 import streamlit as st
 import pandas as pd
+import json
+import os
 import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-API_BASE = "http://77.232.128.127:5000/api"
+API_BASE = os.environ.get('BASKETBALL_API', "http://77.232.128.127:5000/api")
+
+# Не больше стольких одновременных запросов к API (и keep-alive соединений в пуле)
+API_MAX_IN_FLIGHT = 8
+
+# Сколько URL держать с сохранённым ETag и последним ответом
+HTTP_VALIDATORS_MAX = 2000
+
+# Live-счёт: один SSE-поток к API на дату для всех сессий; таблица счёта (один
+# фрагмент на страницу) перерисовывается из памяти раз в LIVE_REFRESH_SECONDS, поток закрывается,
+# если его никто не читал LIVE_IDLE_SECONDS. Сервер шлёт keep-alive раз в 15 секунд
+LIVE_REFRESH_SECONDS = 2
+LIVE_IDLE_SECONDS = 120
+LIVE_READ_TIMEOUT = 60
+LIVE_RETRY_SECONDS = 3
 
 st.set_page_config(page_title="Панель аналитики баскетбола", layout="wide", page_icon="🏀")
 st.title("🏀 Панель аналитики баскетбола")
 
+@st.cache_resource
+def _http_client():
+    """Общий для всех сессий HTTP-клиент: пул keep-alive соединений,
+    ETag с последним ответом по каждому URL и счётчики запросов"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_MAX_IN_FLIGHT)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return {'session': session, 'validators': {}, 'stats': {}, 'lock': threading.Lock()}
+
+def _record_fetch(client, endpoint, elapsed_ms, status=None, error=None):
+    with client['lock']:
+        stats = client['stats'].setdefault(endpoint, {
+            'requests': 0, 'errors': 0, 'not_modified': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_error': None
+        })
+        stats['requests'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if status == 304:
+            stats['not_modified'] += 1
+        if error is not None:
+            stats['errors'] += 1
+            stats['last_error'] = f"{datetime.now():%H:%M:%S} {error}"
+
+def _api_get(path, timeout=10):
+    """GET к API с If-None-Match: при 304 берётся ранее полученный ответ.
+    Время и ошибки каждого запроса попадают в счётчики _http_client()['stats']."""
+    client = _http_client()
+    url = f"{API_BASE}/{path}"
+    endpoint = path.split('/', 1)[0]
+    validators = client['validators']
+    cached = validators.get(url)
+    headers = {'If-None-Match': cached[0]} if cached else {}
+    
+    started = time.perf_counter()
+    try:
+        response = client['session'].get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached:
+            data = cached[1]
+        else:
+            response.raise_for_status()
+            data = response.json()
+            etag = response.headers.get('ETag')
+            if etag:
+                if len(validators) >= HTTP_VALIDATORS_MAX:
+                    validators.clear()
+                validators[url] = (etag, data)
+    except Exception as e:
+        _record_fetch(client, endpoint, (time.perf_counter() - started) * 1000, error=e)
+        raise
+    
+    _record_fetch(client, endpoint, (time.perf_counter() - started) * 1000, status=response.status_code)
+    return data
+
+# Загрузчики не глотают ошибки: st.cache_data не кэширует исключения,
+# поэтому неудачный запрос повторится при следующем обновлении страницы
 @st.cache_data(ttl=3600, show_spinner=False)
 def get_leagues():
-    try:
-        response = requests.get(f"{API_BASE}/leagues", timeout=10)
-        return pd.DataFrame(response.json())
-    except:
-        return pd.DataFrame()
+    return pd.DataFrame(_api_get("leagues"))
 
 @st.cache_data(ttl=60, show_spinner=False)
 def get_games(date):
-    try:
-        response = requests.get(f"{API_BASE}/games/{date}", timeout=10)
-        return response.json()
-    except:
-        return []
+    return _api_get(f"games/{date}")
 
 @st.cache_data(ttl=300, show_spinner=False)
-def get_team_averages(team_id, limit):
-    try:
-        response = requests.get(f"{API_BASE}/team_averages/{team_id}/{limit}", timeout=10)
-        data = response.json()
-        return data if data.get('games_count', 0) > 0 else None
-    except:
-        return None
+def get_match_card(game_id):
+    return _api_get(f"match_card/{game_id}")
 
-@st.cache_data(ttl=300, show_spinner=False)
-def get_last_games(team_id, limit):
-    try:
-        response = requests.get(f"{API_BASE}/last_games/{team_id}/{limit}", timeout=10)
-        return response.json()
-    except:
-        return []
+def _sse_events(response):
+    """Разобрать поток text/event-stream на пары (событие, данные из JSON)"""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            field, _, value = line.partition(':')
+            value = value[1:] if value.startswith(' ') else value
+            if field == 'event':
+                event = value
+            elif field == 'data':
+                data.append(value)
+            continue
+        if data:
+            yield event or 'message', json.loads('\n'.join(data))
+        event, data = None, []
 
-@st.cache_data(ttl=300, show_spinner=False)
-def get_h2h(team1_id, team2_id, season):
-    try:
-        response = requests.get(f"{API_BASE}/h2h/{team1_id}/{team2_id}/{season}", timeout=10)
-        return response.json()
-    except:
-        return []
+def _listen_live(feed, date, client):
+    """Фоновый поток: держит SSE-подключение к /stream/games/<date> и обновляет
+    feed['games']. Переподключается при обрывах, завершается, когда счёт никто не смотрит"""
+    url = f"{API_BASE}/stream/games/{date}"
+    while time.monotonic() - feed['last_read'] < LIVE_IDLE_SECONDS:
+        started = time.perf_counter()
+        try:
+            with requests.get(url, stream=True, timeout=(5, LIVE_READ_TIMEOUT)) as response:
+                response.raise_for_status()
+                _record_fetch(client, 'stream', (time.perf_counter() - started) * 1000, status=response.status_code)
+                for event, data in _sse_events(response):
+                    if event == 'snapshot':
+                        games = {g['id']: g for g in data}
+                    elif event == 'update':
+                        games = dict(feed['games'])
+                        games.update((g['id'], g) for g in data['games'])
+                        for game_id in data['removed']:
+                            games.pop(game_id, None)
+                    else:
+                        continue
+                    with feed['lock']:
+                        feed['games'] = games
+                        feed['updated_at'] = datetime.now()
+                    if time.monotonic() - feed['last_read'] >= LIVE_IDLE_SECONDS:
+                        break
+        except Exception as e:
+            _record_fetch(client, 'stream', (time.perf_counter() - started) * 1000, error=e)
+            time.sleep(LIVE_RETRY_SECONDS)
 
-@st.cache_data(ttl=300, show_spinner=False)
-def get_h2h_averages(team1_id, team2_id, season):
-    try:
-        response = requests.get(f"{API_BASE}/h2h_averages/{team1_id}/{team2_id}/{season}", timeout=10)
-        return response.json()
-    except:
-        return {}
+@st.cache_resource(max_entries=8)
+def _live_feed(date):
+    """Общее для всех сессий состояние live-счёта за дату"""
+    return {'games': {}, 'updated_at': None, 'last_read': 0.0, 'thread': None, 'lock': threading.Lock()}
 
-@st.cache_data(ttl=300, show_spinner=False)
-def get_rest_days(team_id):
+def _live_games(date):
+    """Последние известные игры дня из SSE-потока {id: игра}; поток запускается при первом чтении"""
+    feed = _live_feed(date)
+    with feed['lock']:
+        feed['last_read'] = time.monotonic()
+        if feed['thread'] is None or not feed['thread'].is_alive():
+            feed['thread'] = threading.Thread(
+                target=_listen_live, args=(feed, date, _http_client()), daemon=True
+            )
+            feed['thread'].start()
+        return feed['games']
+
+def _fetch_parallel(calls):
+    """Выполнить независимые загрузки одновременно (не больше API_MAX_IN_FLIGHT).
+    calls: [(функция, аргументы...)]; вместо упавших загрузок возвращается None."""
+    ctx = get_script_run_ctx()
+    
+    def attach_ctx():
+        add_script_run_ctx(threading.current_thread(), ctx)
+    
+    def safe(func, *args):
+        try:
+            return func(*args)
+        except Exception:
+            return None
+    
+    with ThreadPoolExecutor(max_workers=API_MAX_IN_FLIGHT, initializer=attach_ctx) as pool:
+        futures = [pool.submit(safe, *call) for call in calls]
+        return [f.result() for f in futures]
+
+def _show_fetch_stats():
+    """Счётчики запросов к API в сайдбаре"""
+    client = _http_client()
+    with client['lock']:
+        stats = {k: dict(v) for k, v in client['stats'].items()}
+    if not stats:
+        return
+    
+    errors = sum(v['errors'] for v in stats.values())
+    with st.sidebar.expander(f"📡 Запросы к API (ошибок: {errors})", expanded=errors > 0):
+        st.dataframe(pd.DataFrame([
+            {
+                'Эндпоинт': endpoint,
+                'Запросов': v['requests'],
+                '304': v['not_modified'],
+                'Ошибок': v['errors'],
+                'Ср. мс': round(v['total_ms'] / v['requests']),
+                'Макс. мс': round(v['max_ms']),
+                'Последняя ошибка': v['last_error'] or ''
+            }
+            for endpoint, v in sorted(stats.items())
+        ]), use_container_width=True, hide_index=True)
+
+def _averages_or_none(averages):
+    return averages if averages and averages.get('games_count', 0) > 0 else None
+
+def _status_line(game):
+    """Дата, статус, счёт и четверти матча"""
+    line = f"**🕐 Дата:** {game['date'][:16]} | **📍 Статус:** {game['status']}"
+    if game.get('home_score') is not None and game.get('away_score') is not None:
+        line += f" | **🏀 Счёт:** {game['home_score']}-{game['away_score']}"
+    if game.get('quarters'):
+        line += " (" + ', '.join(f"{q['home_score']}-{q['away_score']}" for q in game['quarters'][:4]) + ")"
+    st.markdown(line)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def render_live_scores(date, games):
+    """Статус и счёт матчей списка из live-потока одной таблицей. Это единственный
+    фрагмент страницы с таймером: перерисовывается из памяти, без запросов к API,
+    а карточки матчей (в том числе свёрнутые) в перерисовке не участвуют."""
+    live_games = _live_games(date)
+    rows = []
+    for game in games:
+        current = live_games.get(game['id'], game)
+        has_score = current.get('home_score') is not None and current.get('away_score') is not None
+        rows.append({
+            'Матч': f"{game['home_team_name']} — {game['away_team_name']}",
+            'Статус': current['status'],
+            'Счёт': f"{current['home_score']}-{current['away_score']}" if has_score else '',
+            'Четверти': ', '.join(f"{q['home_score']}-{q['away_score']}" for q in (current.get('quarters') or [])[:4])
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+@st.fragment
+def render_match_card(game):
+    """Аналитика матча. Данные грузятся только после включения переключателя,
+    а фрагмент перерисовывается отдельно от остальной страницы."""
+    home_id = game['home_team_id']
+    away_id = game['away_team_id']
+    season = game['season']
+    
+    _status_line(game)
+    
+    if not st.toggle("📊 Показать аналитику", key=f"card_{game['id']}"):
+        return
+    
     try:
-        response = requests.get(f"{API_BASE}/team_rest_days/{team_id}", timeout=10)
-        return response.json()
-    except:
-        return {'rest_days': None}
+        with st.spinner("Загрузка аналитики..."):
+            card = get_match_card(game['id'])
+    except Exception:
+        st.warning("Не удалось загрузить аналитику матча")
+        return
+    
+    home_avg_5 = _averages_or_none(card['home']['averages'].get('5'))
+    away_avg_5 = _averages_or_none(card['away']['averages'].get('5'))
+    home_avg_10 = _averages_or_none(card['home']['averages'].get('10'))
+    away_avg_10 = _averages_or_none(card['away']['averages'].get('10'))
+    home_rest = card['home']['rest']
+    away_rest = card['away']['rest']
+    
+    st.markdown("### 📊 Средние показатели")
+    
+    col_left, col_right = st.columns(2)
+    
+    with col_left:
+        st.markdown(f"#### {game['home_team_name']} (Хозяева)")
+        if home_avg_5 and home_avg_10:
+            home_data = {
+                'Показатель': ['Дней отдыха', 'Ср. очки (5)', 'Ср. очки (10)', 
+                               'Q1 (5)', 'Q2 (5)', 'H1 (5)', 
+                               'Q3 (5)', 'Q4 (5)', 'H2 (5)'],
+                'Значение': [
+                    home_rest.get('rest_days', '-') if home_rest.get('rest_days') is not None else '-',
+                    f"{home_avg_5['avg_score']:.1f}",
+                    f"{home_avg_10['avg_score']:.1f}",
+                    f"{home_avg_5['quarters'].get('q1', 0):.1f}",
+                    f"{home_avg_5['quarters'].get('q2', 0):.1f}",
+                    f"{home_avg_5['halves'].get('h1', 0):.1f}",
+                    f"{home_avg_5['quarters'].get('q3', 0):.1f}",
+                    f"{home_avg_5['quarters'].get('q4', 0):.1f}",
+                    f"{home_avg_5['halves'].get('h2', 0):.1f}"
+                ]
+            }
+            st.dataframe(pd.DataFrame(home_data), use_container_width=True, hide_index=True)
+    
+    with col_right:
+        st.markdown(f"#### {game['away_team_name']} (Гости)")
+        if away_avg_5 and away_avg_10:
+            away_data = {
+                'Показатель': ['Дней отдыха', 'Ср. очки (5)', 'Ср. очки (10)', 
+                               'Q1 (5)', 'Q2 (5)', 'H1 (5)', 
+                               'Q3 (5)', 'Q4 (5)', 'H2 (5)'],
+                'Значение': [
+                    away_rest.get('rest_days', '-') if away_rest.get('rest_days') is not None else '-',
+                    f"{away_avg_5['avg_score']:.1f}",
+                    f"{away_avg_10['avg_score']:.1f}",
+                    f"{away_avg_5['quarters'].get('q1', 0):.1f}",
+                    f"{away_avg_5['quarters'].get('q2', 0):.1f}",
+                    f"{away_avg_5['halves'].get('h1', 0):.1f}",
+                    f"{away_avg_5['quarters'].get('q3', 0):.1f}",
+                    f"{away_avg_5['quarters'].get('q4', 0):.1f}",
+                    f"{away_avg_5['halves'].get('h2', 0):.1f}"
+                ]
+            }
+            st.dataframe(pd.DataFrame(away_data), use_container_width=True, hide_index=True)
+    
+    st.markdown("---")
+    st.markdown("### 🔄 Личные встречи (H2H)")
+    
+    h2h_games = card['h2h']
+    
+    if h2h_games:
+        h2h_data = []
+        for h2h in h2h_games:
+            quarters_str = ""
+            if h2h.get('quarters'):
+                home_q = [str(q.get('home_score', 0)) for q in h2h['quarters'][:4]]
+                away_q = [str(q.get('away_score', 0)) for q in h2h['quarters'][:4]]
+                quarters_str = f"H: {'-'.join(home_q)} | A: {'-'.join(away_q)}"
+            
+            h2h_data.append({
+                'Дата': h2h['date'][:10],
+                'Хозяева': h2h['home_team_name'],
+                'Гости': h2h['away_team_name'],
+                'Счёт': f"{h2h['home_score']}-{h2h['away_score']}" if h2h.get('home_score') else '-',
+                'Четверти': quarters_str
+            })
+        
+        st.dataframe(pd.DataFrame(h2h_data), use_container_width=True, hide_index=True)
+        
+        h2h_avg = card['h2h_averages']
+        
+        if h2h_avg and h2h_avg.get('games_count', 0) > 0:
+            st.markdown(f"**📈 Средние по {h2h_avg['games_count']} личным встречам:**")
+            
+            h2h_avg_data = {
+                'Команда': [game['home_team_name'], game['away_team_name']],
+                'Ср. очки': [f"{h2h_avg['team1_avg']:.1f}", f"{h2h_avg['team2_avg']:.1f}"],
+                'Q1': [
+                    f"{h2h_avg['team1_quarters'].get('q1', 0):.1f}",
+                    f"{h2h_avg['team2_quarters'].get('q1', 0):.1f}"
+                ],
+                'Q2': [
+                    f"{h2h_avg['team1_quarters'].get('q2', 0):.1f}",
+                    f"{h2h_avg['team2_quarters'].get('q2', 0):.1f}"
+                ],
+                'Q3': [
+                    f"{h2h_avg['team1_quarters'].get('q3', 0):.1f}",
+                    f"{h2h_avg['team2_quarters'].get('q3', 0):.1f}"
+                ],
+                'Q4': [
+                    f"{h2h_avg['team1_quarters'].get('q4', 0):.1f}",
+                    f"{h2h_avg['team2_quarters'].get('q4', 0):.1f}"
+                ]
+            }
+            
+            st.dataframe(pd.DataFrame(h2h_avg_data), use_container_width=True, hide_index=True)
+    else:
+        st.info(f"Нет личных встреч в сезоне {season}")
+    
+    st.markdown("---")
+    st.markdown("### 📈 Последние матчи")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown(f"#### {game['home_team_name']}")
+        home_last_5 = card['home']['last_games']
+        
+        if home_last_5:
+            last_games_data = []
+            for lg in home_last_5:
+                if lg['home_team_id'] == home_id:
+                    team_score = lg['home_score']
+                    opp_score = lg['away_score']
+                    is_home_game = True
+                else:
+                    team_score = lg['away_score']
+                    opp_score = lg['home_score']
+                    is_home_game = False
+                
+                quarters_str = ""
+                if lg.get('quarters'):
+                    q_scores = []
+                    for q in lg['quarters'][:4]:
+                        if is_home_game:
+                            q_scores.append(str(q.get('home_score', 0)))
+                        else:
+                            q_scores.append(str(q.get('away_score', 0)))
+                    quarters_str = f"{'-'.join(q_scores)}"
+                
+                last_games_data.append({
+                    'Дата': lg['date'][:10],
+                    'Соперник': lg['opponent_name'],
+                    'Место': lg['location'],
+                    'Счёт': f"{team_score}-{opp_score}",
+                    'Рез.': lg['result'] or '-',
+                    'Четверти': quarters_str
+                })
+            
+            st.dataframe(pd.DataFrame(last_games_data), use_container_width=True, hide_index=True)
+        else:
+            st.info("Нет данных")
+    
+    with col2:
+        st.markdown(f"#### {game['away_team_name']}")
+        away_last_5 = card['away']['last_games']
+        
+        if away_last_5:
+            last_games_data = []
+            for lg in away_last_5:
+                if lg['home_team_id'] == away_id:
+                    team_score = lg['home_score']
+                    opp_score = lg['away_score']
+                    is_home_game = True
+                else:
+                    team_score = lg['away_score']
+                    opp_score = lg['home_score']
+                    is_home_game = False
+                
+                quarters_str = ""
+                if lg.get('quarters'):
+                    q_scores = []
+                    for q in lg['quarters'][:4]:
+                        if is_home_game:
+                            q_scores.append(str(q.get('home_score', 0)))
+                        else:
+                            q_scores.append(str(q.get('away_score', 0)))
+                    quarters_str = f"{'-'.join(q_scores)}"
+                
+                last_games_data.append({
+                    'Дата': lg['date'][:10],
+                    'Соперник': lg['opponent_name'],
+                    'Место': lg['location'],
+                    'Счёт': f"{team_score}-{opp_score}",
+                    'Рез.': lg['result'] or '-',
+                    'Четверти': quarters_str
+                })
+            
+            st.dataframe(pd.DataFrame(last_games_data), use_container_width=True, hide_index=True)
+        else:
+            st.info("Нет данных")
 
 st.sidebar.header("Фильтры")
 
@@ -75,17 +450,24 @@ selected_date = st.sidebar.date_input(
 )
 date_str = selected_date.strftime('%Y-%m-%d')
 
-leagues = get_leagues()
-if not leagues.empty:
+# Счёт меняется только у сегодняшних матчей, поэтому live включён по умолчанию лишь для них
+live = st.sidebar.toggle("🔴 Live-счёт", value=selected_date == datetime.now().date())
+
+# Список строится только из /games; аналитика матча грузится при открытии карточки
+leagues, games = _fetch_parallel([(get_leagues,), (get_games, date_str)])
+if leagues is not None and not leagues.empty:
     league_options = ['Все лиги'] + leagues['name'].tolist()
     selected_league = st.sidebar.selectbox("Выберите лигу", league_options)
 else:
     selected_league = 'Все лиги'
 
-games = get_games(date_str)
+_show_fetch_stats()
 
 if not games:
-    st.info(f"📅 Нет игр на {date_str}")
+    if games is None:
+        st.error("⚠️ API недоступен — подробности в разделе «Запросы к API»")
+    else:
+        st.info(f"📅 Нет игр на {date_str}")
     st.stop()
 
 if selected_league != 'Все лиги':
@@ -93,205 +475,18 @@ if selected_league != 'Все лиги':
 
 st.success(f"📊 Найдено игр: **{len(games)}**")
 
+if live:
+    st.markdown("### 🔴 Live-счёт")
+    render_live_scores(date_str, games)
+
 for game in games:
-    home_id = game['home_team_id']
-    away_id = game['away_team_id']
-    season = game['season']
-    
     match_title = f"**{game['home_team_name']}** vs **{game['away_team_name']}** — {game['league_name']}"
     
     with st.expander(match_title, expanded=False):
-        st.markdown(f"**🕐 Дата:** {game['date'][:16]} | **📍 Статус:** {game['status']}")
-        
-        home_avg_5 = get_team_averages(home_id, 5)
-        away_avg_5 = get_team_averages(away_id, 5)
-        home_avg_10 = get_team_averages(home_id, 10)
-        away_avg_10 = get_team_averages(away_id, 10)
-        home_rest = get_rest_days(home_id)
-        away_rest = get_rest_days(away_id)
-        
-        st.markdown("### 📊 Средние показатели")
-        
-        col_left, col_right = st.columns(2)
-        
-        with col_left:
-            st.markdown(f"#### {game['home_team_name']} (Хозяева)")
-            if home_avg_5 and home_avg_10:
-                home_data = {
-                    'Показатель': ['Дней отдыха', 'Ср. очки (5)', 'Ср. очки (10)', 
-                                   'Q1 (5)', 'Q2 (5)', 'H1 (5)', 
-                                   'Q3 (5)', 'Q4 (5)', 'H2 (5)'],
-                    'Значение': [
-                        home_rest.get('rest_days', '-') if home_rest.get('rest_days') is not None else '-',
-                        f"{home_avg_5['avg_score']:.1f}",
-                        f"{home_avg_10['avg_score']:.1f}",
-                        f"{home_avg_5['quarters'].get('q1', 0):.1f}",
-                        f"{home_avg_5['quarters'].get('q2', 0):.1f}",
-                        f"{home_avg_5['halves'].get('h1', 0):.1f}",
-                        f"{home_avg_5['quarters'].get('q3', 0):.1f}",
-                        f"{home_avg_5['quarters'].get('q4', 0):.1f}",
-                        f"{home_avg_5['halves'].get('h2', 0):.1f}"
-                    ]
-                }
-                st.dataframe(pd.DataFrame(home_data), use_container_width=True, hide_index=True)
-        
-        with col_right:
-            st.markdown(f"#### {game['away_team_name']} (Гости)")
-            if away_avg_5 and away_avg_10:
-                away_data = {
-                    'Показатель': ['Дней отдыха', 'Ср. очки (5)', 'Ср. очки (10)', 
-                                   'Q1 (5)', 'Q2 (5)', 'H1 (5)', 
-                                   'Q3 (5)', 'Q4 (5)', 'H2 (5)'],
-                    'Значение': [
-                        away_rest.get('rest_days', '-') if away_rest.get('rest_days') is not None else '-',
-                        f"{away_avg_5['avg_score']:.1f}",
-                        f"{away_avg_10['avg_score']:.1f}",
-                        f"{away_avg_5['quarters'].get('q1', 0):.1f}",
-                        f"{away_avg_5['quarters'].get('q2', 0):.1f}",
-                        f"{away_avg_5['halves'].get('h1', 0):.1f}",
-                        f"{away_avg_5['quarters'].get('q3', 0):.1f}",
-                        f"{away_avg_5['quarters'].get('q4', 0):.1f}",
-                        f"{away_avg_5['halves'].get('h2', 0):.1f}"
-                    ]
-                }
-                st.dataframe(pd.DataFrame(away_data), use_container_width=True, hide_index=True)
-        
-        st.markdown("---")
-        st.markdown("### 🔄 Личные встречи (H2H)")
-        
-        h2h_games = get_h2h(home_id, away_id, season)
-        
-        if h2h_games:
-            h2h_data = []
-            for h2h in h2h_games:
-                quarters_str = ""
-                if h2h.get('quarters'):
-                    home_q = [str(q.get('home_score', 0)) for q in h2h['quarters'][:4]]
-                    away_q = [str(q.get('away_score', 0)) for q in h2h['quarters'][:4]]
-                    quarters_str = f"H: {'-'.join(home_q)} | A: {'-'.join(away_q)}"
-                
-                h2h_data.append({
-                    'Дата': h2h['date'][:10],
-                    'Хозяева': h2h['home_team_name'],
-                    'Гости': h2h['away_team_name'],
-                    'Счёт': f"{h2h['home_score']}-{h2h['away_score']}" if h2h.get('home_score') else '-',
-                    'Четверти': quarters_str
-                })
-            
-            st.dataframe(pd.DataFrame(h2h_data), use_container_width=True, hide_index=True)
-            
-            h2h_avg = get_h2h_averages(home_id, away_id, season)
-            
-            if h2h_avg and h2h_avg.get('games_count', 0) > 0:
-                st.markdown(f"**📈 Средние по {h2h_avg['games_count']} личным встречам:**")
-                
-                h2h_avg_data = {
-                    'Команда': [game['home_team_name'], game['away_team_name']],
-                    'Ср. очки': [f"{h2h_avg['team1_avg']:.1f}", f"{h2h_avg['team2_avg']:.1f}"],
-                    'Q1': [
-                        f"{h2h_avg['team1_quarters'].get('q1', 0):.1f}",
-                        f"{h2h_avg['team2_quarters'].get('q1', 0):.1f}"
-                    ],
-                    'Q2': [
-                        f"{h2h_avg['team1_quarters'].get('q2', 0):.1f}",
-                        f"{h2h_avg['team2_quarters'].get('q2', 0):.1f}"
-                    ],
-                    'Q3': [
-                        f"{h2h_avg['team1_quarters'].get('q3', 0):.1f}",
-                        f"{h2h_avg['team2_quarters'].get('q3', 0):.1f}"
-                    ],
-                    'Q4': [
-                        f"{h2h_avg['team1_quarters'].get('q4', 0):.1f}",
-                        f"{h2h_avg['team2_quarters'].get('q4', 0):.1f}"
-                    ]
-                }
-                
-                st.dataframe(pd.DataFrame(h2h_avg_data), use_container_width=True, hide_index=True)
-        else:
-            st.info(f"Нет личных встреч в сезоне {season}")
-        
-        st.markdown("---")
-        st.markdown("### 📈 Последние матчи")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown(f"#### {game['home_team_name']}")
-            home_last_5 = get_last_games(home_id, 5)
-            
-            if home_last_5:
-                last_games_data = []
-                for lg in home_last_5:
-                    if lg['home_team_id'] == home_id:
-                        team_score = lg['home_score']
-                        opp_score = lg['away_score']
-                        is_home_game = True
-                    else:
-                        team_score = lg['away_score']
-                        opp_score = lg['home_score']
-                        is_home_game = False
-                    
-                    quarters_str = ""
-                    if lg.get('quarters'):
-                        q_scores = []
-                        for q in lg['quarters'][:4]:
-                            if is_home_game:
-                                q_scores.append(str(q.get('home_score', 0)))
-                            else:
-                                q_scores.append(str(q.get('away_score', 0)))
-                        quarters_str = f"{'-'.join(q_scores)}"
-                    
-                    last_games_data.append({
-                        'Дата': lg['date'][:10],
-                        'Соперник': lg['opponent_name'],
-                        'Место': lg['location'],
-                        'Счёт': f"{team_score}-{opp_score}",
-                        'Рез.': lg['result'] or '-',
-                        'Четверти': quarters_str
-                    })
-                
-                st.dataframe(pd.DataFrame(last_games_data), use_container_width=True, hide_index=True)
-            else:
-                st.info("Нет данных")
-        
-        with col2:
-            st.markdown(f"#### {game['away_team_name']}")
-            away_last_5 = get_last_games(away_id, 5)
-            
-            if away_last_5:
-                last_games_data = []
-                for lg in away_last_5:
-                    if lg['home_team_id'] == away_id:
-                        team_score = lg['home_score']
-                        opp_score = lg['away_score']
-                        is_home_game = True
-                    else:
-                        team_score = lg['away_score']
-                        opp_score = lg['home_score']
-                        is_home_game = False
-                    
-                    quarters_str = ""
-                    if lg.get('quarters'):
-                        q_scores = []
-                        for q in lg['quarters'][:4]:
-                            if is_home_game:
-                                q_scores.append(str(q.get('home_score', 0)))
-                            else:
-                                q_scores.append(str(q.get('away_score', 0)))
-                        quarters_str = f"{'-'.join(q_scores)}"
-                    
-                    last_games_data.append({
-                        'Дата': lg['date'][:10],
-                        'Соперник': lg['opponent_name'],
-                        'Место': lg['location'],
-                        'Счёт': f"{team_score}-{opp_score}",
-                        'Рез.': lg['result'] or '-',
-                        'Четверти': quarters_str
-                    })
-                
-                st.dataframe(pd.DataFrame(last_games_data), use_container_width=True, hide_index=True)
-            else:
-                st.info("Нет данных")
+        render_match_card(game)
 
 st.markdown("---")
-st.markdown("*Данные обновляются автоматически каждые 60 секунд*")
+if live:
+    st.markdown("*Live-счёт обновляется в реальном времени, список матчей и карточки — раз в 60 секунд*")
+else:
+    st.markdown("*Список матчей обновляется раз в 60 секунд*")
@@ -0,0 +1,206 @@
+"""Нагрузочная проверка запущенного API: смесь запросов дашборда в несколько потоков.
+
+    python3 bench_api.py --url http://127.0.0.1:5000/api --date 2025-01-02
+    python3 bench_api.py --clients 64 --seconds 60 --target-rps 800 --target-p99-ms 150
+    python3 bench_api.py --target-cold-rps 100 --target-cold-p99-ms 500
+
+Два прогона по --seconds. Тёплый: набор URL строится от игр выбранной даты
+(список игр и лиг, карточки матчей, средние и дни отдыха команд, последние
+игры, личные встречи) и повторяется — после первого прохода почти всё берётся
+из кэша ответов API. Холодный: та же смесь эндпоинтов, но каждый URL
+запрашивается один раз — игры за --cold-days дней до даты, средние и последние
+игры с лимитами 1..COLD_MAX_LIMIT; кэш API ключуется по аргументам пути, так что
+ответы считаются заново. Доля попаданий в кэш (из Server-Timing) печатается
+по эндпоинтам: холодный прогон после перезапуска API даёт около нуля.
+Каждый клиент — отдельный поток со своим keep-alive соединением. Печатаются
+RPS и p50/p99 по эндпоинтам и в целом; если заданы цели и результат до них
+не дотягивает, код возврата 1.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import requests
+
+COLD_MAX_LIMIT = 20
+
+
+def build_urls(base, date):
+    """URL смеси запросов для игр даты"""
+    games = requests.get(f"{base}/games/{date}", timeout=30).json()
+    urls = [f"{base}/leagues", f"{base}/games/{date}"]
+    for g in games:
+        home, away = g['home_team_id'], g['away_team_id']
+        urls += [
+            f"{base}/match_card/{g['id']}",
+            f"{base}/team_averages/{home}/10",
+            f"{base}/team_rest_days/{away}",
+            f"{base}/last_games/{home}/5",
+            f"{base}/h2h/{home}/{away}/{g['season']}",
+            f"{base}/h2h_averages/{home}/{away}/{g['season']}",
+        ]
+    return urls, len(games)
+
+
+def build_cold_urls(base, date, days, exclude=()):
+    """Неповторяющиеся URL по эндпоинтам тёплой смеси для игр days дат до date
+    включительно: {эндпоинт: перемешанный список}. exclude — уже запрошенные URL"""
+    pools = {}
+    day = datetime.strptime(date, '%Y-%m-%d')
+    for offset in range(days):
+        games = requests.get(f"{base}/games/{(day - timedelta(days=offset)):%Y-%m-%d}", timeout=30).json()
+        for g in games:
+            home, away = g['home_team_id'], g['away_team_id']
+            pools.setdefault('match_card', set()).add(f"{base}/match_card/{g['id']}")
+            for first, second in ((home, away), (away, home)):
+                pools.setdefault('team_rest_days', set()).add(f"{base}/team_rest_days/{first}")
+                pools.setdefault('h2h', set()).add(f"{base}/h2h/{first}/{second}/{g['season']}")
+                pools.setdefault('h2h_averages', set()).add(f"{base}/h2h_averages/{first}/{second}/{g['season']}")
+                for limit in range(1, COLD_MAX_LIMIT + 1):
+                    pools.setdefault('team_averages', set()).add(f"{base}/team_averages/{first}/{limit}")
+                    pools.setdefault('last_games', set()).add(f"{base}/last_games/{first}/{limit}")
+    exclude = set(exclude)
+    rnd = random.Random(0)
+    return {endpoint: rnd.sample(sorted(urls - exclude), len(urls - exclude)) for endpoint, urls in pools.items()}
+
+
+def _client(next_url, deadline, results):
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        url = next_url()
+        if url is None:
+            break
+        started = time.perf_counter()
+        try:
+            response = session.get(url, timeout=30)
+            ok = response.status_code == 200
+            hit = 'cache;desc=hit' in response.headers.get('Server-Timing', '')
+        except requests.RequestException:
+            ok = hit = False
+        results.append((url, (time.perf_counter() - started) * 1000, ok, hit))
+
+
+def warm_picker(urls, seed):
+    """Случайный URL из набора (с повторами)"""
+    rnd = random.Random(seed)
+    return lambda: rnd.choice(urls)
+
+
+def cold_picker(pools, seed):
+    """Случайный эндпоинт и ещё не запрошенный URL из его набора; эндпоинт с
+    исчерпанным набором выпадает из смеси, None — когда кончились все
+    (list.pop атомарен, наборы общие для всех клиентов)"""
+    rnd = random.Random(seed)
+
+    def pick():
+        while True:
+            endpoints = [endpoint for endpoint in sorted(pools) if pools[endpoint]]
+            if not endpoints:
+                return None
+            try:
+                return pools[rnd.choice(endpoints)].pop()
+            except IndexError:
+                continue
+    return pick
+
+
+def run(pickers, seconds):
+    """Прогнать смесь, по клиенту на выбор URL из pickers:
+    [(url, мс, успех, попадание в кэш)] и фактическая длительность"""
+    results = []
+    started = time.monotonic()
+    deadline = started + seconds
+    threads = [threading.Thread(target=_client, args=(pick, deadline, results)) for pick in pickers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.monotonic() - started
+
+
+def _endpoint(url, base):
+    return url[len(base) + 1:].split('/', 1)[0]
+
+
+def report(results, elapsed, base):
+    """Печать таблицы по эндпоинтам; возвращает (rps, p99 мс, ошибок)"""
+    by_endpoint = {}
+    for url, ms, ok, hit in results:
+        by_endpoint.setdefault(_endpoint(url, base), []).append((ms, ok, hit))
+
+    print(f"{'эндпоинт':<16}{'запросов':>10}{'ошибок':>8}{'кэш %':>8}{'p50 мс':>9}{'p99 мс':>9}")
+    for endpoint, rows in sorted(by_endpoint.items()):
+        ms = np.array([r[0] for r in rows])
+        errors = sum(1 for r in rows if not r[1])
+        hits = 100 * sum(1 for r in rows if r[2]) / len(rows)
+        print(f"{endpoint:<16}{len(rows):>10}{errors:>8}{hits:>8.0f}"
+              f"{np.percentile(ms, 50):>9.1f}{np.percentile(ms, 99):>9.1f}")
+
+    if not results:
+        print("Нет ни одного запроса")
+        return 0.0, float('inf'), 0
+    ms = np.array([r[1] for r in results])
+    errors = sum(1 for r in results if not r[2])
+    hits = 100 * sum(1 for r in results if r[3]) / len(results)
+    rps = len(results) / elapsed
+    p50, p99 = np.percentile(ms, [50, 99])
+    print(f"{'всего':<16}{len(results):>10}{errors:>8}{hits:>8.0f}{p50:>9.1f}{p99:>9.1f}")
+    print(f"RPS: {rps:.0f} за {elapsed:.1f} с")
+    return rps, p99, errors
+
+
+def _check_targets(name, rps, p99, errors, target_rps, target_p99_ms):
+    """Строки о недостигнутых целях прогона name"""
+    failed = []
+    if errors:
+        failed.append(f"{name}: ошибок {errors}")
+    if target_rps and rps < target_rps:
+        failed.append(f"{name}: RPS {rps:.0f} < {target_rps:g}")
+    if target_p99_ms and p99 > target_p99_ms:
+        failed.append(f"{name}: p99 {p99:.1f} мс > {target_p99_ms:g}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000/api', help='адрес API')
+    parser.add_argument('--date', default=datetime.now().strftime('%Y-%m-%d'), help='дата игр для смеси запросов')
+    parser.add_argument('--clients', type=int, default=32, help='параллельных клиентов')
+    parser.add_argument('--seconds', type=float, default=30, help='длительность каждого прогона')
+    parser.add_argument('--cold-days', type=int, default=30, help='дней игр для холодного прогона')
+    parser.add_argument('--target-rps', type=float, help='минимально допустимый RPS тёплого прогона')
+    parser.add_argument('--target-p99-ms', type=float, help='максимально допустимый p99 тёплого прогона')
+    parser.add_argument('--target-cold-rps', type=float, help='минимально допустимый RPS холодного прогона')
+    parser.add_argument('--target-cold-p99-ms', type=float, help='максимально допустимый p99 холодного прогона')
+    args = parser.parse_args()
+
+    base = args.url.rstrip('/')
+    urls, games = build_urls(base, args.date)
+    print(f"Тёплый прогон, {args.date}: игр {games}, URL в смеси {len(urls)}, клиентов {args.clients}")
+    warm = report(*run([warm_picker(urls, i) for i in range(args.clients)], args.seconds), base)
+
+    pools = build_cold_urls(base, args.date, args.cold_days, exclude=urls)
+    sizes = {endpoint: len(pool) for endpoint, pool in pools.items()}
+    print(f"\nХолодный прогон, {args.cold_days} дней до {args.date}: неповторяющихся URL {sum(sizes.values())} "
+          f"(" + ', '.join(f"{endpoint} {size}" for endpoint, size in sorted(sizes.items())) + ")")
+    results, elapsed = run([cold_picker(pools, i) for i in range(args.clients)], args.seconds)
+    cold = report(results, elapsed, base)
+    if elapsed < args.seconds * 0.99:
+        print(f"URL кончились за {elapsed:.1f} с: для более длинного прогона увеличьте --cold-days")
+    exhausted = [endpoint for endpoint, pool in sorted(pools.items()) if not pool]
+    if exhausted and elapsed >= args.seconds * 0.99:
+        print(f"Выпали из смеси до конца прогона: {', '.join(exhausted)}")
+
+    failed = (_check_targets('тёплый', *warm, args.target_rps, args.target_p99_ms)
+              + _check_targets('холодный', *cold, args.target_cold_rps, args.target_cold_p99_ms))
+    if failed:
+        print("Цель не достигнута: " + '; '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Бенчмарк горячих путей: все маршруты /api/... и отрисовка страницы app.py.
+
+    python3 make_synthetic_db.py --games 100k --out bench_results/db_100k.db
+    python3 benchmark.py --db bench_results/db_100k.db
+    python3 benchmark.py --db bench_results/db_100k.db --compare bench_results/<прошлый>.json
+    python3 benchmark.py --db bench_results/db_100k.db --snapshot --compare bench_results/<без снимка>.json
+
+Маршруты вызываются в процессе через тестовый клиент Flask (без сети), URL
+собираются из игр выбранной даты по именам параметров маршрута, так что новые
+эндпоинты попадают в замер сами. Каждый маршрут меряется дважды: cold — кэш
+ответов сбрасывается перед каждым запросом (чистое время вычисления), warm —
+ответ из кэша. Для /api/stream — время до первого события (снимка дня).
+Страница дашборда отрисовывается через streamlit AppTest против API, поднятого
+в этом же процессе: список игр и список с открытой карточкой матча.
+С --snapshot API отвечает из снимка истории в памяти (API_SNAPSHOT=1), снимок
+строится до замеров; сравнение с прогоном без него показывает выигрыш.
+
+Результат (p50/p99 мс и запросов/с на маршрут) пишется в
+bench_results/<время>_<коммит>.json; --compare печатает разницу с прошлым
+прогоном и завершается с кодом 1, если p50 где-то вырос больше --threshold.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import api_server
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_results')
+SAMPLE_GAMES = 20
+LIMIT = 10
+# Параметры маршрутов, которые умеет подставлять бенчмарк (порядок — как в route_urls)
+ROUTE_VALUES = ('date', 'game_id', 'team_id', 'team1_id', 'team2_id', 'season', 'limit')
+# Дополнительные параметры запроса для маршрутов, которым они нужны
+ROUTE_QUERIES = {
+    'export_games': ['format=ndjson&limit=10000', 'format=arrow&limit=10000'],
+}
+# Тела POST-маршрутов по командам всех игр даты
+ROUTE_BODIES = {
+    'post_team_averages': lambda team_ids: {'team_ids': team_ids, 'windows': [5, 10, 20]},
+    'post_team_rest_days': lambda team_ids: {'team_ids': team_ids},
+    'post_last_games': lambda team_ids: {'team_ids': team_ids, 'limit': LIMIT},
+}
+# Регрессией считается рост p50 больше --threshold и больше этого числа мс:
+# у ответов из кэша (доли миллисекунды) шум измерения больше самой разницы
+COMPARE_MIN_DELTA_MS = 0.2
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+def _sample_games(conn, date):
+    rows = conn.execute(
+        "SELECT id, home_team_id, away_team_id, season FROM games WHERE date >= ? AND date < ? ORDER BY id",
+        api_server._day_range(date)
+    ).fetchall()
+    step = max(1, len(rows) // SAMPLE_GAMES)
+    return rows[::step][:SAMPLE_GAMES]
+
+
+def route_urls(date, games):
+    """{имя: [url, ...]} для всех маршрутов /api; параметры GET подставляются по имени,
+    POST-маршруты получают тело из ROUTE_BODIES (url тогда — пара (путь, тело))"""
+    adapter = api_server.app.url_map.bind('localhost')
+    team_ids = sorted({t for game in games for t in game[1:3]})
+    urls = {}
+    for rule in sorted(api_server.app.url_map.iter_rules(), key=lambda r: r.rule):
+        if not rule.rule.startswith('/api/'):
+            continue
+        if 'POST' in rule.methods:
+            if rule.endpoint not in ROUTE_BODIES:
+                print(f"[skip] POST {rule.rule}: нет тела в ROUTE_BODIES")
+                continue
+            urls[rule.endpoint] = [(rule.rule, ROUTE_BODIES[rule.endpoint](team_ids))]
+            continue
+        missing = rule.arguments - set(ROUTE_VALUES)
+        if missing:
+            print(f"[skip] {rule.rule}: нет значений для {', '.join(sorted(missing))}")
+            continue
+        # маршрутам без параметров игры хватает одного URL
+        sample = games if rule.arguments - {'date'} else games[:1]
+        paths = []
+        for game in sample:
+            values = dict(zip(ROUTE_VALUES, (date, game[0], game[1], game[1], game[2], game[3], LIMIT)))
+            paths.append(adapter.build(rule.endpoint, {k: values[k] for k in rule.arguments}))
+        for query in ROUTE_QUERIES.get(rule.endpoint, [None]):
+            name = rule.endpoint if query is None else f"{rule.endpoint}[{query.split('&')[0]}]"
+            urls[name] = [f"{p}?{query}" if query else p for p in paths]
+    return urls
+
+
+def _drop_cache():
+    """Следующий запрос начнёт кэш ответов и снимки live-потока заново"""
+    with api_server._cache_lock:
+        api_server._cache_generation = None
+    with api_server._stream_lock:
+        api_server._stream_cache.clear()
+
+
+def _request(client, url):
+    if isinstance(url, tuple):
+        return client.post(url[0], json=url[1]).status_code
+    if url.startswith('/api/stream/'):
+        # поток бесконечный: берём первое событие и закрываем
+        response = client.get(url, buffered=False)
+        next(response.iter_encoded())
+        response.close()
+        return response.status_code
+    return client.get(url).status_code
+
+
+def measure(client, urls, iterations, cold):
+    """Прогнать url по кругу iterations раз: [мс]"""
+    for url in urls:
+        status = _request(client, url)
+        if status != 200:
+            raise RuntimeError(f"{url}: HTTP {status}")
+    timings = []
+    for i in range(iterations):
+        url = urls[i % len(urls)]
+        if cold:
+            _drop_cache()
+        started = time.perf_counter()
+        _request(client, url)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summary(timings):
+    ms = np.array(timings)
+    p50, p99 = np.percentile(ms, [50, 99])
+    return {'n': len(ms), 'p50_ms': round(p50, 3), 'p99_ms': round(p99, 3), 'rps': round(1000 / ms.mean(), 1)}
+
+
+def bench_routes(date, iterations):
+    conn = sqlite3.connect(api_server.DB_PATH)
+    try:
+        games = _sample_games(conn, date)
+    finally:
+        conn.close()
+    if not games:
+        raise SystemExit(f"На {date} нет игр — укажите --date")
+
+    client = api_server.app.test_client()
+    results = {}
+    for name, urls in sorted(route_urls(date, games).items()):
+        for mode in ('cold', 'warm'):
+            results[f"{name}:{mode}"] = summary(measure(client, urls, iterations, mode == 'cold'))
+            _print_row(f"{name}:{mode}", results[f"{name}:{mode}"])
+    api_server._release_conn()
+    return results
+
+
+def bench_page(date, iterations):
+    """Отрисовка app.py через AppTest против API в этом же процессе"""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, api_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['BASKETBALL_API'] = f"http://127.0.0.1:{server.server_port}/api"
+    day = datetime.strptime(date, '%Y-%m-%d').date()
+    results = {}
+    try:
+        for name, open_card in (('page', False), ('page+card', True)):
+            timings = []
+            for _ in range(iterations):
+                # холодный старт: без кэша ответов API и загрузчиков st.cache_data
+                _drop_cache()
+                st.cache_data.clear()
+                at = AppTest.from_file(APP_PATH, default_timeout=120)
+                started = time.perf_counter()
+                at.run()
+                if day != datetime.now().date():
+                    at.sidebar.date_input[0].set_value(day).run()
+                if open_card:
+                    at.toggle(key=next(t.key for t in at.toggle if t.key and t.key.startswith('card_'))).set_value(True).run()
+                timings.append((time.perf_counter() - started) * 1000)
+                if at.exception:
+                    raise RuntimeError(f"{name}: {at.exception[0].value}")
+            results[name] = summary(timings)
+            _print_row(name, results[name])
+    finally:
+        server.shutdown()
+    return results
+
+
+def _print_row(name, r):
+    print(f"{name:<40}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['rps']:>10.1f}")
+
+
+def _git_commit():
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline_path, threshold):
+    """Разница p50 с прошлым прогоном; возвращает число регрессий больше threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nСравнение с {baseline_path} ({baseline['meta']['commit']})")
+    regressions = 0
+    for name, r in sorted(results.items()):
+        old = baseline['results'].get(name)
+        if not old:
+            print(f"{name:<40}{'новый':>10}")
+            continue
+        change = r['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0
+        mark = ''
+        if change > threshold and r['p50_ms'] - old['p50_ms'] > COMPARE_MIN_DELTA_MS:
+            regressions += 1
+            mark = '  ❌'
+        print(f"{name:<40}{old['p50_ms']:>10.2f}{r['p50_ms']:>10.2f}{change:>+10.0%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=api_server.DB_PATH, help='путь к БД (например, из make_synthetic_db.py)')
+    parser.add_argument('--date', default=datetime.now().strftime('%Y-%m-%d'), help='дата игр для URL')
+    parser.add_argument('--iterations', type=int, default=200, help='запросов на маршрут в каждом режиме')
+    parser.add_argument('--page-iterations', type=int, default=5, help='отрисовок страницы')
+    parser.add_argument('--skip-page', action='store_true', help='не мерить app.py')
+    parser.add_argument('--snapshot', action='store_true', help='снимок истории в памяти (API_SNAPSHOT=1)')
+    parser.add_argument('--compare', help='JSON прошлого прогона')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост p50 (доля)')
+    args = parser.parse_args()
+
+    api_server.DB_PATH = os.environ['BASKETBALL_DB'] = args.db
+    conn = sqlite3.connect(args.db)
+    games_total = conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+    conn.close()
+
+    meta = {
+        'commit': _git_commit(), 'started_at': datetime.now().isoformat(timespec='seconds'),
+        'db': os.path.abspath(args.db), 'games': games_total, 'date': args.date,
+        'iterations': args.iterations, 'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version, 'machine': platform.machine(), 'cpus': os.cpu_count(),
+    }
+    if args.snapshot:
+        api_server.SNAPSHOT_ENABLED = True
+        generation = api_server._data_generation()
+        api_server._release_conn()
+        api_server._load_snapshot(generation)
+        meta['snapshot'] = api_server._snapshot_info()
+        print(f"Снимок истории: {meta['snapshot']['bytes'] / 2**20:.1f} МБ за {meta['snapshot']['load_seconds']:.1f} с")
+    print(f"{args.db}: игр {games_total}, дата {args.date}, коммит {meta['commit']}")
+    print(f"{'маршрут':<40}{'p50 мс':>10}{'p99 мс':>10}{'запр/с':>10}")
+    results = bench_routes(args.date, args.iterations)
+    if not args.skip_page:
+        results.update(bench_page(args.date, args.page_iterations))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}_{meta['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=1)
+    print(f"\nРезультаты: {path}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""Сверка средних API с исходной реализацией /api/team_averages на неполных данных.
+
+    python3 check_api.py                           # синтетическая БД на 5k игр
+    python3 check_api.py --games 20k --seed 3
+    python3 check_api.py --db data/basketball.db   # копия боевой БД
+
+Средние команды за окна API отдаёт несколькими путями: GET /api/team_averages
+по SQLite и по team_games, готовые окна team_rolling_stats, карточки матча и
+дня, пакетный POST /api/team_averages и снимок истории в памяти (API_SNAPSHOT=1).
+Все они должны совпадать с исходной реализацией (baseline_team_averages):
+последние N завершённых игр со счётом и цикл по четвертям, где пустой счёт
+четверти — 0, а отсутствующая четверть не учитывается. Окна с играми, где
+четверть записана дважды, не сверяются: исходный цикл считает каждую строку,
+а движок team_stats — последнюю (их число печатается).
+
+Сверка идёт на временной копии БД в три прохода: без производных таблиц,
+после aggregates.py refresh --full и со снимком истории. Без --db копия
+строится make_synthetic_db.py — в ней есть завершённые игры без итогового
+счёта, четверти с пустым счётом и игры без четвертей. Код возврата 1 при
+любом расхождении.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+import aggregates
+import api_server
+import db_migrate
+import make_synthetic_db
+
+WINDOWS = (5, 7, 10, 20)
+# Первые расхождения каждого пути печатаются целиком
+SHOW_MISMATCHES = 3
+DAY_CARDS_DATES = 10
+
+# Исходный запрос /api/team_averages; ORDER BY дополнен g.id, как во всех путях API,
+# иначе порядок игр одной даты не определён
+SQL_BASELINE_GAMES = """
+SELECT g.*,
+       CASE WHEN g.home_team_id = ? THEN g.home_score ELSE g.away_score END as team_score,
+       CASE WHEN g.home_team_id = ? THEN g.away_score ELSE g.home_score END as opponent_score,
+       CASE WHEN g.home_team_id = ? THEN 1 ELSE 0 END as is_home
+FROM games g
+WHERE (g.home_team_id = ? OR g.away_team_id = ?)
+  AND g.status = 'FT'
+  AND g.home_score IS NOT NULL
+  AND g.away_score IS NOT NULL
+ORDER BY g.date DESC, g.id
+LIMIT ?
+"""
+
+# Неполные данные, которые должна покрывать сверка
+SQL_COVERAGE = {
+    'завершённых игр без счёта': "SELECT COUNT(*) FROM games WHERE status = 'FT' AND (home_score IS NULL OR away_score IS NULL)",
+    'игр с пустым счётом четверти': """
+        SELECT COUNT(DISTINCT q.game_id) FROM quarters q JOIN games g ON g.id = q.game_id
+        WHERE g.status = 'FT' AND (q.home_score IS NULL OR q.away_score IS NULL)""",
+    'завершённых игр без четвертей': """
+        SELECT COUNT(*) FROM games g WHERE g.status = 'FT'
+          AND NOT EXISTS (SELECT 1 FROM quarters q WHERE q.game_id = g.id)""",
+}
+
+# Игры с повторяющейся четвертью: их движок считает иначе, чем исходный цикл
+SQL_DUPLICATE_QUARTERS = """
+SELECT DISTINCT game_id
+FROM quarters
+GROUP BY game_id, quarter_num
+HAVING COUNT(*) > 1
+"""
+
+# Команды, у которых в последних играх есть игры без счёта, — в начало выборки
+SQL_TEAMS = """
+SELECT team_id, SUM(unscored) as unscored
+FROM (
+    SELECT home_team_id as team_id, home_score IS NULL OR away_score IS NULL as unscored
+    FROM games WHERE status = 'FT'
+    UNION ALL
+    SELECT away_team_id as team_id, home_score IS NULL OR away_score IS NULL as unscored
+    FROM games WHERE status = 'FT'
+)
+GROUP BY team_id
+ORDER BY unscored DESC, team_id
+LIMIT ?
+"""
+
+SQL_TEAM_LAST_GAME = """
+SELECT id, substr(date, 1, 10) as day
+FROM games
+WHERE home_team_id = ? OR away_team_id = ?
+ORDER BY date DESC, id
+LIMIT 1
+"""
+
+
+def baseline_team_averages(conn, team_id, limit):
+    """Исходная реализация /api/team_averages (до движка team_stats);
+    conn — соединение с row_factory = sqlite3.Row"""
+    games = conn.execute(SQL_BASELINE_GAMES, (team_id, team_id, team_id, team_id, team_id, limit)).fetchall()
+
+    if not games:
+        return {
+            'games_count': 0,
+            'avg_score': 0,
+            'avg_opponent_score': 0,
+            'avg_total': 0,
+            'quarters': {},
+            'halves': {}
+        }
+
+    avg_score = sum(g['team_score'] for g in games) / len(games)
+    avg_opponent = sum(g['opponent_score'] for g in games) / len(games)
+    avg_total = avg_score + avg_opponent
+
+    quarters_sum = {'q1': [], 'q2': [], 'q3': [], 'q4': []}
+
+    for game in games:
+        quarters = conn.execute("SELECT * FROM quarters WHERE game_id = ? ORDER BY quarter_num", (game['id'],)).fetchall()
+
+        if quarters:
+            for q in quarters:
+                quarter_num = q['quarter_num']
+                if quarter_num <= 4:
+                    if game['is_home']:
+                        score = q['home_score'] or 0
+                    else:
+                        score = q['away_score'] or 0
+
+                    quarters_sum[f'q{quarter_num}'].append(score)
+
+    quarters_avg = {}
+    for q_key, scores in quarters_sum.items():
+        if scores:
+            quarters_avg[q_key] = round(sum(scores) / len(scores), 1)
+        else:
+            quarters_avg[q_key] = 0
+
+    halves_avg = {}
+    if quarters_avg.get('q1', 0) > 0 and quarters_avg.get('q2', 0) > 0:
+        halves_avg['h1'] = round(quarters_avg['q1'] + quarters_avg['q2'], 1)
+    else:
+        halves_avg['h1'] = 0
+
+    if quarters_avg.get('q3', 0) > 0 and quarters_avg.get('q4', 0) > 0:
+        halves_avg['h2'] = round(quarters_avg['q3'] + quarters_avg['q4'], 1)
+    else:
+        halves_avg['h2'] = 0
+
+    return {
+        'games_count': len(games),
+        'avg_score': round(avg_score, 1),
+        'avg_opponent_score': round(avg_opponent, 1),
+        'avg_total': round(avg_total, 1),
+        'quarters': quarters_avg,
+        'halves': halves_avg
+    }
+
+
+def _copy_db(source, target):
+    """Согласованная копия БД (вместе с WAL) через backup API SQLite"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _drop_cache():
+    with api_server._cache_lock:
+        api_server._cache_generation = None
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url}: HTTP {response.status_code}")
+    return json.loads(response.get_data())
+
+
+def _compare(report, path, key, got, expected):
+    """Учесть ответ пути: report[path] = [сверено, расхождений]"""
+    counts = report.setdefault(path, [0, 0])
+    counts[0] += 1
+    if got != expected:
+        counts[1] += 1
+        if counts[1] <= SHOW_MISMATCHES:
+            print(f"  ≠ {path} {key}:\n    API      {got}\n    baseline {expected}")
+
+
+def check_paths(client, expected, cards, dates):
+    """Сверить все пути средних с baseline; вернуть {путь: [сверено, расхождений]}"""
+    report = {}
+    team_ids = sorted({team_id for team_id, _ in expected})
+    for (team_id, window), averages in expected.items():
+        got = _get(client, f'/api/team_averages/{team_id}/{window}')
+        _compare(report, 'GET team_averages', (team_id, window), got, averages)
+
+    response = client.post('/api/team_averages', json={'team_ids': team_ids, 'windows': list(WINDOWS)})
+    batch = json.loads(response.get_data())
+    for (team_id, window), averages in expected.items():
+        _compare(report, 'POST team_averages', (team_id, window), batch[str(team_id)][str(window)], averages)
+
+    def compare_card(path, card):
+        for side in ('home', 'away'):
+            team_id = card[side]['team_id']
+            for window in api_server.MATCH_CARD_WINDOWS:
+                if (team_id, window) in expected:
+                    _compare(report, path, (card['game']['id'], team_id, window),
+                             card[side]['averages'][str(window)], expected[(team_id, window)])
+
+    for game_id in cards:
+        compare_card('match_card', _get(client, f'/api/match_card/{game_id}'))
+    for date in dates:
+        for card in _get(client, f'/api/day_cards/{date}')['cards']:
+            compare_card('day_cards', card)
+    return report
+
+
+def run_checks(db_path, teams_limit):
+    """Три прохода сверки по копии БД; вернуть общее число расхождений"""
+    api_server.DB_PATH = db_path
+    conn = sqlite3.connect(db_path)
+    reader = sqlite3.connect(db_path)
+    reader.row_factory = sqlite3.Row
+    try:
+        for name, query in SQL_COVERAGE.items():
+            count = reader.execute(query).fetchone()[0]
+            print(f"{name}: {count}" + ('' if count else '  (этот случай сверка не покрывает)'))
+
+        # первый проход — по исходным таблицам
+        with conn:
+            for table in ('team_games', 'team_games_source', 'team_rolling_stats', 'h2h_season', 'aggregates_source'):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+        duplicates = {row['game_id'] for row in reader.execute(SQL_DUPLICATE_QUARTERS)}
+        print(f"игр с повторяющейся четвертью: {len(duplicates)}" + ('  (их окна не сверяются)' if duplicates else ''))
+
+        team_ids = [row['team_id'] for row in reader.execute(SQL_TEAMS, (teams_limit,))]
+        expected = {}
+        for team_id in team_ids:
+            for window in WINDOWS:
+                games = reader.execute(SQL_BASELINE_GAMES, (team_id,) * 5 + (window,)).fetchall()
+                if not duplicates.intersection(g['id'] for g in games):
+                    expected[(team_id, window)] = baseline_team_averages(reader, team_id, window)
+        last_games = [reader.execute(SQL_TEAM_LAST_GAME, (team_id, team_id)).fetchone() for team_id in team_ids]
+        cards = sorted({row['id'] for row in last_games})
+        dates = sorted({row['day'] for row in last_games}, reverse=True)[:DAY_CARDS_DATES]
+        print(f"Команд: {len(team_ids)}, окна {', '.join(map(str, WINDOWS))} (сверяется {len(expected)}), "
+              f"карточек матчей: {len(cards)}, дней: {len(dates)}\n")
+
+        client = api_server.app.test_client()
+        mismatches = 0
+        for stage in ('sqlite', 'aggregates', 'snapshot'):
+            if stage == 'aggregates':
+                aggregates.refresh_all(conn, full=True)
+                with conn:
+                    aggregates.bump_generation(conn)
+            if stage == 'snapshot':
+                api_server.SNAPSHOT_ENABLED = True
+                api_server._load_snapshot(api_server._data_generation())
+            _drop_cache()
+            for path, (checked, failed) in check_paths(client, expected, cards, dates).items():
+                print(f"{stage:<12}{path:<22}сверено {checked:>6}, расхождений {failed}")
+                mismatches += failed
+        return mismatches
+    finally:
+        api_server.SNAPSHOT_ENABLED = False
+        api_server._release_conn()
+        reader.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='сверять по копии этой БД (по умолчанию — синтетическая)')
+    parser.add_argument('--games', default='5k', help='размер синтетической БД: 5k, 20k, ...')
+    parser.add_argument('--seed', type=int, default=1, help='зерно синтетической БД')
+    parser.add_argument('--teams', type=int, default=300, help='сколько команд сверять')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'check.db')
+        if args.db:
+            _copy_db(args.db, db_path)
+        else:
+            conn = sqlite3.connect(db_path)
+            try:
+                games, _ = make_synthetic_db.generate(conn, make_synthetic_db.parse_scale(args.games), args.seed)
+                db_migrate.migrate(conn)
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+            print(f"Синтетическая БД: {games} игр")
+
+        mismatches = run_checks(db_path, args.teams)
+    if mismatches:
+        print(f"\n❌ Расхождений с исходной реализацией: {mismatches}")
+        return 1
+    print("\n✅ Все пути средних совпадают с исходной реализацией")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
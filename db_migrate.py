@@ -0,0 +1,142 @@
+"""Миграция индексов БД и проверка планов запросов API.
+
+    python3 db_migrate.py migrate          # создать недостающие индексы
+    python3 db_migrate.py check            # EXPLAIN QUERY PLAN для запросов API
+
+check завершается с кодом 1, если хоть один запрос эндпоинтов
+читает games, quarters или team_games полным сканированием.
+"""
+import argparse
+import sqlite3
+import sys
+
+import api_server
+
+# Индексы под шаблоны доступа API:
+#  - выборка игр за день по диапазону g.date;
+#  - последние игры команды: (home_team_id = ? OR away_team_id = ?) AND status = 'FT'
+#    ORDER BY date DESC — SQLite объединяет два индекса (MULTI-INDEX OR);
+#  - четверти по game_id.
+INDEXES = [
+    ('idx_games_date', 'games(date)'),
+    ('idx_games_home_team', 'games(home_team_id, status, date)'),
+    ('idx_games_away_team', 'games(away_team_id, status, date)'),
+    ('idx_quarters_game', 'quarters(game_id, quarter_num)'),
+]
+
+# Таблицы, полное сканирование которых недопустимо
+LARGE_TABLES = ('games', 'quarters', 'team_games')
+
+# Запросы эндпоинтов с подходящим числом параметров
+AUDIT_QUERIES = [
+    ('leagues', api_server.SQL_LEAGUES, ()),
+    ('games', api_server.SQL_GAMES_BY_DATE, ('2025-01-01', '2025-01-02')),
+    ('game', api_server.SQL_GAME_BY_ID, (1,)),
+    ('quarters', api_server.SQL_QUARTERS_BY_GAME, (1,)),
+    ('quarters_batch', api_server.SQL_QUARTERS_BY_GAMES.format(placeholders='?,?,?'), (1, 2, 3)),
+    ('last_games', api_server.SQL_LAST_GAMES, (1,) * 6 + (10,)),
+    ('h2h', api_server.SQL_H2H, (1, 2, 2, 1, '2024-2025')),
+    ('team_averages', api_server.SQL_TEAM_SCORED_GAMES, (1,) * 5 + (10,)),
+    ('team_rolling_stats', api_server.SQL_TEAM_ROLLING_STATS, (1, 10)),
+    ('team_games_last', api_server.SQL_TEAM_GAMES_LAST, (1, 10)),
+    ('team_games_scored', api_server.SQL_TEAM_GAMES_SCORED, (1, 10)),
+    ('team_games_last_date', api_server.SQL_TEAM_GAMES_LAST_DATE, (1,)),
+    ('team_rest_days', api_server.SQL_TEAM_LAST_GAME_DATE, (1, 1)),
+    ('h2h_averages', api_server.SQL_H2H_GAMES, (1, 2, 2, 1, '2024-2025')),
+    ('day_cards_history', api_server.SQL_TEAMS_RECENT_GAME_IDS.format(placeholders='?,?'), (1, 2, 1, 2, 10)),
+    ('window_history', api_server.SQL_TEAMS_RECENT_SCORED_GAME_IDS.format(placeholders='?,?'), (1, 2, 1, 2, 10)),
+    ('teams_rolling_stats', api_server.SQL_TEAMS_ROLLING_STATS.format(teams='?,?', windows='?,?'), (1, 2, 5, 10)),
+    ('teams_games_last_date', api_server.SQL_TEAMS_GAMES_LAST_DATE.format(placeholders='?,?'), (1, 2)),
+    ('teams_rest_days', api_server.SQL_TEAMS_LAST_GAME_DATE.format(placeholders='?,?'), (1, 2, 1, 2)),
+    ('day_cards_games', api_server.SQL_GAMES_BY_IDS.format(placeholders='?,?'), (1, 2)),
+    ('day_cards_h2h', api_server.SQL_PAIRS_H2H.format(teams='?,?', seasons='?'), (1, 2, 1, 2, '2024-2025')),
+    ('export_page_end', api_server.SQL_EXPORT_PAGE_END.format(filters=' AND g.season = ?'), (0, '2024-2025', 1000)),
+    ('export_games', api_server.SQL_EXPORT_GAMES.format(filters=' AND g.season = ?'), (0, 1000, '2024-2025')),
+    ('h2h_store', api_server.SQL_H2H_STORE.format(lows='?,?', highs='?,?', seasons='?'), (1, 2, 3, 4, '2024-2025')),
+    ('data_generation', api_server.SQL_DATA_GENERATION, ()),
+    ('aggregates_current', api_server.SQL_AGGREGATES_CURRENT, ()),
+]
+
+
+def migrate(conn):
+    """Создать недостающие индексы и обновить статистику планировщика"""
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    for name, target in INDEXES:
+        if name in existing:
+            print(f"  = {name}")
+            continue
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+        print(f"  + {name} ON {target}")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def _full_scans(conn, query, params):
+    """Строки плана, где большая таблица читается целиком"""
+    plan = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+    bad = []
+    for row in plan:
+        detail = row[-1]
+        if not detail.startswith('SCAN '):
+            continue
+        # "SCAN g", "SCAN games USING COVERING INDEX ..." и т.п.
+        table = detail.split()[1]
+        if table in LARGE_TABLES or _alias_of(query, table) in LARGE_TABLES:
+            bad.append(detail)
+    return plan, bad
+
+
+def _alias_of(query, alias):
+    """Имя таблицы по алиасу из FROM/JOIN (`FROM games g`)"""
+    tokens = query.replace('\n', ' ').split()
+    for i, tok in enumerate(tokens[:-1]):
+        if tokens[i + 1] == alias and tok.lower() not in ('from', 'join', 'as'):
+            return tok
+    return alias
+
+
+def check(conn, verbose=False):
+    """Проверить планы всех запросов эндпоинтов; вернуть число проблемных"""
+    failed = 0
+    for name, query, params in AUDIT_QUERIES:
+        try:
+            plan, bad = _full_scans(conn, query, params)
+        except sqlite3.OperationalError as e:
+            # производные таблицы появляются после первого запуска aggregates.py
+            print(f"[skip] {name}: {e}")
+            continue
+        status = 'FAIL' if bad else 'ok'
+        print(f"[{status}] {name}")
+        if bad or verbose:
+            for row in plan:
+                print(f"        {row[-1]}")
+        failed += bool(bad)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['migrate', 'check'])
+    parser.add_argument('--db', default=api_server.DB_PATH, help='путь к basketball.db')
+    parser.add_argument('-v', '--verbose', action='store_true', help='печатать планы всех запросов')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == 'migrate':
+            print(f"Миграция индексов: {args.db}")
+            migrate(conn)
+            return 0
+
+        failed = check(conn, args.verbose)
+        if failed:
+            print(f"\n❌ Полное сканирование в {failed} запрос(ах)")
+            return 1
+        print("\n✅ Все запросы используют индексы")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""Снимок истории завершённых матчей в памяти: колонки NumPy вместо запросов к SQLite.
+
+Снимок строится один раз на поколение данных (см. api_server._data_generation)
+и дальше только читается, поэтому его можно отдавать всем потокам без блокировок.
+
+- Матчи (SELECT * FROM games, только FT) лежат по колонкам, упорядоченные по id:
+  целые — массивы минимального типа, повторяющиеся строки (сезон, статус, арена) —
+  словарь и коды, остальные строки (дата) — байты UTF-8 фиксированной ширины.
+- Счёт матча и очки по четвертям — матрицы int16 (матч × сторона и
+  матч × четверть 1..4 × сторона), пустое значение — MISSING.
+- Индекс «команда × матч»: две строки на матч, по команде и от новых матчей
+  к старым (в один день — по id), как в team_games; матчи команды — срез.
+- Строки четвертей для выдачи — те же колонки подряд по матчам со смещениями.
+
+Последние N матчей, средние за окна, дата последнего матча и личные встречи
+считаются по срезам и отдаются в тех же форматах, что и ответы api_server.py.
+"""
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import team_stats
+
+SQL_GAMES = "SELECT * FROM games WHERE status = 'FT' ORDER BY id"
+
+SQL_QUARTERS = """
+SELECT q.*
+FROM quarters q
+JOIN games g ON g.id = q.game_id
+WHERE g.status = 'FT'
+ORDER BY q.game_id, q.quarter_num, q.id
+"""
+
+SQL_LEAGUE_NAMES = "SELECT id, name FROM leagues"
+SQL_TEAM_NAMES = "SELECT id, name FROM teams"
+
+# Пустой счёт или отсутствующая четверть в матрицах int16
+MISSING = np.iinfo(np.int16).min
+# Строковая колонка хранится словарём, если различных значений не больше этой доли строк
+CATEGORY_SHARE = 0.25
+INT_TYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+class _Column:
+    """Колонка выборки SQLite в компактном виде; column[i] — значение как из sqlite3"""
+    __slots__ = ('kind', 'data', 'nulls', 'values')
+
+    def __init__(self, values):
+        """values — np.ndarray dtype=object со значениями колонки"""
+        nulls = np.equal(values, None)
+        present = values[~nulls]
+        types = set(map(type, present))
+        self.nulls = nulls if nulls.any() else None
+        self.values = None
+
+        if types <= {int}:
+            self.kind = 'int'
+            data = np.where(nulls, 0, values).astype(np.int64)
+            self.data = data.astype(_int_type(data.min(initial=0), data.max(initial=0)))
+        elif types <= {float}:
+            self.kind = 'float'
+            self.data = np.where(nulls, 0.0, values).astype(np.float64)
+        elif types <= {str} and len(distinct := set(present)) <= CATEGORY_SHARE * len(values):
+            self.kind = 'category'
+            self.values = sorted(distinct)
+            codes = {v: i for i, v in enumerate(self.values)}
+            self.data = np.fromiter((codes.get(v, 0) for v in values), dtype=np.int64,
+                                    count=len(values)).astype(_int_type(0, len(self.values)))
+        elif types <= {str}:
+            self.kind = 'str'
+            self.data = np.char.encode(np.where(nulls, '', values).astype(str), 'utf-8')
+        else:
+            # смешанные типы (как бывает в SQLite) храним как есть
+            self.kind = 'object'
+            self.data = values
+
+    def __getitem__(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        value = self.data[i]
+        if self.kind == 'int':
+            return int(value)
+        if self.kind == 'float':
+            return float(value)
+        if self.kind == 'category':
+            return self.values[value]
+        if self.kind == 'str':
+            return value.decode()
+        return value
+
+    @property
+    def nbytes(self):
+        size = self.data.nbytes + (self.nulls.nbytes if self.nulls is not None else 0)
+        if self.kind == 'category':
+            size += sum(sys.getsizeof(v) for v in self.values)
+        elif self.kind == 'object':
+            size += sum(sys.getsizeof(v) for v in self.data)
+        return size
+
+
+def _int_type(low, high):
+    """Наименьший целый тип NumPy, вмещающий low..high"""
+    return next(t for t in INT_TYPES if np.iinfo(t).min <= low and high <= np.iinfo(t).max)
+
+
+def _int16(values, empty=MISSING):
+    """Очки в int16: None -> empty; значение вне 0..32767 — ValueError"""
+    nulls = np.equal(values, None)
+    array = np.where(nulls, 0, values).astype(np.int64)
+    if array.min(initial=0) < 0 or array.max(initial=0) > np.iinfo(np.int16).max:
+        raise ValueError("очки не помещаются в int16")
+    return np.where(nulls, empty, array).astype(np.int16)
+
+
+def _select(conn, query):
+    """{колонка: np.ndarray dtype=object} выборки, независимо от row_factory соединения"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(query)
+    names = [d[0] for d in cursor.description]
+    rows = np.empty((0, len(names)), dtype=object)
+    fetched = cursor.fetchall()
+    if fetched:
+        rows = np.array(fetched, dtype=object).reshape(len(fetched), len(names))
+    return {name: rows[:, i] for i, name in enumerate(names)}
+
+
+def load(conn, generation=None):
+    """Прочитать завершённые матчи и их четверти в снимок (одной транзакцией чтения)"""
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    try:
+        games = _select(conn, SQL_GAMES)
+        quarters = _select(conn, SQL_QUARTERS)
+        league_names = dict(conn.execute(SQL_LEAGUE_NAMES).fetchall())
+        team_names = dict(conn.execute(SQL_TEAM_NAMES).fetchall())
+    finally:
+        conn.rollback()
+    snapshot = GameSnapshot(games, quarters, league_names, team_names, generation)
+    snapshot.load_seconds = time.perf_counter() - started
+    return snapshot
+
+
+class GameSnapshot:
+    """Неизменяемый снимок истории матчей; строится функцией load()"""
+
+    def __init__(self, games, quarters, league_names, team_names, generation=None):
+        self.generation = generation
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        self.load_seconds = None
+        self._league_names = league_names
+        self._team_names = team_names
+
+        game_ids = np.array(games['id'], dtype=np.int64)
+        n = len(game_ids)
+        self._home = np.array(games['home_team_id'], dtype=np.int64)
+        self._away = np.array(games['away_team_id'], dtype=np.int64)
+        self._scores = np.column_stack([_int16(games['home_score']), _int16(games['away_score'])]).reshape(n, 2)
+        seasons, season_codes = np.unique(games['season'].astype(str), return_inverse=True)
+        self._seasons = {season: code for code, season in enumerate(seasons)}
+        self._season_codes = season_codes.ravel().astype(_int_type(0, len(seasons)))
+
+        # четверти: строки для выдачи по матчам (смещения) и матрица очков 1..4
+        quarter_game = np.searchsorted(game_ids, np.array(quarters['game_id'], dtype=np.int64))
+        self._quarter_offsets = np.searchsorted(quarter_game, np.arange(n + 1))
+        self._quarters = np.full((n, 4, 2), MISSING, dtype=np.int16)
+        quarter_num = np.where(np.equal(quarters['quarter_num'], None), 0, quarters['quarter_num']).astype(np.int64)
+        rows = np.flatnonzero((quarter_num >= 1) & (quarter_num <= 4))
+        # как в team_stats: для повторяющейся четверти — последняя строка, пустые очки — 0
+        _, last = np.unique((quarter_game[rows] * 4 + quarter_num[rows] - 1)[::-1], return_index=True)
+        rows = rows[::-1][last]
+        for side, column in enumerate(('home_score', 'away_score')):
+            points = _int16(quarters[column], empty=0)
+            self._quarters[quarter_game[rows], quarter_num[rows] - 1, side] = points[rows]
+
+        # «команда × матч»: по команде, от новых матчей к старым, в один день — по id
+        _, date_rank = np.unique(games['date'].astype(str), return_inverse=True)
+        team = np.concatenate([self._home, self._away])
+        order = np.lexsort((np.tile(game_ids, 2), -np.tile(date_rank.ravel(), 2), team))
+        self._team_game = (order % max(n, 1)).astype(np.int32)
+        self._team_home = order < n
+        self._teams, starts = np.unique(team[order], return_index=True)
+        self._team_starts = np.append(starts, 2 * n)
+        # матчей без итогового счёта у команды: на столько строк длиннее выборка окна средних
+        unscored = (self._scores == MISSING).any(axis=1)[self._team_game]
+        team_index = np.repeat(np.arange(len(self._teams)), np.diff(self._team_starts))
+        self._team_unscored = np.bincount(team_index, weights=unscored, minlength=len(self._teams)).astype(np.int32)
+
+        self._columns = [(name, _Column(values)) for name, values in games.items()]
+        self._date = dict(self._columns)['date']
+        self._quarter_columns = [(name, _Column(values)) for name, values in quarters.items()]
+        self.nbytes = self._nbytes()
+
+    @property
+    def games_count(self):
+        return len(self._home)
+
+    def _nbytes(self):
+        """Память снимка в байтах (массивы, словари колонок и названий)"""
+        arrays = (self._home, self._away, self._scores, self._season_codes, self._quarter_offsets,
+                  self._quarters, self._team_game, self._team_home, self._teams, self._team_starts,
+                  self._team_unscored)
+        size = sum(a.nbytes for a in arrays)
+        size += sum(column.nbytes for _, column in self._columns + self._quarter_columns)
+        for names in (self._league_names, self._team_names, self._seasons):
+            size += sys.getsizeof(names) + sum(sys.getsizeof(v) for v in names.values())
+        return size
+
+    def info(self):
+        """Размер снимка для /api/health и /api/metrics"""
+        games = self.games_count
+        return {
+            'generation': self.generation,
+            'games': games,
+            'quarters': int(self._quarter_offsets[-1]),
+            'teams': len(self._teams),
+            'bytes': self.nbytes,
+            'bytes_per_million_games': round(self.nbytes / games * 1000000) if games else 0,
+            'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'loaded_at': self.loaded_at,
+        }
+
+    def _team_rows(self, team_ids, limit=None, scored=False):
+        """Строки индекса «команда × матч» первых limit матчей каждой команды подряд
+        и их число по командам. scored — limit матчей со счётом: выборка длиннее
+        на число матчей команды без счёта"""
+        ids = np.asarray(team_ids, dtype=np.int64).reshape(-1)
+        if not len(self._teams):
+            return np.zeros(0, dtype=np.int64), np.zeros(len(ids), dtype=np.int64)
+        position = np.searchsorted(self._teams, ids).clip(max=len(self._teams) - 1)
+        start = self._team_starts[position]
+        counts = np.where(self._teams[position] == ids, self._team_starts[position + 1] - start, 0)
+        if limit is not None:
+            if scored:
+                limit = limit + self._team_unscored[position]
+            counts = np.minimum(counts, limit)
+        offsets = np.repeat(start - (np.cumsum(counts) - counts), counts)
+        return np.arange(counts.sum()) + offsets, counts
+
+    def _frame(self, team_ids, rows):
+        """Таблица «команда × матч» (колонки team_stats) для строк индекса"""
+        games = self._team_game[rows]
+        side = np.where(self._team_home[rows], 0, 1)
+        frame = {
+            'team_id': np.asarray(team_ids),
+            'team_score': _points(self._scores[games, side]),
+            'opponent_score': _points(self._scores[games, 1 - side]),
+        }
+        team_q = _points(self._quarters[games, :, side])
+        opponent_q = _points(self._quarters[games, :, 1 - side])
+        for i, (col, opponent_col) in enumerate(zip(team_stats.QUARTERS, team_stats.OPPONENT_QUARTERS)):
+            frame[col] = team_q[:, i]
+            frame[opponent_col] = opponent_q[:, i]
+        return frame
+
+    def _game_row(self, i):
+        """Матч в формате SQL_GAMES_BY_IDS api_server со списком четвертей"""
+        row = {name: column[i] for name, column in self._columns}
+        row['league_name'] = self._league_names.get(row['league_id'])
+        row['home_team_name'] = self._team_names.get(row['home_team_id'])
+        row['away_team_name'] = self._team_names.get(row['away_team_id'])
+        row['quarters'] = [
+            {name: column[j] for name, column in self._quarter_columns}
+            for j in range(self._quarter_offsets[i], self._quarter_offsets[i + 1])
+        ]
+        return row
+
+    def last_games(self, team_id, limit):
+        """Последние limit матчей команды от новых к старым (строки матчей с четвертями)"""
+        rows, _ = self._team_rows([team_id], limit)
+        return [self._game_row(i) for i in self._team_game[rows]]
+
+    def last_game_dates(self, team_ids):
+        """{team_id: дата последнего матча или None}"""
+        rows, counts = self._team_rows(team_ids, 1)
+        dates = iter(self._date[i] for i in self._team_game[rows])
+        return {team_id: next(dates) if count else None for team_id, count in zip(team_ids, counts)}
+
+    def window_averages(self, team_ids, windows):
+        """Средние за последние N матчей со счётом: {team_id: {'5': {...}}} как
+        team_stats.window_averages (матчи без счёта в окно не входят)"""
+        team_ids = list(team_ids)
+        rows, counts = self._team_rows(team_ids, max(windows), scored=True)
+        frame = self._frame(np.repeat(np.asarray(team_ids, dtype=np.int64), counts), rows)
+        return team_stats.window_averages(frame, windows, team_ids)
+
+    def h2h(self, team1_id, team2_id, season):
+        """Личные встречи за сезон со счётом: (матчи от новых к старым, средние для team1)"""
+        code = self._seasons.get(str(season))
+        rows, _ = self._team_rows([team1_id])
+        if code is not None:
+            games = self._team_game[rows]
+            opponent = np.where(self._team_home[rows], self._away[games], self._home[games])
+            scored = (self._scores[games] != MISSING).all(axis=1)
+            rows = rows[(opponent == team2_id) & (self._season_codes[games] == code) & scored]
+        else:
+            rows = rows[:0]
+        averages = team_stats.h2h_averages(self._frame(np.full(len(rows), team1_id), rows), team1_id)
+        return [self._game_row(i) for i in self._team_game[rows]], averages
+
+
+def _points(values):
+    """Очки int16 -> float, MISSING -> NaN (как пустые значения в team_stats)"""
+    return np.where(values == MISSING, np.nan, values.astype(float))
@@ -0,0 +1,48 @@
+"""
+Боевой запуск API вместо сервера разработки Flask:
+
+    gunicorn -c gunicorn.conf.py api_server:app
+
+Воркеры — процессы с пулом потоков (gthread): SQLite открыта только на чтение,
+каждый процесс держит свой пул соединений и кэш ответов, медленный запрос
+занимает один поток, а не весь сервер. Число процессов, потоков и таймауты
+задаются переменными окружения (см. ниже).
+
+Перезапуск без простоя после ежедневного обновления БД: новые воркеры
+поднимаются и прогреваются, старые дорабатывают начатые запросы:
+
+    kill -HUP $(cat /tmp/basketball_api.pid)
+"""
+import logging
+import multiprocessing
+import os
+
+bind = os.environ.get('API_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('API_WORKERS', min(multiprocessing.cpu_count(), 4)))
+worker_class = 'gthread'
+# Живой поток /api/stream/games занимает поток воркера на всё подключение;
+# дашборд держит один такой поток на дату, так что запас в 16 потоков с избытком
+threads = int(os.environ.get('API_THREADS', 16))
+
+# Зависший воркер перезапускается через timeout секунд; отдельный SQL-запрос
+# прерывается раньше — см. API_QUERY_TIMEOUT в api_server.py
+timeout = int(os.environ.get('API_WORKER_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('API_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+pidfile = os.environ.get('API_PIDFILE', '/tmp/basketball_api.pid')
+errorlog = '-'
+loglevel = os.environ.get('API_LOG_LEVEL', 'info')
+
+# Приложение грузится в каждом воркере, а не в мастере: соединения SQLite
+# не переживают fork, а HUP заодно подхватывает новый код
+preload_app = False
+
+
+def post_worker_init(worker):
+    """Воркер принимает запросы только после прогрева соединений и кэша"""
+    import api_server
+    logging.getLogger('gunicorn.error').info(
+        "Прогрев воркера %s: %s", worker.pid,
+        ', '.join(f"{name} {seconds:.2f} с" for name, seconds in api_server.warm_up().items())
+    )
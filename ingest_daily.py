@@ -0,0 +1,330 @@
+"""Загрузка ежедневных JSON API-Sports (data/games_daily/) в basketball.db.
+
+    python3 ingest_daily.py                  # новые и изменившиеся файлы
+    python3 ingest_daily.py --force          # все файлы заново
+    python3 ingest_daily.py --dir PATH --db PATH --skip-aggregates
+
+Повторный запуск безопасен: файл, содержимое которого (sha256) уже загружено,
+пропускается, а игра перезаписывается, только если изменились её поля.
+Игры пишутся пачками по INGEST_BATCH_SIZE через executemany, каждая пачка —
+короткая транзакция: в WAL API читает старые данные, пока пачка пишется.
+После загрузки агрегаты пересчитываются инкрементально (aggregates.py), а
+счётчик data_generation увеличивается — по нему API сбрасывает кэш ответов.
+Каждый запуск записывается в ingest_runs: время, число файлов и строк.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aggregates
+import api_server
+
+DAILY_DIR = "/root/basketball_project/data/games_daily"
+
+# Игр в одной транзакции записи
+INGEST_BATCH_SIZE = 5000
+
+QUARTER_KEYS = ('quarter_1', 'quarter_2', 'quarter_3', 'quarter_4')
+GAME_COLUMNS = (
+    'id', 'league_id', 'season', 'date', 'timestamp', 'status',
+    'home_team_id', 'away_team_id', 'home_score', 'away_score', 'venue'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_files (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingest_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    seconds REAL,
+    files_total INTEGER NOT NULL DEFAULT 0,
+    files_skipped INTEGER NOT NULL DEFAULT 0,
+    files_ingested INTEGER NOT NULL DEFAULT 0,
+    files_failed INTEGER NOT NULL DEFAULT 0,
+    games_new INTEGER NOT NULL DEFAULT 0,
+    games_updated INTEGER NOT NULL DEFAULT 0,
+    games_unchanged INTEGER NOT NULL DEFAULT 0,
+    quarters INTEGER NOT NULL DEFAULT 0,
+    leagues INTEGER NOT NULL DEFAULT 0,
+    teams INTEGER NOT NULL DEFAULT 0,
+    generation INTEGER,
+    status TEXT NOT NULL
+);
+"""
+
+SQL_GAMES_EXISTING = f"SELECT {', '.join(GAME_COLUMNS)} FROM games WHERE id IN ({{placeholders}})"
+
+# Только четверти 1-4: прочие строки quarters (если есть) загрузка не трогает
+SQL_QUARTERS_EXISTING = """
+SELECT game_id, quarter_num, home_score, away_score
+FROM quarters
+WHERE game_id IN ({placeholders}) AND quarter_num BETWEEN 1 AND 4
+ORDER BY game_id, quarter_num, id
+"""
+
+SQL_UPSERT_GAME = f"""
+INSERT INTO games ({', '.join(GAME_COLUMNS)})
+VALUES ({', '.join('?' * len(GAME_COLUMNS))})
+ON CONFLICT(id) DO UPDATE SET
+    {', '.join(f'{c} = excluded.{c}' for c in GAME_COLUMNS[1:])}
+"""
+
+# Лиги и команды перезаписываются, только если поменялись название, страна
+# или логотип; пустые страна и логотип в JSON не затирают уже известные
+SQL_UPSERT_LEAGUE = """
+INSERT INTO leagues (id, name, country) VALUES (?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET name = excluded.name, country = COALESCE(excluded.country, leagues.country)
+WHERE leagues.name IS NOT excluded.name
+   OR (excluded.country IS NOT NULL AND leagues.country IS NOT excluded.country)
+"""
+
+SQL_UPSERT_TEAM = """
+INSERT INTO teams (id, name, logo) VALUES (?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET name = excluded.name, logo = COALESCE(excluded.logo, teams.logo)
+WHERE teams.name IS NOT excluded.name
+   OR (excluded.logo IS NOT NULL AND teams.logo IS NOT excluded.logo)
+"""
+
+RUN_COUNTERS = (
+    'files_total', 'files_skipped', 'files_ingested', 'files_failed',
+    'games_new', 'games_updated', 'games_unchanged', 'quarters', 'leagues', 'teams'
+)
+
+log = logging.getLogger(__name__)
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA)
+
+
+def parse_game(item):
+    """Игра API-Sports -> (строка games, строки quarters, лиги, команды) или None без id.
+    Лиги — (id, name, country), команды — (id, name, logo)"""
+    league = item.get('league') or {}
+    teams = item.get('teams') or {}
+    home = teams.get('home') or {}
+    away = teams.get('away') or {}
+    scores = item.get('scores') or {}
+    home_scores = scores.get('home') or {}
+    away_scores = scores.get('away') or {}
+    if item.get('id') is None or home.get('id') is None or away.get('id') is None:
+        return None
+
+    season = league.get('season')
+    venue = item.get('venue')
+    if isinstance(venue, dict):
+        venue = venue.get('name')
+    game = (
+        item['id'], league.get('id'), str(season) if season is not None else None,
+        item.get('date'), item.get('timestamp'), (item.get('status') or {}).get('short'),
+        home['id'], away['id'], home_scores.get('total'), away_scores.get('total'), venue
+    )
+    quarters = [
+        (item['id'], num, home_scores.get(key), away_scores.get(key))
+        for num, key in enumerate(QUARTER_KEYS, 1)
+        if home_scores.get(key) is not None or away_scores.get(key) is not None
+    ]
+    country = (item.get('country') or {}).get('name')
+    leagues = [(league['id'], league.get('name'), country)] if league.get('id') is not None else []
+    teams = [(home['id'], home.get('name'), home.get('logo')), (away['id'], away.get('name'), away.get('logo'))]
+    return game, quarters, leagues, teams
+
+
+def _new_batch():
+    return {'games': {}, 'leagues': {}, 'teams': {}, 'files': []}
+
+
+def _add_file(batch, path, sha256, size, payload):
+    """Разобрать файл в пачку; игра, встреченная повторно, берётся из более позднего файла"""
+    items = payload.get('response', []) if isinstance(payload, dict) else payload
+    games = 0
+    for item in items:
+        parsed = parse_game(item)
+        if parsed is None:
+            continue
+        game, quarters, leagues, teams = parsed
+        batch['games'][game[0]] = (game, quarters)
+        _merge_rows(batch['leagues'], leagues)
+        _merge_rows(batch['teams'], teams)
+        games += 1
+    batch['files'].append((sha256, str(path), size, games))
+
+
+def _merge_rows(rows, new):
+    """Добавить строки (id, ...) в {id: строка}: поздние значения заменяют ранние,
+    но пустые поля не затирают уже известные (логотип, страна)"""
+    for row in new:
+        old = rows.get(row[0])
+        rows[row[0]] = row if old is None else tuple(o if v is None else v for v, o in zip(row, old))
+
+
+def _existing_games(conn, game_ids):
+    """Текущие игры пачки в том же виде, что и разобранные из JSON:
+    {id: (кортеж GAME_COLUMNS, список четвертей 1-4)}"""
+    existing = {}
+    for i in range(0, len(game_ids), api_server.SQL_MAX_VARIABLES):
+        chunk = game_ids[i:i + api_server.SQL_MAX_VARIABLES]
+        placeholders = api_server._placeholders(chunk)
+        for row in conn.execute(SQL_GAMES_EXISTING.format(placeholders=placeholders), chunk):
+            existing[row[0]] = (tuple(row), [])
+        for row in conn.execute(SQL_QUARTERS_EXISTING.format(placeholders=placeholders), chunk):
+            if row[0] in existing:
+                existing[row[0]][1].append(tuple(row))
+    return existing
+
+
+def _write_batch(conn, batch, run_id, stats, touched):
+    """Записать пачку одной транзакцией: изменившиеся игры с четвертями, лиги, команды
+    и отметки о файлах. Переписанные матчи добавляются в touched для агрегатов."""
+    existing = _existing_games(conn, list(batch['games']))
+    changed = [(game, quarters) for gid, (game, quarters) in batch['games'].items() if existing.get(gid) != (game, quarters)]
+    ingested_at = datetime.now().isoformat(timespec='seconds')
+
+    with conn:
+        before = conn.total_changes
+        conn.executemany(SQL_UPSERT_LEAGUE, batch['leagues'].values())
+        stats['leagues'] += conn.total_changes - before
+
+        before = conn.total_changes
+        conn.executemany(SQL_UPSERT_TEAM, batch['teams'].values())
+        stats['teams'] += conn.total_changes - before
+
+        conn.executemany(SQL_UPSERT_GAME, [game for game, _ in changed])
+        conn.executemany(
+            "DELETE FROM quarters WHERE game_id = ? AND quarter_num BETWEEN 1 AND 4",
+            [(game[0],) for game, _ in changed]
+        )
+        quarters = [q for _, game_quarters in changed for q in game_quarters]
+        conn.executemany(
+            "INSERT INTO quarters (game_id, quarter_num, home_score, away_score) VALUES (?, ?, ?, ?)",
+            quarters
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO ingest_files (sha256, path, size, games, run_id, ingested_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(sha, path, size, games, run_id, ingested_at) for sha, path, size, games in batch['files']]
+        )
+
+    touched.update((game[6], game[7], game[2]) for game, _ in changed)
+    new = sum(1 for game, _ in changed if game[0] not in existing)
+    stats['games_new'] += new
+    stats['games_updated'] += len(changed) - new
+    stats['games_unchanged'] += len(batch['games']) - len(changed)
+    stats['quarters'] += len(quarters)
+    stats['files_ingested'] += len(batch['files'])
+
+
+def ingest(conn, directory, run_id, force=False):
+    """Загрузить JSON-файлы каталога (старые раньше новых).
+    Возвращает счётчики запуска и переписанные матчи {(home_id, away_id, season)}."""
+    stats = dict.fromkeys(RUN_COUNTERS, 0)
+    touched = set()
+    files = sorted(Path(directory).glob('*.json'), key=lambda p: (p.stat().st_mtime, p.name))
+    stats['files_total'] = len(files)
+
+    batch = _new_batch()
+    for path in files:
+        data = path.read_bytes()
+        sha256 = hashlib.sha256(data).hexdigest()
+        if not force and conn.execute("SELECT 1 FROM ingest_files WHERE sha256 = ?", (sha256,)).fetchone():
+            stats['files_skipped'] += 1
+            continue
+        try:
+            _add_file(batch, path, sha256, len(data), json.loads(data))
+        except (ValueError, AttributeError, TypeError) as e:
+            # битый файл не отмечается загруженным и будет прочитан в следующий раз
+            log.warning("Пропущен файл %s: %s", path, e)
+            stats['files_failed'] += 1
+            continue
+        if len(batch['games']) >= INGEST_BATCH_SIZE:
+            _write_batch(conn, batch, run_id, stats, touched)
+            batch = _new_batch()
+
+    if batch['files']:
+        _write_batch(conn, batch, run_id, stats, touched)
+    return stats, touched
+
+
+def _start_run(conn):
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO ingest_runs (started_at, status) VALUES (?, 'running')",
+            (datetime.now().isoformat(timespec='seconds'),)
+        )
+    return cur.lastrowid
+
+
+def _finish_run(conn, run_id, stats, seconds, generation, status):
+    with conn:
+        conn.execute(
+            f"UPDATE ingest_runs SET finished_at = ?, seconds = ?, generation = ?, status = ?, "
+            f"{', '.join(f'{c} = ?' for c in RUN_COUNTERS)} WHERE id = ?",
+            (datetime.now().isoformat(timespec='seconds'), round(seconds, 3), generation, status,
+             *(stats.get(c, 0) for c in RUN_COUNTERS), run_id)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=DAILY_DIR, help='каталог с JSON API-Sports')
+    parser.add_argument('--db', default=api_server.DB_PATH, help='путь к basketball.db')
+    parser.add_argument('--force', action='store_true', help='загрузить и уже загруженные файлы')
+    parser.add_argument('--skip-aggregates', action='store_true', help='не пересчитывать агрегаты')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    api_server.DB_PATH = args.db
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # в WAL NORMAL не теряет целостность при сбое, но не ждёт fsync на каждый commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    ensure_schema(conn)
+    aggregates.ensure_schema(conn)
+
+    run_id = _start_run(conn)
+    started = time.perf_counter()
+    stats = {}
+    try:
+        stats, touched = ingest(conn, args.dir, run_id, args.force)
+        changed = stats['games_new'] + stats['games_updated'] + stats['leagues'] + stats['teams']
+        if changed and not args.skip_aggregates:
+            for table, (updated, seconds) in aggregates.refresh_all(conn, touched=touched).items():
+                print(f"{table}: обновлено {updated} за {seconds:.2f} с")
+        # агрегаты меняются только вслед за играми, поэтому хватает одного сдвига
+        generation = None
+        if changed:
+            with conn:
+                generation = aggregates.bump_generation(conn)
+        _finish_run(conn, run_id, stats, time.perf_counter() - started, generation, 'ok')
+    except Exception as e:
+        _finish_run(conn, run_id, stats, time.perf_counter() - started, None, f'error: {e}')
+        raise
+    finally:
+        api_server._release_conn()
+
+    print(
+        f"Файлов {stats['files_total']}: загружено {stats['files_ingested']}, "
+        f"пропущено {stats['files_skipped']}, с ошибкой {stats['files_failed']}\n"
+        f"Игр: новых {stats['games_new']}, изменено {stats['games_updated']}, без изменений {stats['games_unchanged']}; "
+        f"четвертей {stats['quarters']}, лиг {stats['leagues']}, команд {stats['teams']}\n"
+        f"За {time.perf_counter() - started:.2f} с, поколение данных {generation}"
+    )
+    conn.close()
+    return 1 if stats['files_failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
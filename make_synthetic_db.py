@@ -0,0 +1,221 @@
+"""Синтетическая basketball.db заданного размера для бенчмарков.
+
+    python3 make_synthetic_db.py --games 10k  --out bench_results/db_10k.db
+    python3 make_synthetic_db.py --games 100k --out bench_results/db_100k.db --aggregates
+    python3 make_synthetic_db.py --games 1M   --out bench_results/db_1m.db --force
+
+Схема та же, что у боевой БД: leagues, teams, games, quarters. Лиги по 16 команд
+играют двухкруговой турнир (240 игр за сезон), число лиг растёт с размером,
+чтобы у команды было не больше SEASONS_MAX сезонов истории. Последний сезон
+идёт сейчас: прошедшие игры завершены (FT, счёт = сумма четвертей), будущие —
+NS без счёта, на сегодня всегда есть игры. Как и в настоящих данных, у части
+завершённых игр нет четвертей, нет итогового счёта или пуст счёт одной из
+четвертей. Генерация детерминирована (--seed).
+
+После заполнения создаются индексы (db_migrate.py), с --aggregates — ещё и
+производные таблицы aggregates.py; БД переводится в WAL.
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import aggregates
+import api_server
+import db_migrate
+
+TEAMS_PER_LEAGUE = 16
+GAMES_PER_SEASON = TEAMS_PER_LEAGUE * (TEAMS_PER_LEAGUE - 1)
+SEASONS_MAX = 10
+SEASON_DAYS = 180
+# текущий сезон начался столько дней назад (остаток — будущие игры)
+CURRENT_SEASON_PLAYED_DAYS = 120
+MIN_LEAGUES = 14
+MISSING_QUARTERS_SHARE = 0.01
+# FT без итогового счёта и FT с пустым счётом одной четверти
+UNSCORED_SHARE = 0.005
+NULL_QUARTER_SHARE = 0.005
+INSERT_BATCH_SIZE = 50000
+
+SCHEMA = """
+CREATE TABLE leagues (id INTEGER PRIMARY KEY, name TEXT, country TEXT);
+CREATE TABLE teams (id INTEGER PRIMARY KEY, name TEXT, logo TEXT);
+CREATE TABLE games (
+    id INTEGER PRIMARY KEY,
+    league_id INTEGER,
+    season TEXT,
+    date TEXT,
+    timestamp INTEGER,
+    status TEXT,
+    home_team_id INTEGER,
+    away_team_id INTEGER,
+    home_score INTEGER,
+    away_score INTEGER,
+    venue TEXT
+);
+CREATE TABLE quarters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id INTEGER,
+    quarter_num INTEGER,
+    home_score INTEGER,
+    away_score INTEGER
+);
+"""
+
+
+def parse_scale(value):
+    """'10k', '100k', '1M', '2500' -> число игр"""
+    multipliers = {'k': 1000, 'm': 1000000}
+    value = value.strip().lower()
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def layout(games):
+    """Число лиг и сезонов под нужное число игр"""
+    leagues = max(MIN_LEAGUES, math.ceil(games / (GAMES_PER_SEASON * SEASONS_MAX)))
+    seasons = math.ceil(games / (GAMES_PER_SEASON * leagues))
+    return leagues, seasons
+
+
+def _season_games(rng, league_id, start, now):
+    """Двухкруговой турнир лиги за сезон: столбцы игр, отсортированные по времени"""
+    teams = league_id * 100 + np.arange(TEAMS_PER_LEAGUE)
+    home, away = np.meshgrid(teams, teams, indexing='ij')
+    pairs = home != away
+    home, away = home[pairs], away[pairs]
+    order = rng.permutation(len(home))
+    # день сезона и час начала 10..20 UTC
+    offsets = rng.integers(0, SEASON_DAYS, len(home)) * 86400 + rng.integers(10, 21, len(home)) * 3600
+    timestamps = int(start.timestamp()) + np.sort(offsets)
+    quarters = rng.integers(12, 33, (len(home), 4, 2))
+    quarters[:, :, 0] += rng.integers(0, 3, (len(home), 4))
+    finished = timestamps < now.timestamp()
+    return home[order], away[order], timestamps, quarters, finished
+
+
+def generate(conn, games, seed=1, now=None):
+    """Заполнить пустую БД; возвращает число игр и четвертей"""
+    now = now or datetime.now(timezone.utc)
+    rng = np.random.default_rng(seed)
+    # отдельный генератор для неполных данных: основные игры при том же --seed не меняются
+    gaps_rng = np.random.default_rng([seed, 1])
+    leagues, seasons = layout(games)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO leagues VALUES (?, ?, ?)", (
+        (lid, f"League {lid}", f"Country {lid % 40}") for lid in range(1, leagues + 1)
+    ))
+    conn.executemany("INSERT INTO teams VALUES (?, ?, ?)", (
+        (lid * 100 + t, f"Team {lid * 100 + t}", f"https://media.example/teams/{lid * 100 + t}.png")
+        for lid in range(1, leagues + 1) for t in range(TEAMS_PER_LEAGUE)
+    ))
+
+    current_start = (now - timedelta(days=CURRENT_SEASON_PLAYED_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0)
+    game_rows, quarter_rows = [], []
+    game_id = 0
+    quarters_total = 0
+    # с последнего сезона: при неполном числе игр усечётся самая старая история
+    for s in range(seasons):
+        start = current_start - timedelta(days=365 * s)
+        season = f"{start.year}-{start.year + 1}"
+        for league_id in range(1, leagues + 1):
+            if game_id >= games:
+                break
+            home, away, timestamps, quarters, finished = _season_games(rng, league_id, start, now)
+            missing = rng.random(len(home)) < MISSING_QUARTERS_SHARE
+            unscored = gaps_rng.random(len(home)) < UNSCORED_SHARE
+            null_quarter = np.where(gaps_rng.random(len(home)) < NULL_QUARTER_SHARE,
+                                    gaps_rng.integers(0, 4, len(home)), -1)
+            for i in range(min(len(home), games - game_id)):
+                game_id += 1
+                ts = int(timestamps[i])
+                date = datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+                if finished[i]:
+                    q = quarters[i]
+                    score = (None, None) if unscored[i] else (int(q[:, 0].sum()), int(q[:, 1].sum()))
+                    game_rows.append((game_id, league_id, season, date, ts, 'FT', int(home[i]), int(away[i]),
+                                      *score, f"Arena {home[i]}"))
+                    if not missing[i]:
+                        quarter_rows.extend(
+                            (game_id, n + 1, None, None) if n == null_quarter[i] else
+                            (game_id, n + 1, int(q[n, 0]), int(q[n, 1]))
+                            for n in range(4)
+                        )
+                else:
+                    game_rows.append((game_id, league_id, season, date, ts, 'NS', int(home[i]), int(away[i]),
+                                      None, None, f"Arena {home[i]}"))
+            if len(game_rows) >= INSERT_BATCH_SIZE:
+                quarters_total += _flush(conn, game_rows, quarter_rows)
+    quarters_total += _flush(conn, game_rows, quarter_rows)
+    conn.commit()
+    return game_id, quarters_total
+
+
+def _flush(conn, game_rows, quarter_rows):
+    conn.executemany("INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", game_rows)
+    conn.executemany(
+        "INSERT INTO quarters (game_id, quarter_num, home_score, away_score) VALUES (?, ?, ?, ?)",
+        quarter_rows
+    )
+    written = len(quarter_rows)
+    game_rows.clear()
+    quarter_rows.clear()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', default='10k', help='число игр: 10k, 100k, 1M или просто число')
+    parser.add_argument('--out', required=True, help='путь к создаваемой БД')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора')
+    parser.add_argument('--aggregates', action='store_true', help='построить таблицы aggregates.py')
+    parser.add_argument('--force', action='store_true', help='перезаписать существующий файл')
+    args = parser.parse_args()
+
+    games = parse_scale(args.games)
+    if os.path.exists(args.out):
+        if not args.force:
+            print(f"{args.out} уже существует (--force, чтобы перезаписать)")
+            return 1
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.out + suffix):
+                os.remove(args.out + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+
+    leagues, seasons = layout(games)
+    print(f"{args.out}: {games} игр, лиг {leagues}, сезонов {seasons}")
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.out)
+    try:
+        # файл строится с нуля: журнал и fsync не нужны до конца заполнения
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        written, quarters = generate(conn, games, args.seed)
+        print(f"Игры: {written}, четверти: {quarters} за {time.perf_counter() - started:.1f} с")
+
+        db_migrate.migrate(conn)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if args.aggregates:
+            # агрегаты читают игры через пул соединений api_server
+            api_server.DB_PATH = args.out
+            aggregates.ensure_schema(conn)
+            for table, (updated, seconds) in aggregates.refresh_all(conn, full=True).items():
+                print(f"{table}: обновлено {updated} за {seconds:.2f} с")
+            with conn:
+                aggregates.bump_generation(conn)
+    finally:
+        api_server._release_conn()
+        conn.close()
+    print(f"Готово за {time.perf_counter() - started:.1f} с")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
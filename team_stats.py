@@ -0,0 +1,363 @@
+"""Векторный расчёт статистики команд по играм и четвертям.
+
+Игры и четверти загружаются в таблицы (DataFrame из SQLite через load_frames
+или колонки NumPy из строк API через frames_from_rows) и разворачиваются
+в таблицу «команда × матч» — две строки на матч: за хозяев и за гостей.
+Средние за окна последних игр, результаты и средние по личным встречам
+считаются над ней целиком, для любого числа команд, окон и пар за один вызов.
+
+Таблица «команда × матч» — dict колонок np.ndarray: на маленьких выборках
+одного запроса API это в разы дешевле DataFrame, а для анализа её можно
+обернуть в pd.DataFrame.
+
+Используется api_server.py (team_averages, h2h_averages, match_card,
+day_cards), снимком истории в памяти game_snapshot.py и пакетными
+расчётами в aggregates.py.
+"""
+import numpy as np
+import pandas as pd
+
+QUARTERS = ('q1', 'q2', 'q3', 'q4')
+OPPONENT_QUARTERS = ('oq1', 'oq2', 'oq3', 'oq4')
+
+GAME_COLUMNS = ['id', 'league_id', 'season', 'date', 'status', 'home_team_id', 'away_team_id', 'home_score', 'away_score']
+QUARTER_COLUMNS = ['game_id', 'quarter_num', 'home_score', 'away_score']
+
+TEAM_GAME_COLUMNS = (
+    ['team_id', 'opponent_id', 'game_id', 'league_id', 'season', 'date', 'is_home', 'team_score', 'opponent_score', 'result', 'rank']
+    + list(QUARTERS) + list(OPPONENT_QUARTERS)
+)
+
+SQL_GAMES = """
+SELECT id, league_id, season, date, status, home_team_id, away_team_id, home_score, away_score
+FROM games
+WHERE status = 'FT'
+"""
+
+SQL_QUARTERS = """
+SELECT q.game_id, q.quarter_num, q.home_score, q.away_score
+FROM quarters q
+JOIN games g ON g.id = q.game_id
+WHERE g.status = 'FT'
+ORDER BY q.game_id, q.quarter_num, q.id
+"""
+
+
+def load_frames(conn, league_id=None, season=None, team_ids=None):
+    """Загрузить завершённые игры и их четверти из SQLite в две таблицы.
+    team_ids — только матчи этих команд (вся их история, в любых лигах)"""
+    filters = [(col, value) for col, value in (('league_id', league_id), ('season', season)) if value is not None]
+    params = [value for _, value in filters]
+    games_sql = SQL_GAMES + ''.join(f" AND {col} = ?" for col, _ in filters)
+    quarters_filter = ''.join(f"AND g.{col} = ? " for col, _ in filters)
+    if team_ids is not None:
+        team_ids = list(team_ids)
+        placeholders = ','.join('?' * len(team_ids))
+        games_sql += f" AND (home_team_id IN ({placeholders}) OR away_team_id IN ({placeholders}))"
+        quarters_filter += f"AND (g.home_team_id IN ({placeholders}) OR g.away_team_id IN ({placeholders})) "
+        params += team_ids * 2
+
+    quarters_sql = SQL_QUARTERS.replace('ORDER BY', quarters_filter + 'ORDER BY')
+    games = pd.read_sql_query(games_sql, conn, params=params)
+    quarters = pd.read_sql_query(quarters_sql, conn, params=params)
+    return games, quarters
+
+
+def frames_from_rows(rows):
+    """Таблицы игр и четвертей из строк API (dict с подгруженным списком 'quarters').
+    Матч, встречающийся в нескольких списках, берётся один раз."""
+    games = {}
+    quarters = []
+    for g in rows:
+        if g['id'] in games:
+            continue
+        games[g['id']] = [g[c] for c in GAME_COLUMNS]
+        quarters.extend([q[c] for c in QUARTER_COLUMNS] for q in g.get('quarters', ()))
+    return _columns(list(games.values()), GAME_COLUMNS), _columns(quarters, QUARTER_COLUMNS)
+
+
+def _columns(records, names):
+    """Колоночная таблица {имя: np.ndarray} из списка строк; None в числах -> NaN"""
+    table = {}
+    for i, name in enumerate(names):
+        values = [r[i] for r in records]
+        dtype = float if name.endswith('_score') or name in QUARTERS + OPPONENT_QUARTERS else None
+        table[name] = np.array(values, dtype=dtype) if values else np.array([], dtype=dtype or float)
+    return table
+
+
+def team_games(games, quarters):
+    """Таблица «команда × матч»: счёт, результат и четверти с точки зрения команды.
+    games/quarters — DataFrame из load_frames или колонки из frames_from_rows.
+    Возвращает {колонка: np.ndarray} (pd.DataFrame(...) для анализа),
+    строки упорядочены по команде и от новых матчей к старым (в один день —
+    по возрастанию id матча, как в team_games); rank — номер
+    матча у команды начиная с 1. В четвертях пустой счёт считается 0,
+    отсутствующая четверть — NaN."""
+    game_ids = np.asarray(games['id'])
+    home_q, away_q = _quarter_matrices(quarters, game_ids)
+
+    home_score = np.asarray(games['home_score'], dtype=float)
+    away_score = np.asarray(games['away_score'], dtype=float)
+    dates = np.asarray(games['date'])
+    n = len(game_ids)
+
+    home_id = np.asarray(games['home_team_id'])
+    away_id = np.asarray(games['away_team_id'])
+    team_id = np.concatenate([home_id, away_id])
+    team_score = np.concatenate([home_score, away_score])
+    opponent_score = np.concatenate([away_score, home_score])
+    finished = np.tile(np.asarray(games['status']) == 'FT', 2)
+    result = np.where(team_score > opponent_score, 'W', np.where(finished, 'L', None))
+    team_q = np.vstack([home_q, away_q])
+    opponent_q = np.vstack([away_q, home_q])
+
+    # по команде, внутри команды — от новых матчей к старым, в один день — по id матча
+    _, date_rank = np.unique(np.tile(dates, 2), return_inverse=True)
+    order = np.lexsort((np.tile(game_ids, 2), -date_rank.ravel(), team_id))
+    sorted_teams = team_id[order]
+
+    frame = {
+        'team_id': sorted_teams,
+        'opponent_id': np.concatenate([away_id, home_id])[order],
+        'game_id': np.tile(game_ids, 2)[order],
+        'league_id': np.tile(np.asarray(games['league_id']), 2)[order],
+        'season': np.tile(np.asarray(games['season']), 2)[order],
+        'date': np.tile(dates, 2)[order],
+        'is_home': np.repeat([True, False], n)[order],
+        'team_score': team_score[order],
+        'opponent_score': opponent_score[order],
+        'result': result[order],
+        'rank': _ranks(sorted_teams),
+    }
+    for i, col in enumerate(QUARTERS):
+        frame[col] = team_q[order, i]
+    for i, col in enumerate(OPPONENT_QUARTERS):
+        frame[col] = opponent_q[order, i]
+    return frame
+
+
+def team_frame(rows):
+    """Таблица «команда × матч» из строк производной таблицы team_games
+    (см. aggregates.py), упорядоченных как в team_games()"""
+    columns = [c for c in TEAM_GAME_COLUMNS if c != 'rank' and (not rows or c in rows[0].keys())]
+    frame = _columns([[r[c] for c in columns] for r in rows], columns)
+    frame['rank'] = _ranks(np.asarray(frame['team_id']))
+    return frame
+
+
+def rest_days(frame):
+    """Дни отдыха перед каждым матчем (с предыдущего матча команды); NaN у первого матча"""
+    dates = pd.to_datetime(pd.Series(frame['date'], dtype=object), utc=True, format='ISO8601')
+    seconds = dates.dt.as_unit('s').astype('int64').to_numpy()
+    teams = np.asarray(frame['team_id'])
+    days = np.full(len(teams), np.nan)
+    if len(teams) > 1:
+        # строки команды идут от новых к старым: предыдущий матч — следующая строка
+        same_team = teams[:-1] == teams[1:]
+        days[:-1] = np.where(same_team, (seconds[:-1] - seconds[1:]) // 86400, np.nan)
+    return days
+
+
+def _ranks(sorted_teams):
+    """Номер строки внутри своей команды (с 1) для массива, упорядоченного по команде"""
+    positions = np.arange(len(sorted_teams))
+    group_start = np.ones(len(sorted_teams), dtype=bool)
+    group_start[1:] = sorted_teams[1:] != sorted_teams[:-1]
+    return positions - np.maximum.accumulate(np.where(group_start, positions, 0)) + 1
+
+
+def _quarter_matrices(quarters, game_ids):
+    """Матрицы (матч × четверть 1..4) очков хозяев и гостей; NaN, если четверти нет.
+    Для повторяющейся четверти берётся последняя строка."""
+    home = np.full((len(game_ids), 4), np.nan)
+    away = np.full((len(game_ids), 4), np.nan)
+    quarter_num = np.asarray(quarters['quarter_num'], dtype=np.int64)
+    if len(quarter_num) == 0 or len(game_ids) == 0:
+        return home, away
+
+    position = _positions(game_ids, np.asarray(quarters['game_id']))
+    rows = np.flatnonzero((position >= 0) & (quarter_num >= 1) & (quarter_num <= 4))
+    # последняя строка на (матч, четверть): уникальные ключи по развёрнутому списку
+    keys = position[rows] * 4 + quarter_num[rows] - 1
+    _, last = np.unique(keys[::-1], return_index=True)
+    rows = rows[::-1][last]
+
+    for matrix, column in ((home, 'home_score'), (away, 'away_score')):
+        scores = np.asarray(quarters[column], dtype=float)[rows]
+        matrix[position[rows], quarter_num[rows] - 1] = np.where(np.isnan(scores), 0.0, scores)
+    return home, away
+
+
+def _positions(index, keys):
+    """Позиция каждого ключа в массиве index (значения уникальны) или -1"""
+    if len(index) == 0:
+        return np.full(len(keys), -1)
+    order = np.argsort(index, kind='stable')
+    found = np.searchsorted(index, keys, sorter=order).clip(max=len(index) - 1)
+    position = order[found]
+    return np.where(index[position] == keys, position, -1)
+
+
+def averages_payload(games_count, avg_score, avg_opponent, quarter_means):
+    """Ответ team_averages из посчитанных средних (quarter_means: q1..q4 -> среднее или None)"""
+    if not games_count:
+        return {
+            'games_count': 0,
+            'avg_score': 0,
+            'avg_opponent_score': 0,
+            'avg_total': 0,
+            'quarters': {},
+            'halves': {}
+        }
+
+    avg_total = avg_score + avg_opponent
+
+    quarters_avg = {}
+    for q_key, mean in quarter_means.items():
+        if mean is not None:
+            quarters_avg[q_key] = round(mean, 1)
+        else:
+            quarters_avg[q_key] = 0
+
+    halves_avg = {}
+    if quarters_avg.get('q1', 0) > 0 and quarters_avg.get('q2', 0) > 0:
+        halves_avg['h1'] = round(quarters_avg['q1'] + quarters_avg['q2'], 1)
+    else:
+        halves_avg['h1'] = 0
+
+    if quarters_avg.get('q3', 0) > 0 and quarters_avg.get('q4', 0) > 0:
+        halves_avg['h2'] = round(quarters_avg['q3'] + quarters_avg['q4'], 1)
+    else:
+        halves_avg['h2'] = 0
+
+    return {
+        'games_count': games_count,
+        'avg_score': round(avg_score, 1),
+        'avg_opponent_score': round(avg_opponent, 1),
+        'avg_total': round(avg_total, 1),
+        'quarters': quarters_avg,
+        'halves': halves_avg
+    }
+
+
+def _group_means(team_idx, groups, values):
+    """Суммы, число непустых значений и размер групп по индексам team_idx (NaN пропускаются)"""
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    sums = np.stack([np.bincount(team_idx, weights=filled[:, c], minlength=groups) for c in range(values.shape[1])], axis=1)
+    counts = np.stack([np.bincount(team_idx, weights=present[:, c], minlength=groups) for c in range(values.shape[1])], axis=1)
+    return sums, counts, np.bincount(team_idx, minlength=groups)
+
+
+def window_averages(frame, windows, team_ids=None):
+    """Средние за последние N игр со счётом для всех команд и окон сразу.
+    Как в /api/team_averages, игры без итогового счёта в окно не попадают:
+    окно 5 — пять последних игр, где известен счёт. У каждой команды frame
+    должен содержать не меньше max(windows) таких игр подряд от последней
+    (или всю её историю); строки упорядочены по команде, как в team_games().
+    Возвращает {team_id: {'5': {...}, '10': {...}}} в формате /api/team_averages."""
+    if team_ids is None:
+        team_ids = np.unique(frame['team_id']).tolist()
+    team_ids = list(team_ids)
+
+    values = np.column_stack([frame[c] for c in ('team_score', 'opponent_score') + QUARTERS]).astype(float)
+    position = _positions(np.asarray(team_ids), np.asarray(frame['team_id']))
+    usable = ~np.isnan(values[:, 0]) & ~np.isnan(values[:, 1]) & (position >= 0)
+    # номер игры со счётом у своей команды: окно отсчитывается только по ним
+    ranks = np.zeros(len(usable), dtype=np.int64)
+    ranks[usable] = _ranks(np.asarray(frame['team_id'])[usable])
+
+    result = {team_id: {} for team_id in team_ids}
+    for n in windows:
+        mask = usable & (ranks <= n)
+        sums, counts, sizes = _group_means(position[mask], len(team_ids), values[mask])
+        for i, team_id in enumerate(team_ids):
+            if not sizes[i]:
+                result[team_id][str(n)] = averages_payload(0, 0, 0, {})
+                continue
+            quarter_means = {
+                q: float(sums[i, 2 + k] / counts[i, 2 + k]) if counts[i, 2 + k] else None
+                for k, q in enumerate(QUARTERS)
+            }
+            result[team_id][str(n)] = averages_payload(
+                int(sizes[i]),
+                float(sums[i, 0] / sizes[i]),
+                float(sums[i, 1] / sizes[i]),
+                quarter_means
+            )
+    return result
+
+
+def h2h_averages(frame, team1_id):
+    """Средние по личным встречам с точки зрения team1.
+    frame — таблица «команда × матч», построенная только из матчей этой пары."""
+    rows = np.asarray(frame['team_id']) == team1_id
+    sums, counts, sizes = _group_means(np.zeros(int(rows.sum()), dtype=np.int64), 1, _h2h_values(frame, rows))
+    return h2h_payload(sums[0], counts[0], int(sizes[0]))
+
+
+def pairs_h2h_averages(frame, pairs):
+    """Средние по личным встречам для многих пар сразу.
+    pairs — (team1_id, team2_id, season); frame может содержать любые матчи.
+    Возвращает {(team1_id, team2_id, season): {...}} в формате /api/h2h_averages."""
+    pairs = list(pairs)
+    if not pairs:
+        return {}
+    season_codes, codes = np.unique(
+        np.concatenate([np.asarray([p[2] for p in pairs], dtype=object), np.asarray(frame['season'], dtype=object)]),
+        return_inverse=True
+    )
+    codes = codes.ravel()
+    teams = np.asarray([p[:2] for p in pairs], dtype=np.int64).reshape(-1, 2)
+    pair_keys = _pair_keys(teams[:, 0], teams[:, 1], codes[:len(pairs)], len(season_codes))
+    row_keys = _pair_keys(np.asarray(frame['team_id'], dtype=np.int64), np.asarray(frame['opponent_id'], dtype=np.int64),
+                          codes[len(pairs):], len(season_codes))
+
+    position = _positions(pair_keys, row_keys)
+    rows = position >= 0
+    sums, counts, sizes = _group_means(position[rows], len(pairs), _h2h_values(frame, rows))
+    return {pair: h2h_payload(sums[i], counts[i], int(sizes[i])) for i, pair in enumerate(pairs)}
+
+
+def _pair_keys(team1_ids, team2_ids, season_codes, seasons):
+    """Целочисленный ключ (команда, соперник, сезон) для сопоставления строк с парами"""
+    return (team1_ids * (1 << 24) + team2_ids) * seasons + season_codes
+
+
+def _h2h_values(frame, rows):
+    """Счёт и четверти обеих сторон для выбранных строк: матрица (строка × 10)"""
+    columns = ('team_score', 'opponent_score') + QUARTERS + OPPONENT_QUARTERS
+    return np.column_stack([np.asarray(frame[c], dtype=float)[rows] for c in columns]).reshape(-1, len(columns))
+
+
+def h2h_payload(sums, counts, games_count):
+    """Ответ h2h_averages из сумм и числа непустых значений по колонкам _h2h_values
+    (h2h_payload((), (), 0) — пустой ответ)"""
+    if not games_count:
+        return {
+            'games_count': 0,
+            'team1_avg': 0,
+            'team2_avg': 0,
+            'team1_quarters': {},
+            'team2_quarters': {}
+        }
+
+    def mean(col):
+        return round(float(sums[col] / counts[col]), 1) if counts[col] else 0
+
+    return {
+        'games_count': games_count,
+        'team1_avg': mean(0),
+        'team2_avg': mean(1),
+        'team1_quarters': {q: mean(2 + k) for k, q in enumerate(QUARTERS)},
+        'team2_quarters': {q: mean(6 + k) for k, q in enumerate(QUARTERS)}
+    }
+
+
+def flip_h2h(averages):
+    """Ответ h2h_averages с точки зрения второй команды пары"""
+    flipped = dict(averages)
+    flipped['team1_avg'], flipped['team2_avg'] = averages['team2_avg'], averages['team1_avg']
+    flipped['team1_quarters'], flipped['team2_quarters'] = averages['team2_quarters'], averages['team1_quarters']
+    return flipped